@@ -0,0 +1,167 @@
+import queue
+import threading
+import time
+from collections import deque
+
+
+# =========================
+# Допуск по классам: приоритет, вес, дедлайн
+# =========================
+class Late(Exception):
+    """Задача прождала в очереди дольше дедлайна своего класса."""
+
+
+class AdmissionClass:
+    """
+    priority — строгий порядок (меньше — раньше): пока есть задачи
+    с меньшим priority, остальные ждут;
+    weight — доля среди классов с одинаковым priority (3 и 1 — три
+    задачи одного на одну другого, если ждут обе);
+    deadline — секунд ожидания в очереди, дальше задача «опоздала» (0 — без дедлайна).
+    """
+
+    __slots__ = ("name", "priority", "weight", "deadline", "items", "pass_")
+
+    def __init__(self, name: str, priority: int = 0, weight: float = 1.0, deadline: float = 0.0):
+        self.name = name
+        self.priority = priority
+        self.weight = max(weight, 0.001)
+        self.deadline = deadline
+        self.items = None
+        self.pass_ = 0.0
+
+
+class Ticket:
+    __slots__ = ("item", "cls", "key", "enqueued", "waited", "late")
+
+    def __init__(self, item, cls: str, key=None):
+        self.item = item
+        self.cls = cls
+        self.key = key
+        self.enqueued = time.monotonic()
+        self.waited = 0.0
+        self.late = False
+
+
+class AdmissionQueue:
+    """
+    Очередь из нескольких классов. get() отдаёт следующую задачу:
+    из непустых классов с наименьшим priority — по stride scheduling
+    (у каждого класса «пройденный путь» pass_, растёт на 1/weight за
+    задачу, берём класс с наименьшим), внутри класса — FIFO.
+
+    put(..., key=k) — задачи одного ключа (пользователя) строго по порядку
+    постановки, независимо от классов: в классе стоит только первая задача
+    ключа, следующая встаёт в очередь своего класса, когда первую забрали.
+    Приоритеты и веса действуют между ключами, не внутри.
+
+    Опоздавшие (ждали дольше deadline) тоже отдаются, с ticket.late=True:
+    ответить «перегружен» вместо работы — дело потребителя.
+    observe(cls, waited, late) — время ожидания в метрики.
+    """
+
+    def __init__(self, classes, maxsize: int = 0, default: str = None, observe=None):
+        self._classes = {}
+        for c in classes:
+            c = AdmissionClass(c.name, c.priority, c.weight, c.deadline)
+            c.items = deque()
+            self._classes[c.name] = c
+        if not self._classes:
+            raise ValueError("no admission classes")
+        self.default = default or next(iter(self._classes))
+        self.maxsize = maxsize
+        self.observe = observe
+        self._size = 0
+        self._keyed = {}  # key -> deque задач, [0] — стоит в очереди своего класса
+        self._closed = False
+        self._cv = threading.Condition()
+
+    def put(self, item, cls: str = None, key=None):
+        """Не блокирует: queue.Full, если очередь заполнена."""
+        c = self._classes.get(cls) or self._classes[self.default]
+        with self._cv:
+            if self.maxsize and self._size >= self.maxsize:
+                raise queue.Full()
+            ticket = Ticket(item, c.name, key)
+            self._size += 1
+            if key is not None:
+                waiting = self._keyed.get(key)
+                if waiting:
+                    # ждёт за предыдущими задачами того же ключа
+                    waiting.append(ticket)
+                    return
+                self._keyed[key] = deque((ticket,))
+            self._push(c, ticket)
+            self._cv.notify()
+
+    def _push(self, c: AdmissionClass, ticket: Ticket):
+        if not c.items:
+            # класс простаивал — не копит «кредит» за время простоя
+            busy = [o.pass_ for o in self._classes.values() if o.items and o.priority == c.priority]
+            if busy:
+                c.pass_ = max(c.pass_, min(busy))
+        c.items.append(ticket)
+
+    def _pick(self) -> AdmissionClass:
+        best = None
+        for c in self._classes.values():
+            if not c.items:
+                continue
+            if best is None or (c.priority, c.pass_) < (best.priority, best.pass_):
+                best = c
+        return best
+
+    def get(self, timeout: float = None):
+        """Ticket или None (очередь закрыта и пуста / вышел timeout)."""
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cv:
+            while not self._size:
+                if self._closed:
+                    return None
+                left = None if end is None else end - time.monotonic()
+                if left is not None and left <= 0:
+                    return None
+                self._cv.wait(left)
+            c = self._pick()
+            ticket = c.items.popleft()
+            c.pass_ += 1.0 / c.weight
+            self._size -= 1
+            if ticket.key is not None:
+                waiting = self._keyed[ticket.key]
+                waiting.popleft()
+                if waiting:
+                    self._push(self._classes[waiting[0].cls], waiting[0])
+                else:
+                    del self._keyed[ticket.key]
+        ticket.waited = time.monotonic() - ticket.enqueued
+        ticket.late = bool(c.deadline) and ticket.waited > c.deadline
+        if self.observe is not None:
+            self.observe(ticket.cls, ticket.waited, ticket.late)
+        return ticket
+
+    def close(self, drop: bool = False):
+        """get() вернёт None, когда очередь опустеет; drop=True — выбросить ожидающие (их и вернём)."""
+        dropped = []
+        with self._cv:
+            self._closed = True
+            if drop:
+                for c in self._classes.values():
+                    dropped.extend(t.item for t in c.items if t.key is None)
+                    c.items.clear()
+                for waiting in self._keyed.values():
+                    dropped.extend(t.item for t in waiting)
+                self._keyed.clear()
+                self._size = 0
+            self._cv.notify_all()
+        return dropped
+
+    def qsize(self) -> int:
+        return self._size
+
+    def depth_by_class(self) -> dict:
+        with self._cv:
+            res = {name: sum(t.key is None for t in c.items) for name, c in self._classes.items()}
+            for waiting in self._keyed.values():
+                for t in waiting:
+                    res[t.cls] += 1
+        return res
@@ -0,0 +1,207 @@
+import threading
+import time
+
+from admission import AdmissionClass, AdmissionQueue, Late
+
+
+# =========================
+# AI worker pool
+# =========================
+class Busy(Exception):
+    """Очередь AI заполнена — просим пользователя повторить позже."""
+
+
+class AIJob:
+    __slots__ = ("user_id", "fn", "on_done", "on_error", "on_cancel",
+                 "cancelled", "submitted_ts", "started_ts", "trace")
+
+    def __init__(self, user_id, fn, on_done, on_error=None, on_cancel=None):
+        self.user_id = user_id
+        self.fn = fn
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_cancel = on_cancel
+        self.cancelled = False
+        self.submitted_ts = time.monotonic()
+        self.started_ts = 0.0
+        self.trace = None
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class AIPool:
+    """
+    Отдельный пул потоков под OpenAI: медленные completion'ы больше
+    не держат потоки telebot, кнопки и /profile отвечают сразу.
+
+    - max_queue: сколько задач (в очереди + в работе) держим всего,
+      дальше submit() бросает Busy;
+    - per_user: сколько задач одного пользователя одновременно; новый
+      вопрос сверх лимита отменяет самый старый (его ответ не отправится);
+    - результат доставляется колбэком on_done(result) из потока пула;
+    - классы (admission.AdmissionClass): submit(..., cls="ai_pro") — PRO
+      получает больше свободных потоков, чем free; задача, прождавшая
+      дольше дедлайна класса, не выполняется — on_error(Late()).
+
+    fn(job) получает задачу и может сам проверять job.cancelled
+    (например, при стриминге), чтобы бросить работу пораньше.
+
+    С tracer (tracing.Tracer) задача продолжает трассу апдейта, который
+    её поставил: спан "ai_queue" (ожидание) и "ai_job" (fn + доставка).
+    """
+
+    def __init__(self, workers: int = 8, max_queue: int = 64, per_user: int = 1,
+                 classes=None, observe=None, tracer=None):
+        self.workers = workers
+        self.tracer = tracer
+        self.max_queue = max_queue
+        self.per_user = max(1, per_user)
+        self._queue = AdmissionQueue(classes or [AdmissionClass("default")], observe=observe)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._inflight = {}  # user_id -> [AIJob] (от старых к новым)
+        self._count = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.completed = 0
+        self.failed = 0
+        self.late = 0
+
+    def depth(self) -> int:
+        return self._count
+
+    def submit(self, user_id: int, fn, on_done, on_error=None, on_cancel=None, cls: str = None) -> AIJob:
+        job = AIJob(user_id, fn, on_done, on_error, on_cancel)
+        superseded = []
+        with self._lock:
+            if self._count >= self.max_queue:
+                self.rejected += 1
+                raise Busy()
+            jobs = self._inflight.setdefault(user_id, [])
+            while len(jobs) >= self.per_user:
+                old = jobs.pop(0)
+                old.cancel()
+                superseded.append(old)
+            jobs.append(job)
+            self._count += 1
+        for old in superseded:
+            self._notify_cancel(old)
+        if self.tracer is not None:
+            job.trace = self.tracer.hold()
+        if not self._threads:
+            self._start()
+        self._queue.put(job, cls)
+        return job
+
+    def cancel_user(self, user_id: int):
+        with self._lock:
+            jobs = self._inflight.pop(user_id, [])
+        for job in jobs:
+            job.cancel()
+            self._notify_cancel(job)
+
+    def _notify_cancel(self, job: AIJob):
+        self.cancelled += 1
+        if job.on_cancel:
+            try:
+                job.on_cancel()
+            except Exception as e:
+                print(f"⚠️ ai-pool on_cancel: {e}")
+
+    def _release(self, job: AIJob):
+        with self._lock:
+            self._count -= 1
+            jobs = self._inflight.get(job.user_id)
+            if jobs and job in jobs:
+                jobs.remove(job)
+                if not jobs:
+                    del self._inflight[job.user_id]
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"ai-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _worker(self):
+        while True:
+            ticket = self._queue.get()
+            if ticket is None:
+                return
+            job = ticket.item
+            if job.trace is not None:
+                self.tracer.record(job.trace, "ai_queue", ticket.enqueued, ticket.enqueued + ticket.waited,
+                                   cls=ticket.cls, late=ticket.late)
+                with self.tracer.resume(job.trace), self.tracer.span("ai_job", cls=ticket.cls):
+                    self._handle(job, ticket.late)
+            else:
+                self._handle(job, ticket.late)
+
+    def _handle(self, job: AIJob, late: bool):
+        if late:
+            self._shed(job)
+        else:
+            self._run(job)
+
+    def _shed(self, job: AIJob):
+        # ответ пришёл бы слишком поздно — не тратим на него OpenAI
+        try:
+            if job.cancelled:
+                return
+            self.late += 1
+            if job.on_error:
+                job.on_error(Late())
+        except Exception as e:
+            print(f"⚠️ ai-pool delivery: {e}")
+        finally:
+            self._release(job)
+
+    def _run(self, job: AIJob):
+        try:
+            if job.cancelled:
+                return
+            job.started_ts = time.monotonic()
+            try:
+                result = job.fn(job)
+            except Exception as e:
+                if job.cancelled:
+                    return
+                self.failed += 1
+                if job.on_error:
+                    job.on_error(e)
+                return
+            if job.cancelled:
+                return
+            self.completed += 1
+            job.on_done(result)
+        except Exception as e:
+            # ошибка доставки не должна ронять поток пула
+            print(f"⚠️ ai-pool delivery: {e}")
+        finally:
+            self._release(job)
+
+    def shutdown(self, wait: bool = True):
+        # ждущие в очереди выбрасываем, начатые дорабатывают
+        for job in self._queue.close(drop=True):
+            if job.trace is not None:
+                self.tracer.release(job.trace)
+            self._release(job)
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._count,
+            "max_queue": self.max_queue,
+            "workers": self.workers,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "late": self.late,
+        }
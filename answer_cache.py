@@ -0,0 +1,276 @@
+import re
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+
+from storage import WriteBehind
+
+
+# =========================
+# Near-duplicate кэш ответов (MinHash + LSH)
+# =========================
+_MERSENNE = (1 << 61) - 1
+_NON_WORD = re.compile(r"[^\w]+", re.UNICODE)
+# вежливые/пустые слова не меняют смысл вопроса; «не», «без» и т.п. сюда не входят
+_FILLER = frozenset(("пожалуйста", "плиз", "please", "ну", "вот", "привет", "здравствуйте"))
+
+
+def normalize(text: str) -> str:
+    """«Сделай резюме для Junior Python!» -> «сделай резюме для junior python»."""
+    text = text.lower().replace("ё", "е")
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def word_set(norm: str) -> frozenset:
+    """Слова нормализованного вопроса без вежливостей: порядок и повторы не важны."""
+    return frozenset(w for w in norm.split() if w not in _FILLER)
+
+
+def shingles(norm: str, n: int = 3):
+    padded = f" {norm} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class MinHasher:
+    """num_perm хэш-функций вида (a*x + b) mod p поверх crc32 шингла."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        # детерминированные коэффициенты: сигнатуры из SQLite остаются валидными
+        x = seed
+        coeffs = []
+        for _ in range(num_perm):
+            x = (x * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            a = (x >> 3) % (_MERSENNE - 1) + 1
+            x = (x * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            b = (x >> 3) % _MERSENNE
+            coeffs.append((a, b))
+        self.coeffs = coeffs
+        self.num_perm = num_perm
+
+    def signature(self, norm: str) -> array:
+        hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles(norm)]
+        return array("Q", (min((a * h + b) % _MERSENNE for h in hashes) for a, b in self.coeffs))
+
+
+def similarity(sig1, sig2) -> float:
+    """Оценка Жаккара по совпадающим позициям MinHash."""
+    same = sum(1 for x, y in zip(sig1, sig2) if x == y)
+    return same / len(sig1)
+
+
+class _Entry:
+    __slots__ = ("id", "tier", "norm", "sig", "answer", "created_ts", "last_hit_ts", "hits")
+
+    def __init__(self, id, tier, norm, sig, answer, created_ts, last_hit_ts, hits):
+        self.id = id
+        self.tier = tier
+        self.norm = norm
+        self.sig = sig
+        self.answer = answer
+        self.created_ts = created_ts
+        self.last_hit_ts = last_hit_ts
+        self.hits = hits
+
+
+class AnswerCache:
+    """
+    Кэш ответов на почти одинаковые вопросы, без внешних эмбеддингов:
+    нормализованный текст -> символьные 3-граммы -> MinHash (64) ->
+    LSH (bands x rows) для кандидатов -> проверка по threshold ->
+    точная проверка по множеству слов (word_set).
+
+    Похожесть по символам не видит смысл: «junior python» и «senior python»,
+    «не хочу» и «хочу» отличаются парой символов. Поэтому кандидат отдаётся,
+    только если слова вопросов совпадают (кроме порядка, повторов и
+    вежливостей) — иначе это чужой ответ на другой вопрос.
+
+    Отдельный пул на каждый tier ("pro"/"free"), LRU + TTL, записи
+    лежат в answer_cache (SQLite), индекс строится в памяти при старте.
+    """
+
+    def __init__(self, db, threshold: float = 0.95, max_entries: int = 5000,
+                 ttl: float = 72 * 3600, num_perm: int = 64, bands: int = 16):
+        assert num_perm % bands == 0
+        self.db = db
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._lock = threading.Lock()
+        self._entries = {}   # tier -> OrderedDict(id -> _Entry), LRU порядок
+        self._exact = {}     # (tier, norm) -> id
+        self._buckets = {}   # (tier, band, band_hash) -> set(id)
+        self._touch = WriteBehind(
+            db, "UPDATE answer_cache SET last_hit_ts=?, hits=? WHERE id=?",
+            flush_interval=30, max_pending=1000, name="answer-cache-hits",
+        )
+        self.hits = 0
+        self.near_hits = 0
+        self.near_rejected = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---- индекс ----
+    def _band_keys(self, tier, sig):
+        r = self.rows
+        return [(tier, i, hash(tuple(sig[i * r:(i + 1) * r]))) for i in range(self.bands)]
+
+    def _index(self, e: _Entry):
+        self._entries.setdefault(e.tier, OrderedDict())[e.id] = e
+        self._exact[(e.tier, e.norm)] = e.id
+        for key in self._band_keys(e.tier, e.sig):
+            self._buckets.setdefault(key, set()).add(e.id)
+
+    def _unindex(self, e: _Entry):
+        self._entries.get(e.tier, {}).pop(e.id, None)
+        if self._exact.get((e.tier, e.norm)) == e.id:
+            del self._exact[(e.tier, e.norm)]
+        for key in self._band_keys(e.tier, e.sig):
+            ids = self._buckets.get(key)
+            if ids:
+                ids.discard(e.id)
+                if not ids:
+                    del self._buckets[key]
+
+    # ---- жизненный цикл ----
+    def init_table(self):
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache(
+                id INTEGER PRIMARY KEY,
+                tier TEXT,
+                norm TEXT,
+                sig BLOB,
+                answer TEXT,
+                created_ts INTEGER,
+                last_hit_ts INTEGER,
+                hits INTEGER DEFAULT 0
+            )
+        """)
+        now = int(time.time())
+        self.db.execute("DELETE FROM answer_cache WHERE created_ts < ?", (now - int(self.ttl),))
+        rows = self.db.all("""
+            SELECT id, tier, norm, sig, answer, created_ts, last_hit_ts, hits
+            FROM answer_cache ORDER BY last_hit_ts
+        """)
+        with self._lock:
+            self._entries, self._exact, self._buckets = {}, {}, {}
+            for id, tier, norm, sig_blob, answer, created_ts, last_hit_ts, hits in rows:
+                sig = array("Q")
+                sig.frombytes(sig_blob)
+                if len(sig) != self.hasher.num_perm:
+                    continue
+                self._index(_Entry(id, tier, norm, sig, answer, created_ts, last_hit_ts, hits))
+        self._touch.start()
+
+    def stop(self):
+        self._touch.stop()
+
+    def _expired(self, e: _Entry, now: float) -> bool:
+        return now - e.created_ts > self.ttl
+
+    def _drop(self, e: _Entry):
+        self._unindex(e)
+        self.evictions += 1
+        return e.id
+
+    # ---- API ----
+    def lookup(self, tier: str, text: str):
+        """Ответ на такой же/почти такой же вопрос или None."""
+        norm = normalize(text)
+        if not norm:
+            return None
+        now = time.time()
+        dead = []
+        found = None
+        # сигнатуру считаем вне lock (это самая дорогая часть)
+        sig = None if (tier, norm) in self._exact else self.hasher.signature(norm)
+        with self._lock:
+            lru = self._entries.get(tier)
+            if lru:
+                eid = self._exact.get((tier, norm))
+                if eid is not None:
+                    found = lru[eid]
+                    exact = True
+                else:
+                    exact = False
+                    if sig is None:
+                        sig = self.hasher.signature(norm)
+                    cand = set()
+                    for key in self._band_keys(tier, sig):
+                        cand |= self._buckets.get(key, set())
+                    best = 0.0
+                    words = None
+                    for cid in cand:
+                        e = lru[cid]
+                        score = similarity(sig, e.sig)
+                        if score < self.threshold or score <= best:
+                            continue
+                        if words is None:
+                            words = word_set(norm)
+                        if word_set(e.norm) != words:
+                            self.near_rejected += 1
+                            continue
+                        best, found = score, e
+                if found is not None and self._expired(found, now):
+                    dead.append(self._drop(found))
+                    found = None
+                if found is not None:
+                    lru.move_to_end(found.id)
+                    found.last_hit_ts = int(now)
+                    found.hits += 1
+                    self.hits += 1
+                    if not exact:
+                        self.near_hits += 1
+            if found is None:
+                self.misses += 1
+        if dead:
+            self._delete(dead)
+        if found is None:
+            return None
+        self._touch.put(found.id, (found.last_hit_ts, found.hits, found.id))
+        return found.answer
+
+    def put(self, tier: str, text: str, answer: str):
+        norm = normalize(text)
+        if not norm or not answer:
+            return
+        sig = self.hasher.signature(norm)
+        now = int(time.time())
+        cur = self.db.execute("""
+            INSERT INTO answer_cache(tier, norm, sig, answer, created_ts, last_hit_ts, hits)
+            VALUES(?,?,?,?,?,?,0)
+        """, (tier, norm, sig.tobytes(), answer, now, now))
+        e = _Entry(cur.lastrowid, tier, norm, sig, answer, now, now, 0)
+        dead = []
+        with self._lock:
+            old = self._exact.get((tier, norm))
+            if old is not None:
+                dead.append(self._drop(self._entries[tier][old]))
+            self._index(e)
+            lru = self._entries[tier]
+            while len(lru) > self.max_entries:
+                _, oldest = next(iter(lru.items()))
+                dead.append(self._drop(oldest))
+        if dead:
+            self._delete(dead)
+
+    def _delete(self, ids):
+        self.db.executemany("DELETE FROM answer_cache WHERE id=?", [(i,) for i in ids])
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": {t: len(v) for t, v in self._entries.items()},
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "near_rejected": self.near_rejected,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
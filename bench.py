@@ -0,0 +1,398 @@
+"""
+Офлайн-бенчмарк bot.py: без Telegram и без OpenAI.
+
+    python bench.py --users 200 --questions 2 --ai-latency 0.3
+
+- апдейты синтетические (/start, кнопки, 8 шагов теста, вопросы);
+- исходящие вызовы Telegram перехватываются (apihelper.CUSTOM_REQUEST_SENDER);
+- OpenAI смотрит в локальный stub-сервер (OPENAI_BASE_URL) с настраиваемой
+  задержкой и SSE-стримингом;
+- SQL считается через sqlite3 trace callback на каждом соединении.
+
+База — во временном каталоге (DB_PATH), data.db не трогается; движок
+пользователей — --storage sqlite | sharded | memory.
+"""
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# =========================
+# Stub OpenAI (chat.completions, обычный ответ и SSE)
+# =========================
+class _StubHandler(BaseHTTPRequestHandler):
+    server_version = "StubOpenAI"
+
+    def do_POST(self):
+        srv = self.server
+        length = int(self.headers.get("Content-Length", "0"))
+        req = json.loads(self.rfile.read(length) or b"{}")
+        with srv.lock:
+            srv.requests += 1
+        # время до первого токена
+        time.sleep(srv.latency)
+        words = [f"слово{i}" for i in range(srv.tokens)]
+        usage = {"prompt_tokens": 60, "completion_tokens": srv.tokens, "total_tokens": 60 + srv.tokens}
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": req.get("model", "stub")}
+
+        if not req.get("stream"):
+            time.sleep(srv.token_delay * srv.tokens)
+            body = json.dumps({
+                **base, "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": usage,
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def event(obj):
+            self.wfile.write(b"data: " + json.dumps(obj).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        try:
+            for w in words:
+                event({**base, "object": "chat.completion.chunk",
+                       "choices": [{"index": 0, "delta": {"content": w + " "}, "finish_reason": None}]})
+                if srv.token_delay:
+                    time.sleep(srv.token_delay)
+            event({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # клиент закрыл стрим (вопрос отменён новым)
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubOpenAI(ThreadingHTTPServer):
+    """Отвечает на /v1/chat/completions: latency до первого токена, потом tokens токенов по token_delay."""
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.3, tokens: int = 120, token_delay: float = 0.0,
+                 host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _StubHandler)
+        self.latency = latency
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="stub-openai", daemon=True).start()
+        return self
+
+
+# =========================
+# Fake Telegram (исходящие вызовы)
+# =========================
+class _Resp:
+    status_code = 200
+    reason = "OK"
+
+    def __init__(self, result):
+        self.text = json.dumps({"ok": True, "result": result})
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeTelegram:
+    """Подменяет HTTP-вызовы telebot: считает методы, отдаёт правдоподобные Message."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1000)
+
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        name = url.rsplit("/", 1)[-1]
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        params = params or {}
+        if name in ("sendMessage", "editMessageText"):
+            return _Resp({
+                "message_id": int(params.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "text": params.get("text", ""),
+            })
+        if name == "getMe":
+            return _Resp({"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"})
+        return _Resp(True)
+
+    def install(self):
+        from telebot import apihelper
+        apihelper.CUSTOM_REQUEST_SENDER = self
+        return self
+
+
+# =========================
+# Синтетические апдейты
+# =========================
+class UpdateFactory:
+    def __init__(self, first_user_id: int = 10_000_000):
+        self.first_user_id = first_user_id
+        self._ids = itertools.count(1)
+
+    def _user(self, uid: int) -> dict:
+        return {"id": uid, "is_bot": False, "first_name": f"User{uid}", "username": f"user{uid}"}
+
+    def message(self, uid: int, text: str) -> dict:
+        msg = {
+            "message_id": next(self._ids), "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"}, "from": self._user(uid), "text": text,
+        }
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._ids), "message": msg}
+
+    def callback(self, uid: int, data: str) -> dict:
+        return {"update_id": next(self._ids), "callback_query": {
+            "id": str(next(self._ids)), "chat_instance": "bench", "data": data, "from": self._user(uid),
+            "message": {"message_id": 1, "date": int(time.time()),
+                        "chat": {"id": uid, "type": "private"}, "text": "..."},
+        }}
+
+    def session(self, uid: int, questions: int, steps: int, buckets):
+        """Один пользователь: старт, профиль, тест целиком, вопросы. [(kind, raw_update)]"""
+        out = [
+            ("start", self.message(uid, "/start")),
+            ("button", self.message(uid, "👤 Профиль")),
+            ("button", self.message(uid, "🧪 Тест")),
+        ]
+        for step in range(steps):
+            out.append(("test", self.callback(uid, f"test:{step}:{buckets[(uid + step) % len(buckets)]}")))
+        out.append(("button", self.message(uid, "💼 Карьера")))
+        for i in range(questions):
+            out.append(("question", self.message(uid, f"Как подготовиться к собеседованию №{i} на позицию {uid % 17}?")))
+        return out
+
+
+def interleave(sessions):
+    """Апдейты разных пользователей вперемешку, порядок внутри пользователя сохраняется."""
+    res = []
+    for batch in itertools.zip_longest(*sessions):
+        res.extend(x for x in batch if x is not None)
+    return res
+
+
+# =========================
+# Окружение до импорта bot
+# =========================
+def prepare_env(base_url: str, db_dir: str, real_limits: bool = False, extra=None):
+    env = {
+        "TELEGRAM_TOKEN": "1:bench",
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": base_url,
+        "DB_PATH": os.path.join(db_dir, "bench.db"),
+        "BOT_MODE": "polling",
+        "METRICS_PORT": "0",
+    }
+    if not real_limits:
+        # меряем свой код, а не лимиты Telegram/OpenAI
+        env.update({
+            "OUTBOX_GLOBAL_RATE": "100000", "OUTBOX_CHAT_RATE": "100000", "OUTBOX_CHAT_BURST": "100000",
+            "AI_RATE_FREE_PER_MIN": "100000", "AI_RATE_PRO_PER_MIN": "100000",
+            "AI_BURST_FREE": "1000", "AI_BURST_PRO": "1000",
+            "AI_DAILY_TOKENS_FREE": "0", "AI_DAILY_TOKENS_PRO": "0",
+            "AI_MAX_QUEUE": "100000",
+        })
+    env.update(extra or {})
+    os.environ.update(env)
+
+
+class StatementCounter:
+    """sqlite3 trace callback: всего и в текущем потоке (для подсчёта на апдейт)."""
+
+    def __init__(self):
+        self.total = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def hook(self, con):
+        con.set_trace_callback(self._trace)
+
+    def _trace(self, sql):
+        self._local.n = getattr(self._local, "n", 0) + 1
+        with self._lock:
+            self.total += 1
+
+    def thread_count(self) -> int:
+        return getattr(self._local, "n", 0)
+
+
+def wait_idle(B, done, expected: int, timeout: float):
+    end = time.time() + timeout
+    while time.time() < end:
+        if done() >= expected and not B.ai_pool.depth() and not B.out.depth():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+# =========================
+# Прогон
+# =========================
+def run(args) -> dict:
+    stub = StubOpenAI(args.ai_latency, args.ai_tokens, args.ai_token_delay).start()
+    tmp = tempfile.mkdtemp(prefix="capitalmind-bench-")
+    prepare_env(stub.base_url, tmp, real_limits=args.real_limits, extra={
+        "AI_STREAM": "1" if args.stream else "0",
+        "ANSWER_CACHE": "1" if args.answer_cache else "0",
+        "UPDATE_WORKERS": str(args.workers),
+        "STORAGE": args.storage,
+        "STORAGE_SHARDS": str(args.shards),
+    })
+    tg = FakeTelegram(args.tg_latency).install()
+
+    import telebot
+    import bot as B
+    from webhook import UpdateDispatcher
+
+    stmts = StatementCounter()
+    B.db.on_connect(stmts.hook)
+    if B.STORAGE != "sqlite":
+        B.user_repo.on_connect(stmts.hook)
+    B.startup(warm=False)
+    B.bot.threaded = False
+
+    factory = UpdateFactory()
+    sessions = [
+        factory.session(factory.first_user_id + i, args.questions, len(B.TEST_QUESTIONS), B.BUCKETS)
+        for i in range(args.users)
+    ]
+    stream = interleave(sessions)
+    kinds = {}
+    updates = []
+    for kind, raw in stream:
+        kinds[raw["update_id"]] = kind
+        updates.append(telebot.types.Update.de_json(raw))
+
+    lock = threading.Lock()
+    lat = {}        # kind -> [секунды]
+    per_update = {}  # kind -> [SQL-запросов]
+    done = [0]
+
+    def handle(update):
+        kind = kinds[update.update_id]
+        before = stmts.thread_count()
+        t0 = time.perf_counter()
+        try:
+            B.bot.process_new_updates([update])
+        finally:
+            dt = time.perf_counter() - t0
+            n = stmts.thread_count() - before
+            with lock:
+                lat.setdefault(kind, []).append(dt)
+                per_update.setdefault(kind, []).append(n)
+                done[0] += 1
+
+    dispatcher = UpdateDispatcher(handle, workers=args.workers, max_queue=len(updates) + 1)
+    dispatcher.start()
+    t0 = time.perf_counter()
+    for u in updates:
+        while not dispatcher.submit(u):
+            time.sleep(0.001)
+    drained = wait_idle(B, lambda: done[0], len(updates), args.timeout)
+    elapsed = time.perf_counter() - t0
+    dispatcher.stop()
+    B.shutdown()
+
+    all_lat = [x for v in lat.values() for x in v]
+    in_handlers = sum(sum(v) for v in per_update.values())
+    report = {
+        "updates": len(updates),
+        "drained": drained,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(len(updates) / elapsed, 1) if elapsed else 0.0,
+        "handler_p50_ms": round(percentile(all_lat, 0.5) * 1000, 3),
+        "handler_p99_ms": round(percentile(all_lat, 0.99) * 1000, 3),
+        "db_statements_per_update": round(in_handlers / len(updates), 2) if updates else 0.0,
+        "db_statements_total": stmts.total,
+        "by_kind": {
+            kind: {
+                "n": len(v),
+                "p50_ms": round(percentile(v, 0.5) * 1000, 3),
+                "p99_ms": round(percentile(v, 0.99) * 1000, 3),
+                "db_per_update": round(sum(per_update[kind]) / len(v), 2),
+            }
+            for kind, v in sorted(lat.items())
+        },
+        "telegram_calls": dict(sorted(tg.calls.items())),
+        "openai_requests": stub.requests,
+        "ai_pool": B.ai_pool.stats(),
+    }
+    stub.shutdown()
+    return report
+
+
+def print_report(r: dict):
+    print(f"updates: {r['updates']} за {r['elapsed_s']}s -> {r['updates_per_s']} updates/s"
+          + ("" if r["drained"] else "  (НЕ дождались очередей, см. --timeout)"))
+    print(f"handler latency: p50 {r['handler_p50_ms']} ms, p99 {r['handler_p99_ms']} ms")
+    print(f"SQL: {r['db_statements_per_update']} на апдейт в хендлерах, всего {r['db_statements_total']}")
+    print(f"{'kind':<10}{'n':>7}{'p50 ms':>10}{'p99 ms':>10}{'sql/upd':>9}")
+    for kind, k in r["by_kind"].items():
+        print(f"{kind:<10}{k['n']:>7}{k['p50_ms']:>10}{k['p99_ms']:>10}{k['db_per_update']:>9}")
+    print("telegram:", ", ".join(f"{m}={n}" for m, n in r["telegram_calls"].items()))
+    print(f"openai: {r['openai_requests']} запросов, ai_pool: {r['ai_pool']}")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Офлайн-бенчмарк CapitalMindBot")
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--questions", type=int, default=2, help="вопросов к AI на пользователя")
+    p.add_argument("--workers", type=int, default=8, help="потоков обработки апдейтов")
+    p.add_argument("--ai-latency", type=float, default=0.3, help="секунд до первого токена")
+    p.add_argument("--ai-tokens", type=int, default=120)
+    p.add_argument("--ai-token-delay", type=float, default=0.002)
+    p.add_argument("--tg-latency", type=float, default=0.0, help="задержка каждого вызова Telegram")
+    p.add_argument("--no-stream", dest="stream", action="store_false")
+    p.add_argument("--no-answer-cache", dest="answer_cache", action="store_false")
+    p.add_argument("--storage", default="sqlite", choices=("sqlite", "sharded", "memory"))
+    p.add_argument("--shards", type=int, default=4, help="STORAGE_SHARDS для --storage sharded")
+    p.add_argument("--real-limits", action="store_true", help="не поднимать лимиты outbox/AI")
+    p.add_argument("--timeout", type=float, default=300)
+    p.add_argument("--json", action="store_true")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
@@ -1,627 +1,1765 @@
-import os
-import time
-import sqlite3
-from datetime import datetime, timedelta, timezone
-
-import telebot
-from telebot import types
-
-# OpenAI SDK
-from openai import OpenAI
-
-# =========================
-# ENV
-# =========================
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "").strip()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
-
-# Можно указать админов через переменную ADMIN_IDS="123,456"
-ADMIN_IDS = set()
-_admin_raw = os.getenv("ADMIN_IDS", "").strip()
-if _admin_raw:
-    for x in _admin_raw.split(","):
-        x = x.strip()
-        if x.isdigit():
-            ADMIN_IDS.add(int(x))
-
-# Цена (Stars) — пока как “витрина”, без автосписания
-PRO_PRICE_STARS = 200
-PRO_DAYS = 30
-
-if not TELEGRAM_TOKEN:
-    raise RuntimeError("❌ TELEGRAM_TOKEN не задан в Variables (Railway).")
-if not OPENAI_API_KEY:
-    raise RuntimeError("❌ OPENAI_API_KEY не задан в Variables (Railway).")
-
-bot = telebot.TeleBot(TELEGRAM_TOKEN, parse_mode="HTML")
-ai = OpenAI(api_key=OPENAI_API_KEY)
-
-UTC = timezone.utc
-
-# =========================
-# DB
-# =========================
-DB_PATH = "data.db"
-
-def db():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
-
-def init_db():
-    con = db()
-    cur = con.cursor()
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users(
-        user_id INTEGER PRIMARY KEY,
-        username TEXT,
-        first_name TEXT,
-        created_ts INTEGER,
-        pro_until_ts INTEGER DEFAULT 0,
-        mode TEXT DEFAULT 'career'  -- career | none
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS test_state(
-        user_id INTEGER PRIMARY KEY,
-        step INTEGER DEFAULT 0,
-        score_it INTEGER DEFAULT 0,
-        score_bus INTEGER DEFAULT 0,
-        score_cre INTEGER DEFAULT 0,
-        score_an INTEGER DEFAULT 0,
-        in_test INTEGER DEFAULT 0
-    )
-    """)
-
-    con.commit()
-    con.close()
-
-def upsert_user(u):
-    con = db()
-    cur = con.cursor()
-    now = int(time.time())
-    cur.execute("SELECT user_id FROM users WHERE user_id=?", (u.id,))
-    exists = cur.fetchone()
-    if exists:
-        cur.execute("""
-            UPDATE users
-            SET username=?, first_name=?
-            WHERE user_id=?
-        """, (u.username or "", u.first_name or "", u.id))
-    else:
-        cur.execute("""
-            INSERT INTO users(user_id, username, first_name, created_ts, pro_until_ts, mode)
-            VALUES(?,?,?,?,?,?)
-        """, (u.id, u.username or "", u.first_name or "", now, 0, "career"))
-        # test_state
-        cur.execute("""
-            INSERT OR IGNORE INTO test_state(user_id, step, score_it, score_bus, score_cre, score_an, in_test)
-            VALUES(?,?,?,?,?,?,?)
-        """, (u.id, 0, 0, 0, 0, 0, 0))
-    con.commit()
-    con.close()
-
-def get_user(user_id: int):
-    con = db()
-    cur = con.cursor()
-    cur.execute("SELECT user_id, username, first_name, created_ts, pro_until_ts, mode FROM users WHERE user_id=?", (user_id,))
-    row = cur.fetchone()
-    con.close()
-    return row
-
-def set_mode(user_id: int, mode: str):
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE users SET mode=? WHERE user_id=?", (mode, user_id))
-    con.commit()
-    con.close()
-
-def is_pro(user_id: int) -> bool:
-    row = get_user(user_id)
-    if not row:
-        return False
-    pro_until_ts = int(row[4] or 0)
-    return pro_until_ts > int(time.time())
-
-def pro_until_str(user_id: int) -> str:
-    row = get_user(user_id)
-    if not row:
-        return "-"
-    ts = int(row[4] or 0)
-    if ts <= 0:
-        return "-"
-    dt = datetime.fromtimestamp(ts, tz=UTC)
-    return dt.strftime("%d.%m.%Y %H:%M (UTC)")
-
-def grant_pro(user_id: int, days: int = PRO_DAYS):
-    now = int(time.time())
-    current = 0
-    row = get_user(user_id)
-    if row:
-        current = int(row[4] or 0)
-    base = max(now, current)
-    new_until = int((datetime.fromtimestamp(base, tz=UTC) + timedelta(days=days)).timestamp())
-
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE users SET pro_until_ts=? WHERE user_id=?", (new_until, user_id))
-    con.commit()
-    con.close()
-
-# =========================
-# COPY (Texts)
-# =========================
-WELCOME = (
-    "🚀 <b>CapitalMind — Карьерный AI-бот</b>\n\n"
-    "Я помогаю в <b>карьере</b>: резюме, собеседования, план развития, навыки, профессии.\n\n"
-    "🧭 Выбери действие кнопками ниже."
-)
-
-CAREER_INFO = (
-    "💼 <b>Режим: Карьера</b>\n"
-    "Напиши вопрос по работе/карьере.\n\n"
-    "Примеры:\n"
-    "• «Подбери мне 3 профессии под мои сильные стороны»\n"
-    "• «Сделай резюме для Junior Python»\n"
-    "• «Подготовь к собеседованию на Sales»\n"
-)
-
-TERMS = (
-    "📜 <b>Правила</b>\n\n"
-    "• Бот даёт карьерные рекомендации, но не гарантирует трудоустройство.\n"
-    "• Не передавай пароли/коды/ключи.\n"
-    "• По медицине/праву — только общая информация.\n"
-)
-
-PAY_SUPPORT = (
-    "🧾 <b>Оплата PRO</b>\n\n"
-    "Сейчас кнопка PRO работает как витрина.\n"
-    "Чтобы сделать <b>автоматическое списание Stars</b>, нужно подключить оплату правильно\n"
-    "(это зависит от метода: провайдер платежей или Stars-подписки).\n\n"
-    "Пока можешь написать админу, и мы активируем PRO вручную ✅"
-)
-
-# =========================
-# TEST
-# =========================
-# 4 направления: it / business / creative / analytic
-TEST_QUESTIONS = [
-    ("1/8 🧩 Что тебе ближе?",
-     [("💻 Кодить/разбираться в технике", "it"),
-      ("📈 Продажи/переговоры/бизнес", "bus"),
-      ("🎨 Дизайн/креатив/контент", "cre"),
-      ("📊 Анализ/логика/данные", "an")]),
-
-    ("2/8 🧩 Что больше нравится в задачах?",
-     [("🧠 Решать сложные технические штуки", "it"),
-      ("🤝 Общаться и убеждать", "bus"),
-      ("✨ Придумывать идеи и визуал", "cre"),
-      ("🔎 Искать закономерности", "an")]),
-
-    ("3/8 🧩 Твой любимый тип результата:",
-     [("Работающий продукт/код", "it"),
-      ("Сделка/прибыль/рост", "bus"),
-      ("Красиво и оригинально", "cre"),
-      ("Точно и доказуемо", "an")]),
-
-    ("4/8 🧩 Какой стиль тебе ближе?",
-     [("Системность + технологии", "it"),
-      ("Лидерство + люди", "bus"),
-      ("Творчество + свобода", "cre"),
-      ("Структура + цифры", "an")]),
-
-    ("5/8 🧩 В команде ты чаще…",
-     [("Делаю сложную часть руками", "it"),
-      ("Договариваюсь и двигаю процесс", "bus"),
-      ("Придумываю концепты/идеи", "cre"),
-      ("Считаю/проверяю/улучшаю", "an")]),
-
-    ("6/8 🧩 Что интереснее изучать?",
-     [("Программирование/гаджеты", "it"),
-      ("Маркетинг/продажи/деньги", "bus"),
-      ("Дизайн/видео/музыка", "cre"),
-      ("Математика/аналитика", "an")]),
-
-    ("7/8 🧩 Где ты быстрее прокачаешься?",
-     [("Техскиллы + практика", "it"),
-      ("Софтскиллы + коммуникация", "bus"),
-      ("Портфолио + креатив", "cre"),
-      ("Задачи + логика", "an")]),
-
-    ("8/8 🧩 Что тебе важнее всего?",
-     [("Создавать и строить", "it"),
-      ("Влиять и зарабатывать", "bus"),
-      ("Выделяться и творить", "cre"),
-      ("Понимать и оптимизировать", "an")]),
-]
-
-def reset_test(user_id: int):
-    con = db()
-    cur = con.cursor()
-    cur.execute("""
-        UPDATE test_state
-        SET step=0, score_it=0, score_bus=0, score_cre=0, score_an=0, in_test=1
-        WHERE user_id=?
-    """, (user_id,))
-    con.commit()
-    con.close()
-
-def get_test_state(user_id: int):
-    con = db()
-    cur = con.cursor()
-    cur.execute("""
-        SELECT step, score_it, score_bus, score_cre, score_an, in_test
-        FROM test_state WHERE user_id=?
-    """, (user_id,))
-    row = cur.fetchone()
-    con.close()
-    return row
-
-def set_test_step(user_id: int, step: int):
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE test_state SET step=? WHERE user_id=?", (step, user_id))
-    con.commit()
-    con.close()
-
-def add_score(user_id: int, bucket: str, delta: int = 1):
-    con = db()
-    cur = con.cursor()
-    if bucket == "it":
-        cur.execute("UPDATE test_state SET score_it=score_it+? WHERE user_id=?", (delta, user_id))
-    elif bucket == "bus":
-        cur.execute("UPDATE test_state SET score_bus=score_bus+? WHERE user_id=?", (delta, user_id))
-    elif bucket == "cre":
-        cur.execute("UPDATE test_state SET score_cre=score_cre+? WHERE user_id=?", (delta, user_id))
-    elif bucket == "an":
-cur.execute("UPDATE test_state SET score_an=score_an+? WHERE user_id=?", (delta, user_id))
-    con.commit()
-    con.close()
-
-def finish_test(user_id: int):
-    con = db()
-    cur = con.cursor()
-    cur.execute("UPDATE test_state SET in_test=0 WHERE user_id=?", (user_id,))
-    con.commit()
-    con.close()
-
-def calc_test_result(scores):
-    it, bus, cre, an = scores
-    mx = max(scores)
-    if mx == it:
-        return "it"
-    if mx == bus:
-        return "bus"
-    if mx == cre:
-        return "cre"
-    return "an"
-
-def base_plan_for(result: str) -> str:
-    if result == "it":
-        return (
-            "✅ <b>Твой вектор: IT/ТЕХ</b> 💻\n\n"
-            "🔹 Подойдёт: Python/JS, QA, DevOps (начально), аналитика данных.\n"
-            "🔹 План на 7 дней:\n"
-            "1) Выбери 1 роль (например, Junior Python)\n"
-            "2) 30–60 мин/день практика (задачи)\n"
-            "3) Сделай мини-проект и оформи GitHub\n"
-        )
-    if result == "bus":
-        return (
-            "✅ <b>Твой вектор: БИЗНЕС/ПРОДАЖИ</b> 📈\n\n"
-            "🔹 Подойдёт: Sales, SMM/маркетинг, аккаунт-менеджер.\n"
-            "🔹 План на 7 дней:\n"
-            "1) Подготовь короткий питч о себе\n"
-            "2) Отработай 20 вопросов собеседования\n"
-            "3) Собери портфолио кейсов (даже учебных)\n"
-        )
-    if result == "cre":
-        return (
-            "✅ <b>Твой вектор: КРЕАТИВ</b> 🎨\n\n"
-            "🔹 Подойдёт: дизайн, монтаж, контент, копирайт.\n"
-            "🔹 План на 7 дней:\n"
-            "1) Выбери нишу и стиль\n"
-            "2) Сделай 3 работы в портфолио\n"
-            "3) Оформи профиль и описание услуг\n"
-        )
-    return (
-        "✅ <b>Твой вектор: АНАЛИТИКА</b> 📊\n\n"
-        "🔹 Подойдёт: аналитик, финансы, data-аналитика (начально).\n"
-        "🔹 План на 7 дней:\n"
-        "1) Освой Excel/Sheets базу + диаграммы\n"
-        "2) Сделай 2 мини-отчёта по данным\n"
-        "3) Научись объяснять выводы простыми словами\n"
-    )
-
-# =========================
-# Keyboards
-# =========================
-def main_kb():
-    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    kb.row("💼 Карьера", "🧪 Тест")
-    kb.row("👤 Профиль", "⭐ PRO")
-    kb.row("ℹ️ Помощь")
-    return kb
-
-def test_kb(step: int):
-    q_text, options = TEST_QUESTIONS[step]
-    kb = types.InlineKeyboardMarkup()
-    for title, bucket in options:
-        kb.add(types.InlineKeyboardButton(title, callback_data=f"test:{step}:{bucket}"))
-    kb.add(types.InlineKeyboardButton("⛔️ Отменить тест", callback_data="test_cancel"))
-    return q_text, kb
-
-def pro_kb():
-    kb = types.InlineKeyboardMarkup()
-    kb.add(types.InlineKeyboardButton(f"⭐ Купить PRO — {PRO_PRICE_STARS} Stars / {PRO_DAYS} дней", callback_data="buy_pro"))
-    kb.add(types.InlineKeyboardButton("📩 Связаться с админом", callback_data="contact_admin"))
-    return kb
-
-# =========================
-# AI (career-only)
-# =========================
-SYSTEM_CAREER = (
-    "Ты карьерный консультант. Отвечай ТОЛЬКО по вопросам работы/карьеры: "
-    "резюме, собеседования, профессии, навыки, карьерный план, зарплаты в общих чертах. "
-    "Если вопрос не про карьеру — вежливо откажись и попроси переформулировать под карьеру. "
-    "Язык ответа: русский. Стиль: дружелюбно, коротко, по пунктам, с эмодзи."
-)
-
-def ai_answer_career(user_text: str, pro: bool) -> str:
-    # Чуть разные лимиты
-    max_tokens = 650 if pro else 420
-
-    resp = ai.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": SYSTEM_CAREER},
-            {"role": "user", "content": user_text.strip()},
-        ],
-        temperature=0.7,
-        max_tokens=max_tokens,
-    )
-    return (resp.choices[0].message.content or "").strip()
-
-# =========================
-# Commands
-# =========================
-@bot.message_handler(commands=["start"])
-def cmd_start(message):
-    upsert_user(message.from_user)
-    bot.send_message(message.chat.id, WELCOME, reply_markup=main_kb())
-
-@bot.message_handler(commands=["terms"])
-def cmd_terms(message):
-    upsert_user(message.from_user)
-bot.send_message(message.chat.id, TERMS, reply_markup=main_kb())
-
-@bot.message_handler(commands=["profile"])
-def cmd_profile(message):
-    upsert_user(message.from_user)
-    uid = message.from_user.id
-    row = get_user(uid)
-    if not row:
-        bot.send_message(message.chat.id, "⚠️ Не нашёл профиль. Напиши /start", reply_markup=main_kb())
-        return
-
-    name = row[2] or "User"
-    pro = is_pro(uid)
-    until = pro_until_str(uid)
-
-    text = (
-        f"👤 <b>Профиль</b>\n\n"
-        f"• Имя: <b>{name}</b>\n"
-        f"• PRO: {'✅ <b>Активен</b>' if pro else '❌ <b>Нет</b>'}\n"
-        f"• До: <b>{until}</b>\n\n"
-        f"• Режим: <b>Карьера</b> 💼\n"
-    )
-    bot.send_message(message.chat.id, text, reply_markup=main_kb())
-
-# Админ: выдать PRO вручную
-@bot.message_handler(commands=["grantpro"])
-def cmd_grantpro(message):
-    if message.from_user.id not in ADMIN_IDS:
-        bot.send_message(message.chat.id, "⛔️ Нет доступа.")
-        return
-    parts = (message.text or "").split()
-    if len(parts) < 2:
-        bot.send_message(message.chat.id, "Используй: /grantpro <user_id> [days]")
-        return
-    uid = int(parts[1])
-    days = int(parts[2]) if len(parts) >= 3 else PRO_DAYS
-    grant_pro(uid, days=days)
-    bot.send_message(message.chat.id, f"✅ Выдал PRO пользователю {uid} на {days} дней.")
-
-# =========================
-# Buttons (Reply keyboard)
-# =========================
-@bot.message_handler(func=lambda m: (m.text or "") == "💼 Карьера")
-def btn_career(message):
-    upsert_user(message.from_user)
-    set_mode(message.from_user.id, "career")
-    bot.send_message(message.chat.id, CAREER_INFO, reply_markup=main_kb())
-
-@bot.message_handler(func=lambda m: (m.text or "") == "👤 Профиль")
-def btn_profile(message):
-    cmd_profile(message)
-
-@bot.message_handler(func=lambda m: (m.text or "") == "🧪 Тест")
-def btn_test(message):
-    upsert_user(message.from_user)
-    reset_test(message.from_user.id)
-    q_text, kb = test_kb(0)
-    bot.send_message(message.chat.id, "🧪 <b>Карьерный тест</b>\nОтветь на 8 вопросов:", reply_markup=main_kb())
-    bot.send_message(message.chat.id, q_text, reply_markup=kb)
-
-@bot.message_handler(func=lambda m: (m.text or "") == "⭐ PRO")
-def btn_pro(message):
-    upsert_user(message.from_user)
-    uid = message.from_user.id
-    if is_pro(uid):
-        bot.send_message(
-            message.chat.id,
-            f"⭐ <b>PRO уже активен</b>\nДействует до: <b>{pro_until_str(uid)}</b>",
-            reply_markup=main_kb()
-        )
-    else:
-        bot.send_message(
-            message.chat.id,
-            f"⭐ <b>PRO-подписка</b>\n\n"
-            f"• Цена: <b>{PRO_PRICE_STARS} Stars</b>\n"
-            f"• Длительность: <b>{PRO_DAYS} дней</b>\n\n"
-            f"Что даёт PRO:\n"
-            f"✅ более сильные ответы AI\n"
-            f"✅ PRO-разбор результатов теста\n",
-            reply_markup=pro_kb()
-        )
-
-@bot.message_handler(func=lambda m: (m.text or "") == "ℹ️ Помощь")
-def btn_help(message):
-    upsert_user(message.from_user)
-    bot.send_message(
-        message.chat.id,
-        "ℹ️ <b>Помощь</b>\n\n"
-        "💼 Карьера — задавай вопросы про работу.\n"
-        "🧪 Тест — определим направление.\n"
-        "👤 Профиль — статус PRO.\n"
-        "⭐ PRO — расширенный разбор.\n\n"
-        "Команды:\n"
-        "/start /profile /terms\n",
-        reply_markup=main_kb()
-    )
-
-# =========================
-# Inline callbacks
-# =========================
-@bot.callback_query_handler(func=lambda c: True)
-def callbacks(call):
-    uid = call.from_user.id
-    upsert_user(call.from_user)
-
-    if call.data == "test_cancel":
-        finish_test(uid)
-        bot.answer_callback_query(call.id, "Тест отменён")
-        bot.send_message(call.message.chat.id, "⛔️ Тест отменён.", reply_markup=main_kb())
-        return
-
-    if call.data.startswith("test:"):
-        # test:<step>:<bucket>
-        try:
-            _, step_s, bucket = call.data.split(":")
-            step = int(step_s)
-        except Exception:
-            bot.answer_callback_query(call.id, "Ошибка данных теста")
-            return
-st = get_test_state(uid)
-        if not st:
-            bot.answer_callback_query(call.id, "Состояние теста не найдено. Нажми «Тест» ещё раз.")
-            return
-
-        add_score(uid, bucket, 1)
-        next_step = step + 1
-        set_test_step(uid, next_step)
-        bot.answer_callback_query(call.id, "✅ Принято")
-
-        # следующий вопрос
-        if next_step < len(TEST_QUESTIONS):
-            q_text, kb = test_kb(next_step)
-            bot.edit_message_text(q_text, call.message.chat.id, call.message.message_id, reply_markup=kb)
-            return
-
-        # финал
-        finish_test(uid)
-        st2 = get_test_state(uid)
-        # step, it, bus, cre, an, in_test
-        scores = (st2[1], st2[2], st2[3], st2[4])
-        result = calc_test_result(scores)
-
-        bot.edit_message_text("✅ Тест завершён!", call.message.chat.id, call.message.message_id)
-        bot.send_message(call.message.chat.id, base_plan_for(result), reply_markup=main_kb())
-
-        # PRO-разбор теста (AI) — только если PRO
-        if is_pro(uid):
-            bot.send_message(call.message.chat.id, "⭐ <b>PRO-разбор:</b> делаю персональный план на 30 дней… ⏳")
-            try:
-                prompt = (
-                    f"Результат теста: {result}. "
-                    f"Составь план развития на 30 дней по карьере: "
-                    f"навыки, ежедневные задания, 3 идеи как заработать/стажировка, "
-                    f"и 5 вопросов для самопроверки."
-                )
-                ans = ai_answer_career(prompt, pro=True)
-                bot.send_message(call.message.chat.id, ans, reply_markup=main_kb())
-            except Exception as e:
-                bot.send_message(call.message.chat.id, f"⚠️ Ошибка AI: <code>{e}</code>")
-        else:
-            bot.send_message(
-                call.message.chat.id,
-                f"⭐ Хочешь PRO-разбор теста (план на 30 дней)?\n"
-                f"Нажми: ⭐ PRO → купить за {PRO_PRICE_STARS} Stars",
-                reply_markup=main_kb()
-            )
-        return
-
-    if call.data == "buy_pro":
-        bot.answer_callback_query(call.id, "Открываю оплату…")
-        bot.send_message(call.message.chat.id, PAY_SUPPORT, reply_markup=main_kb())
-        return
-
-    if call.data == "contact_admin":
-        bot.answer_callback_query(call.id, "Ок")
-        admin_text = "📩 Напиши админу: (добавь контакт тут)\n\nИли попроси /grantpro (если ты админ)."
-        bot.send_message(call.message.chat.id, admin_text, reply_markup=main_kb())
-        return
-
-    bot.answer_callback_query(call.id, "Ок")
-
-# =========================
-# Main text handler (career-only AI)
-# =========================
-@bot.message_handler(content_types=["text"])
-def handle_text(message):
-    upsert_user(message.from_user)
-
-    text = (message.text or "").strip()
-    if not text:
-        return
-
-    # Если это команды/кнопки — их уже поймали handlers выше.
-    # Здесь — обычный текст.
-
-    # Проверим, не идёт ли тест (чтобы пользователь не ломал поток)
-    st = get_test_state(message.from_user.id)
-    if st and int(st[5] or 0) == 1:
-        bot.send_message(message.chat.id, "🧪 Ты сейчас проходишь тест. Ответь кнопками под вопросом 🙂", reply_markup=main_kb())
-        return
-
-    # Режим — только карьера
-    uid = message.from_user.id
-    row = get_user(uid)
-    mode = row[5] if row else "career"
-    if mode != "career":
-        set_mode(uid, "career")
-
-    pro = is_pro(uid)
-
-    # “Типичный ответ” перед AI (как ты просил)
-    bot.send_message(message.chat.id, "✅ Принял! Сейчас подумаю и дам карьерный ответ… 🤝")
-
-    try:
-        ans = ai_answer_career(text, pro=pro)
-        if not ans:
-            ans = "⚠️ Не получилось сформировать ответ. Попробуй спросить иначе."
-        bot.send_message(message.chat.id, ans, reply_markup=main_kb())
-    except Exception as e:
-        bot.send_message(message.chat.id, f"⚠️ Ошибка AI: <code>{e}</code>", reply_markup=main_kb())
-
-# =========================
-# Run
-# =========================
-def main():
-    init_db()
-    print("✅ Bot started (polling)...")
-# long_polling: True чтобы меньше 409 конфликтов
-    bot.infinity_polling(timeout=60, long_polling_timeout=60)
-
-if __name__ == "__main__":
-    main()
+import html
+import itertools
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import telebot
+from telebot import types
+
+# OpenAI SDK
+from openai import OpenAI
+
+from admission import AdmissionClass, Late
+from ai_pool import AIPool, Busy
+from answer_cache import AnswerCache
+from cache import LRUCache
+from delivery import Delivery
+from events import EventLog
+from expiry import SOON, ExpiryScheduler
+from limits import RateLimiter, UsageLedger
+from memory import ConversationMemory
+from metrics import RATE_BUCKETS, MetricsServer, Registry, quantile
+from outbox import PRIO_BULK, Outbox
+from plans import PlanCache
+from recorder import TrafficRecorder
+from repository import open_repository
+from resilience import CircuitBreaker, Resilient, StreamCut
+from storage import Database, UserRecord, WriteBehind
+from streaming import StreamingReply
+from webhook import UpdateDispatcher, WebhookServer
+from workers import ProcessRouter, poll_updates
+import testflow
+from testflow import BUCKETS, TestEngine
+from tracing import SamplingProfiler, Tracer, flatten, hot_frames
+
+# =========================
+# ENV
+# =========================
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "").strip()
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
+
+# Можно указать админов через переменную ADMIN_IDS="123,456"
+ADMIN_IDS = set()
+_admin_raw = os.getenv("ADMIN_IDS", "").strip()
+if _admin_raw:
+    for x in _admin_raw.split(","):
+        x = x.strip()
+        if x.isdigit():
+            ADMIN_IDS.add(int(x))
+
+# Приём апдейтов: polling | webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")  # https://<app>.up.railway.app
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram").strip()
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+UPDATE_QUEUE = int(os.getenv("UPDATE_QUEUE", "1000"))
+# >0 — апдейты обрабатывают N отдельных процессов (по user_id), этот только принимает
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+
+# Метрики в формате Prometheus на локальном порту (0 = выключено)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Трассировка апдейтов (TRACING=1): дерево спанов медленных (> TRACE_SLOW_MS)
+# пишется строкой JSON в TRACE_LOG, последние — в /slow.
+# /cpuprofile N — сэмплирующий профайлер на N секунд, файл в PROFILE_DIR.
+TRACING = os.getenv("TRACING", "0") == "1"
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+TRACE_LOG = os.getenv("TRACE_LOG", "slow_updates.jsonl")
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".")
+
+# Запись входящих апдейтов (обезличенных) для replay.py; пусто — не писать.
+# RECORD_SALT — постоянный, чтобы пользователь между рестартами был тем же;
+# RECORD_TEXT=keep — не маскировать текст вопросов (только для стендов).
+RECORD_PATH = os.getenv("RECORD_PATH", "").strip()
+RECORD_SALT = os.getenv("RECORD_SALT", "")
+RECORD_TEXT = os.getenv("RECORD_TEXT", "mask")
+RECORD_MAX_MB = int(os.getenv("RECORD_MAX_MB", "512"))
+
+# Цена (Stars) — пока как “витрина”, без автосписания
+PRO_PRICE_STARS = 200
+PRO_DAYS = 30
+
+if not TELEGRAM_TOKEN:
+    raise RuntimeError("❌ TELEGRAM_TOKEN не задан в Variables (Railway).")
+if not OPENAI_API_KEY:
+    raise RuntimeError("❌ OPENAI_API_KEY не задан в Variables (Railway).")
+if BOT_MODE not in ("polling", "webhook"):
+    raise RuntimeError("❌ BOT_MODE должен быть polling или webhook.")
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise RuntimeError("❌ Для BOT_MODE=webhook нужен WEBHOOK_URL.")
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    # без секрета любой, кто знает URL, может слать боту поддельные апдейты
+    raise RuntimeError("❌ Для BOT_MODE=webhook нужен WEBHOOK_SECRET (1–256 символов: A-Z, a-z, 0-9, _ и -).")
+
+bot = telebot.TeleBot(TELEGRAM_TOKEN, parse_mode="HTML")
+# повторы делает resilient (см. AI), у клиента свои выключены
+ai = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+UTC = timezone.utc
+
+# Счётчики и гистограммы задержек (хендлеры, SQL, OpenAI), см. /metrics
+metrics = Registry()
+
+# Спаны: приём -> хендлер -> SQL-хелперы -> OpenAI -> вызовы Telegram.
+# Выключенный — декораторы не оборачивают функции, спаны — общий no-op.
+tracer = Tracer(enabled=TRACING, slow_ms=TRACE_SLOW_MS, slow_log=TRACE_LOG)
+profiler = SamplingProfiler()
+
+# Все исходящие сообщения — через очередь с лимитами Telegram (30/s, ~1/s на чат)
+out = Outbox(
+    bot,
+    global_rate=float(os.getenv("OUTBOX_GLOBAL_RATE", "30")),
+    chat_rate=float(os.getenv("OUTBOX_CHAT_RATE", "1")),
+    chat_burst=float(os.getenv("OUTBOX_CHAT_BURST", "3")),
+    workers=int(os.getenv("OUTBOX_WORKERS", "4")),
+    tracer=tracer,
+)
+
+# Ответы модели: чистка HTML, разбивка по 4096, правка заглушки на месте,
+# запасной plain text — ошибка отправки не превращается в ошибку AI
+delivery = Delivery(out)
+
+# =========================
+# DB
+# =========================
+DB_PATH = os.getenv("DB_PATH", "data.db")
+
+# Соединения живут весь процесс (по одному на поток), WAL.
+DB_OPTIONS = dict(
+    busy_timeout_ms=int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000")),
+    synchronous=os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+)
+db = Database(DB_PATH, **DB_OPTIONS)
+
+# users / test_state / counters: sqlite (в data.db) | sharded (N файлов
+# рядом, по user_id % N) | memory (тесты, бенчмарки). Остальные таблицы
+# (кэши планов и ответов, расход токенов) всегда в db.
+# Перенос данных между движками — migrate_storage.py.
+STORAGE = os.getenv("STORAGE", "sqlite")
+STORAGE_SHARDS = int(os.getenv("STORAGE_SHARDS", "4"))
+user_repo = open_repository(STORAGE, db, shards=STORAGE_SHARDS, **DB_OPTIONS)
+
+# Кэш строк users: get_user/is_pro/pro_until_str не ходят в хранилище.
+# Все записи в users идут через хелперы ниже и обновляют кэш (write-through).
+user_cache = LRUCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "50000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "600")),
+)
+# write-through внутри откатившейся транзакции — кэш больше не верен
+user_repo.on_rollback(user_cache.clear)
+
+# Обновления username/first_name копятся в буфере и пишутся пачкой.
+# Новые пользователи вставляются сразу (см. upsert_user).
+PROFILE_WRITE_BEHIND = os.getenv("PROFILE_WRITE_BEHIND", "1") != "0"
+profile_writer = WriteBehind(
+    user_repo.update_profiles,
+    flush_interval=float(os.getenv("PROFILE_FLUSH_INTERVAL", "5")),
+    max_pending=int(os.getenv("PROFILE_FLUSH_BATCH", "500")),
+    name="profile-writer",
+)
+
+def init_db():
+    user_repo.init(questions=len(TEST_QUESTIONS))
+
+# Запись в чужие строки users (админ). В режиме процессов кэш этих
+# пользователей живёт в других воркерах — им уходит сигнал сбросить его.
+users_changed_hooks = []
+
+def users_changed(user_ids):
+    """user_ids=None — «поменялось много», сбросить кэш целиком."""
+    for hook in users_changed_hooks:
+        hook(user_ids)
+
+def invalidate_users(user_ids):
+    if user_ids is None:
+        user_cache.clear()
+        return
+    for uid in user_ids:
+        user_cache.pop(uid)
+
+@tracer.traced("db")
+@metrics.timed("db_seconds")
+def bump(name: str, delta: int = 1, user_id: int = 0):
+    """user_id — чей апдейт: в sharded счётчик пишется в его шард (в ту же транзакцию)."""
+    user_repo.bump(name, delta, user_id)
+
+@tracer.traced("db")
+@metrics.timed("db_seconds")
+def counter(name: str) -> int:
+    return user_repo.counter(name)
+
+@tracer.traced("db")
+@metrics.timed("db_seconds")
+def upsert_user(u):
+    now = int(time.time())
+    username = u.username or ""
+    first_name = u.first_name or ""
+    with user_repo.tx(u.id):
+        rec = get_user(u.id)
+        if rec:
+            # профиль не менялся — писать нечего
+            if rec.username == username and rec.first_name == first_name:
+                return
+            rec.username = username
+            rec.first_name = first_name
+            if PROFILE_WRITE_BEHIND:
+                profile_writer.put(u.id, (username, first_name, u.id))
+                return
+            user_repo.update_profiles([(username, first_name, u.id)])
+        else:
+            rec = UserRecord(u.id, username, first_name, now, 0, "career")
+            user_repo.insert(rec)  # + пустая строка test_state
+            bump("users_total", user_id=u.id)
+            user_cache.put(u.id, rec)
+
+@tracer.traced("db")
+@metrics.timed("db_seconds")
+def get_user(user_id: int):
+    rec = user_cache.get(user_id)
+    if rec is not None:
+        return rec
+    rec = user_repo.get(user_id)
+    if rec is None:
+        return None
+    user_cache.put(user_id, rec)
+    return rec
+
+@tracer.traced("db")
+@metrics.timed("db_seconds")
+def set_mode(user_id: int, mode: str):
+    user_repo.set_mode(user_id, mode)
+    rec = user_cache.get(user_id)
+    if rec is not None:
+        rec.mode = mode
+
+def is_pro(user_id: int) -> bool:
+    rec = get_user(user_id)
+    if not rec:
+        return False
+    return rec.pro_until_ts > int(time.time())
+
+def pro_until_str(user_id: int) -> str:
+    rec = get_user(user_id)
+    if not rec:
+        return "-"
+    ts = rec.pro_until_ts
+    if ts <= 0:
+        return "-"
+    return fmt_utc(ts)
+
+def fmt_utc(ts: int) -> str:
+    return datetime.fromtimestamp(ts, tz=UTC).strftime("%d.%m.%Y %H:%M (UTC)")
+
+def grant_pro(user_id: int, days: int = PRO_DAYS):
+    grant_pro_bulk([user_id], days=days)
+
+@tracer.traced("db")
+@metrics.timed("db_seconds")
+def grant_pro_bulk(user_ids, days: int = PRO_DAYS) -> int:
+    """
+    PRO на days дней от max(сейчас, текущий срок) — для всех user_ids
+    одним executemany в одной транзакции (в sharded — по одной на шард).
+    Возвращает число обновлённых строк.
+    """
+    if not user_ids:
+        return 0
+    now = int(time.time())
+    delta = int(timedelta(days=days).total_seconds())
+    with user_repo.tx(user_ids[0]):
+        updated = user_repo.extend_pro(user_ids, now, delta)
+        # write-through: только то, что уже лежит в кэше (откат чистит кэш сам)
+        for uid in user_ids:
+            rec = user_cache.get(uid)
+            if rec is not None:
+                rec.pro_until_ts = max(rec.pro_until_ts, now) + delta
+    changed = list(user_ids) if len(user_ids) <= 1000 else None
+    users_changed(changed)
+    expiry.refresh(changed)
+    return updated
+
+@tracer.traced("db")
+@metrics.timed("db_seconds")
+def users_where(flt: str):
+    """
+    user_id по фильтру (через индексы):
+      pro      — PRO активен сейчас
+      expired  — PRO был, но закончился
+      new:<N>  — зарегистрировались за последние N дней
+      all      — все
+    """
+    now = int(time.time())
+    if flt == "pro":
+        return user_repo.user_ids(pro_after=now)
+    if flt == "expired":
+        return user_repo.user_ids(pro_after=0, pro_upto=now)
+    if flt.startswith("new:") and flt[4:].isdigit():
+        return user_repo.user_ids(created_since=now - int(flt[4:]) * 86400)
+    if flt == "all":
+        return user_repo.user_ids()
+    raise ValueError(flt)
+
+@tracer.traced("db")
+@metrics.timed("db_seconds")
+def stats_snapshot() -> dict:
+    """Цифры для /stats: счётчики + COUNT по диапазону индекса (без полного скана)."""
+    now = int(time.time())
+    count = user_repo.count_users
+    return {
+        "users_total": counter("users_total"),
+        "new_24h": count(created_since=now - 86400),
+        "new_7d": count(created_since=now - 7 * 86400),
+        "pro_active": count(pro_after=now),
+        "pro_expiring_7d": count(pro_after=now, pro_upto=now + 7 * 86400),
+        "tests_started": counter("tests_started"),
+        "tests_completed": counter("tests_completed"),
+    }
+
+# =========================
+# COPY (Texts)
+# =========================
+WELCOME = (
+    "🚀 <b>CapitalMind — Карьерный AI-бот</b>\n\n"
+    "Я помогаю в <b>карьере</b>: резюме, собеседования, план развития, навыки, профессии.\n\n"
+    "🧭 Выбери действие кнопками ниже."
+)
+
+CAREER_INFO = (
+    "💼 <b>Режим: Карьера</b>\n"
+    "Напиши вопрос по работе/карьере.\n\n"
+    "Примеры:\n"
+    "• «Подбери мне 3 профессии под мои сильные стороны»\n"
+    "• «Сделай резюме для Junior Python»\n"
+    "• «Подготовь к собеседованию на Sales»\n"
+)
+
+TERMS = (
+    "📜 <b>Правила</b>\n\n"
+    "• Бот даёт карьерные рекомендации, но не гарантирует трудоустройство.\n"
+    "• Не передавай пароли/коды/ключи.\n"
+    "• По медицине/праву — только общая информация.\n"
+)
+
+PAY_SUPPORT = (
+    "🧾 <b>Оплата PRO</b>\n\n"
+    "Сейчас кнопка PRO работает как витрина.\n"
+    "Чтобы сделать <b>автоматическое списание Stars</b>, нужно подключить оплату правильно\n"
+    "(это зависит от метода: провайдер платежей или Stars-подписки).\n\n"
+    "Пока можешь написать админу, и мы активируем PRO вручную ✅"
+)
+
+# =========================
+# TEST
+# =========================
+# 4 направления: it / business / creative / analytic
+TEST_QUESTIONS = [
+    ("1/8 🧩 Что тебе ближе?",
+     [("💻 Кодить/разбираться в технике", "it"),
+      ("📈 Продажи/переговоры/бизнес", "bus"),
+      ("🎨 Дизайн/креатив/контент", "cre"),
+      ("📊 Анализ/логика/данные", "an")]),
+
+    ("2/8 🧩 Что больше нравится в задачах?",
+     [("🧠 Решать сложные технические штуки", "it"),
+      ("🤝 Общаться и убеждать", "bus"),
+      ("✨ Придумывать идеи и визуал", "cre"),
+      ("🔎 Искать закономерности", "an")]),
+
+    ("3/8 🧩 Твой любимый тип результата:",
+     [("Работающий продукт/код", "it"),
+      ("Сделка/прибыль/рост", "bus"),
+      ("Красиво и оригинально", "cre"),
+      ("Точно и доказуемо", "an")]),
+
+    ("4/8 🧩 Какой стиль тебе ближе?",
+     [("Системность + технологии", "it"),
+      ("Лидерство + люди", "bus"),
+      ("Творчество + свобода", "cre"),
+      ("Структура + цифры", "an")]),
+
+    ("5/8 🧩 В команде ты чаще…",
+     [("Делаю сложную часть руками", "it"),
+      ("Договариваюсь и двигаю процесс", "bus"),
+      ("Придумываю концепты/идеи", "cre"),
+      ("Считаю/проверяю/улучшаю", "an")]),
+
+    ("6/8 🧩 Что интереснее изучать?",
+     [("Программирование/гаджеты", "it"),
+      ("Маркетинг/продажи/деньги", "bus"),
+      ("Дизайн/видео/музыка", "cre"),
+      ("Математика/аналитика", "an")]),
+
+    ("7/8 🧩 Где ты быстрее прокачаешься?",
+     [("Техскиллы + практика", "it"),
+      ("Софтскиллы + коммуникация", "bus"),
+      ("Портфолио + креатив", "cre"),
+      ("Задачи + логика", "an")]),
+
+    ("8/8 🧩 Что тебе важнее всего?",
+     [("Создавать и строить", "it"),
+      ("Влиять и зарабатывать", "bus"),
+      ("Выделяться и творить", "cre"),
+      ("Понимать и оптимизировать", "an")]),
+]
+
+# Активные сессии теста — в памяти, в test_state одна запись на ответ
+tests = TestEngine(
+    user_repo,
+    questions=len(TEST_QUESTIONS),
+    persist=os.getenv("TEST_PERSIST", "answer"),  # answer | finish
+)
+user_repo.on_rollback(tests.clear)
+
+def calc_test_result(scores):
+    # scores — вектор в порядке BUCKETS; при равенстве побеждает более ранний
+    best = 0
+    for i in range(1, len(BUCKETS)):
+        if scores[i] > scores[best]:
+            best = i
+    return BUCKETS[best]
+
+def base_plan_for(result: str) -> str:
+    if result == "it":
+        return (
+            "✅ <b>Твой вектор: IT/ТЕХ</b> 💻\n\n"
+            "🔹 Подойдёт: Python/JS, QA, DevOps (начально), аналитика данных.\n"
+            "🔹 План на 7 дней:\n"
+            "1) Выбери 1 роль (например, Junior Python)\n"
+            "2) 30–60 мин/день практика (задачи)\n"
+            "3) Сделай мини-проект и оформи GitHub\n"
+        )
+    if result == "bus":
+        return (
+            "✅ <b>Твой вектор: БИЗНЕС/ПРОДАЖИ</b> 📈\n\n"
+            "🔹 Подойдёт: Sales, SMM/маркетинг, аккаунт-менеджер.\n"
+            "🔹 План на 7 дней:\n"
+            "1) Подготовь короткий питч о себе\n"
+            "2) Отработай 20 вопросов собеседования\n"
+            "3) Собери портфолио кейсов (даже учебных)\n"
+        )
+    if result == "cre":
+        return (
+            "✅ <b>Твой вектор: КРЕАТИВ</b> 🎨\n\n"
+            "🔹 Подойдёт: дизайн, монтаж, контент, копирайт.\n"
+            "🔹 План на 7 дней:\n"
+            "1) Выбери нишу и стиль\n"
+            "2) Сделай 3 работы в портфолио\n"
+            "3) Оформи профиль и описание услуг\n"
+        )
+    return (
+        "✅ <b>Твой вектор: АНАЛИТИКА</b> 📊\n\n"
+        "🔹 Подойдёт: аналитик, финансы, data-аналитика (начально).\n"
+        "🔹 План на 7 дней:\n"
+        "1) Освой Excel/Sheets базу + диаграммы\n"
+        "2) Сделай 2 мини-отчёта по данным\n"
+        "3) Научись объяснять выводы простыми словами\n"
+    )
+
+# =========================
+# Keyboards
+# =========================
+class FrozenMarkup(types.JsonSerializable):
+    """Клавиатура, сериализованная в JSON один раз (telebot зовёт to_json() на каждую отправку)."""
+
+    __slots__ = ("markup", "_json")
+
+    def __init__(self, markup):
+        self.markup = markup
+        self._json = markup.to_json()
+
+    def to_json(self):
+        return self._json
+
+def _build_main_kb():
+    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    kb.row("💼 Карьера", "🧪 Тест")
+    kb.row("👤 Профиль", "⭐ PRO")
+    kb.row("ℹ️ Помощь")
+    return kb
+
+def _build_test_kb(step: int):
+    q_text, options = TEST_QUESTIONS[step]
+    kb = types.InlineKeyboardMarkup()
+    for title, bucket in options:
+        kb.add(types.InlineKeyboardButton(title, callback_data=f"test:{step}:{bucket}"))
+    kb.add(types.InlineKeyboardButton("⛔️ Отменить тест", callback_data="test_cancel"))
+    return q_text, FrozenMarkup(kb)
+
+def _build_pro_kb():
+    kb = types.InlineKeyboardMarkup()
+    kb.add(types.InlineKeyboardButton(f"⭐ Купить PRO — {PRO_PRICE_STARS} Stars / {PRO_DAYS} дней", callback_data="buy_pro"))
+    kb.add(types.InlineKeyboardButton("📩 Связаться с админом", callback_data="contact_admin"))
+    return kb
+
+# Все клавиатуры статичны — собираем и сериализуем один раз при импорте
+MAIN_KB = FrozenMarkup(_build_main_kb())
+TEST_KBS = [_build_test_kb(step) for step in range(len(TEST_QUESTIONS))]
+PRO_KB = FrozenMarkup(_build_pro_kb())
+
+def main_kb():
+    return MAIN_KB
+
+def test_kb(step: int):
+    return TEST_KBS[step]
+
+def pro_kb():
+    return PRO_KB
+
+# =========================
+# AI (career-only)
+# =========================
+SYSTEM_CAREER = (
+    "Ты карьерный консультант. Отвечай ТОЛЬКО по вопросам работы/карьеры: "
+    "резюме, собеседования, профессии, навыки, карьерный план, зарплаты в общих чертах. "
+    "Если вопрос не про карьеру — вежливо откажись и попроси переформулировать под карьеру. "
+    "Язык ответа: русский. Стиль: дружелюбно, коротко, по пунктам, с эмодзи."
+)
+
+AI_MODEL = os.getenv("AI_MODEL", "gpt-4o-mini")
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "60"))  # служебные вызовы: PRO-планы, резюме диалога
+# Дедлайн на ответ пользователю, со всеми повторами
+AI_DEADLINE = {
+    "free": float(os.getenv("AI_DEADLINE_FREE", "25")),
+    "pro": float(os.getenv("AI_DEADLINE_PRO", "45")),
+}
+
+# Повторы на 429/5xx с jitter, hedging хвостов и circuit breaker
+resilient = Resilient(
+    model=AI_MODEL,
+    fallback_model=os.getenv("AI_FALLBACK_MODEL", "").strip(),
+    max_retries=int(os.getenv("AI_MAX_RETRIES", "2")),
+    hedge=os.getenv("AI_HEDGE", "1") != "0",
+    hedge_quantile=float(os.getenv("AI_HEDGE_QUANTILE", "0.95")),
+    hedge_min=float(os.getenv("AI_HEDGE_MIN_S", "2")),
+    breaker=CircuitBreaker(
+        failures=int(os.getenv("AI_BREAKER_FAILURES", "5")),
+        cooldown=float(os.getenv("AI_BREAKER_COOLDOWN_S", "30")),
+    ),
+)
+
+# Когда OpenAI недоступен (или не ответил за дедлайн)
+AI_UNAVAILABLE = (
+    "⚠️ AI сейчас перегружен и не успел ответить. Попробуй ещё раз через пару минут 🙏\n\n"
+    "Пока — что точно работает:\n"
+    "1) Резюме: 1 страница, цифры и результаты вместо обязанностей\n"
+    "2) Собеседование: 3 истории по схеме ситуация → действие → результат\n"
+    "3) Рост: одна цель на месяц и 30–60 минут практики в день\n\n"
+    "🧪 А ещё можно пройти тест — он работает без AI."
+)
+# Стриминг: ответ появляется в заглушке по мере генерации
+AI_STREAM = os.getenv("AI_STREAM", "1") != "0"
+AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.0"))
+
+# =========================
+# Допуск: классы работы
+# =========================
+# Сначала кнопки и тест (priority 0), потом вопросы к AI: PRO весом
+# AI_PRO_WEIGHT против 1 у free, в конце фоновые резюме памяти.
+# Дедлайн — сколько секунд задача может ждать в очереди (отдельно во
+# входной очереди апдейтов и в пуле AI); опоздавшей отвечаем «перегружен».
+ADMISSION_CLASSES = [
+    AdmissionClass("interactive", 0, 1, float(os.getenv("DEADLINE_INTERACTIVE_S", "20"))),
+    AdmissionClass("test", 0, 1, float(os.getenv("DEADLINE_TEST_S", "20"))),
+    AdmissionClass("ai_pro", 1, float(os.getenv("AI_PRO_WEIGHT", "3")), float(os.getenv("DEADLINE_AI_PRO_S", "120"))),
+    AdmissionClass("ai_free", 1, 1, float(os.getenv("DEADLINE_AI_FREE_S", "45"))),
+    AdmissionClass("background", 2, 1, 0),
+]
+
+UPDATE_LATE = "⏳ Бот был перегружен и не успел ответить вовремя. Повтори, пожалуйста 🙏"
+AI_LATE = "⏳ Сейчас очень много вопросов — ответ занял бы слишком долго. Спроси ещё раз через пару минут 🙏"
+AI_CUT_OFF = "\n\n✂️ <i>Ответ оборван — не уложился во время. Спроси ещё раз, чтобы получить полный.</i>"
+
+def observe_admission(stage: str):
+    def observe(cls: str, waited: float, late: bool):
+        metrics.observe("admission_wait_seconds", waited, stage=stage, cls=cls)
+        if late:
+            metrics.inc("admission_shed_total", stage=stage, cls=cls)
+    return observe
+
+# OpenAI — в своём пуле потоков, хендлеры telebot не ждут completion
+ai_pool = AIPool(
+    workers=int(os.getenv("AI_WORKERS", "8")),
+    max_queue=int(os.getenv("AI_MAX_QUEUE", "64")),
+    per_user=int(os.getenv("AI_PER_USER", "1")),
+    classes=ADMISSION_CLASSES,
+    observe=observe_admission("ai"),
+    tracer=tracer,
+)
+
+# Похожие вопросы (по символьным n-граммам) отвечаем из кэша, без вызова модели
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") != "0"
+answers = AnswerCache(
+    db,
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL_HOURS", "72")) * 3600,
+)
+
+# Лимиты: token bucket на вопросы + дневной бюджет токенов OpenAI (0 = без лимита)
+ai_rate = {
+    "free": RateLimiter(
+        rate=float(os.getenv("AI_RATE_FREE_PER_MIN", "4")) / 60,
+        burst=float(os.getenv("AI_BURST_FREE", "3")),
+    ),
+    "pro": RateLimiter(
+        rate=float(os.getenv("AI_RATE_PRO_PER_MIN", "12")) / 60,
+        burst=float(os.getenv("AI_BURST_PRO", "6")),
+    ),
+}
+AI_DAILY_TOKENS = {
+    "free": int(os.getenv("AI_DAILY_TOKENS_FREE", "20000")),
+    "pro": int(os.getenv("AI_DAILY_TOKENS_PRO", "150000")),
+}
+usage = UsageLedger(db, flush_interval=float(os.getenv("USAGE_FLUSH_INTERVAL", "10")))
+
+AI_BUSY = "⏳ Сейчас очень много вопросов. Попробуй ещё раз через минуту 🙏"
+AI_SUPERSEDED = "⏭ Отвечаю на твой новый вопрос."
+
+def _record_usage(user_id: int, u):
+    if u is not None:
+        usage.record(user_id, int(u.prompt_tokens or 0), int(u.completion_tokens or 0))
+
+def _observe_ai(call: str, pro: bool, started: float, u, first_token: float = 0.0):
+    """Время вызова OpenAI, время до первого токена и скорость генерации (токенов/с)."""
+    now = time.perf_counter()
+    tier = "pro" if pro else "free"
+    metrics.observe("openai_seconds", now - started, call=call, tier=tier)
+    if first_token:
+        metrics.observe("openai_first_token_seconds", first_token - started, tier=tier)
+    if u is None:
+        return
+    completion = int(u.completion_tokens or 0)
+    metrics.inc("openai_tokens_total", int(u.prompt_tokens or 0), kind="prompt")
+    metrics.inc("openai_tokens_total", completion, kind="completion")
+    # у стрима скорость считаем от первого токена: это скорость самой генерации
+    gen = now - (first_token or started)
+    if completion and gen > 0:
+        metrics.observe("openai_tokens_per_second", completion / gen, buckets=RATE_BUCKETS, call=call)
+
+@tracer.traced("openai")
+def ai_answer_career(user_text: str, pro: bool, user_id: int = 0, history=None) -> str:
+    # Чуть разные лимиты
+    max_tokens = 650 if pro else 420
+
+    tier = "pro" if pro else "free"
+
+    def request(model, timeout):
+        return ai.chat.completions.create(
+            timeout=timeout,
+            model=model,
+            messages=_career_messages(user_text, history),
+            temperature=0.7,
+            max_tokens=max_tokens,
+        )
+
+    started = time.perf_counter()
+    try:
+        # user_id=0 (PRO-планы) — фоновая генерация, ей свой дедлайн
+        # проигравший hedge-дубль тоже оплачен — его токены в учёт пользователя
+        resp = resilient.call(f"complete:{tier}", request, AI_DEADLINE[tier] if user_id else AI_TIMEOUT,
+                              on_discard=lambda r: _record_usage(user_id, r.usage))
+    except Exception as e:
+        metrics.inc("openai_errors_total", call="complete", error=type(e).__name__)
+        raise
+    _observe_ai("complete", pro, started, resp.usage)
+    # user_id=0 — служебные вызовы (например, генерация PRO-планов)
+    _record_usage(user_id, resp.usage)
+    return (resp.choices[0].message.content or "").strip()
+
+def _career_messages(user_text: str, history=None):
+    return [
+        {"role": "system", "content": SYSTEM_CAREER},
+        *(history or ()),
+        {"role": "user", "content": user_text.strip()},
+    ]
+
+@tracer.traced("openai")
+def ai_answer_career_stream(user_text: str, pro: bool, on_delta, job=None, user_id: int = 0, history=None) -> str:
+    """
+    То же, что ai_answer_career, но отдаёт текст кусками в on_delta(delta).
+    Не дочитали до дедлайна — StreamCut с уже показанным текстом.
+    """
+    max_tokens = 650 if pro else 420
+
+    tier = "pro" if pro else "free"
+
+    def request(model, timeout):
+        # hedging/повторы — до первого токена; дальше читаем победивший стрим
+        stream = ai.chat.completions.create(
+            timeout=timeout,
+            model=model,
+            messages=_career_messages(user_text, history),
+            temperature=0.7,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        head = []
+        try:
+            for chunk in stream:
+                head.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+        except BaseException:
+            stream.close()
+            raise
+        return stream, head
+
+    started = time.perf_counter()
+    end = time.monotonic() + AI_DEADLINE[tier]
+    first_token = 0.0
+    u = None
+    parts = []
+    cut = False
+    try:
+        stream, head = resilient.call(
+            f"stream:{tier}", request, AI_DEADLINE[tier], on_discard=lambda r: r[0].close())
+        try:
+            for chunk in itertools.chain(head, stream):
+                if job is not None and job.cancelled:
+                    break
+                if time.monotonic() > end:
+                    # дедлайн: дальше не читаем, пришедшее — вызывающему через StreamCut
+                    metrics.inc("openai_errors_total", call="stream", error="DeadlineExceeded")
+                    cut = True
+                    break
+                if getattr(chunk, "usage", None) is not None:
+                    # последний чанк — только usage, без choices
+                    u = chunk.usage
+                    _record_usage(user_id, u)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not first_token:
+                        first_token = time.perf_counter()
+                    parts.append(delta)
+                    on_delta(delta)
+        finally:
+            stream.close()
+    except Exception as e:
+        metrics.inc("openai_errors_total", call="stream", error=type(e).__name__)
+        raise
+    _observe_ai("stream", pro, started, u, first_token)
+    text = "".join(parts).strip()
+    if cut:
+        raise StreamCut(text)
+    return text
+
+SYSTEM_SUMMARY = (
+    "Сожми диалог карьерного консультанта с пользователем в короткое резюме "
+    "для себя: факты о пользователе (опыт, навыки, цели, город, зарплата), "
+    "что уже обсудили и к чему пришли. Без вступлений, по пунктам, на русском."
+)
+
+@tracer.traced("openai")
+def ai_summarize(user_id: int, summary: str, turns, max_tokens: int) -> str:
+    """Новое резюме = старое резюме + свёрнутые реплики."""
+    dialog = "\n".join(f"{'Пользователь' if role == 'user' else 'Консультант'}: {text}" for role, text in turns)
+    if summary:
+        dialog = f"Резюме раньше: {summary}\n\n{dialog}"
+    def request(model, timeout):
+        return ai.chat.completions.create(
+            timeout=timeout,
+            model=model,
+            messages=[
+                {"role": "system", "content": SYSTEM_SUMMARY},
+                {"role": "user", "content": dialog},
+            ],
+            temperature=0.2,
+            max_tokens=max_tokens,
+        )
+
+    started = time.perf_counter()
+    try:
+        resp = resilient.call("summary", request, AI_TIMEOUT,
+                              on_discard=lambda r: _record_usage(user_id, r.usage))
+    except Exception as e:
+        metrics.inc("openai_errors_total", call="summary", error=type(e).__name__)
+        raise
+    _observe_ai("summary", False, started, resp.usage)
+    _record_usage(user_id, resp.usage)
+    return (resp.choices[0].message.content or "").strip()
+
+# Память диалога: последние реплики + резюме старых, под бюджет токенов (0 = без памяти)
+memory = ConversationMemory(
+    summarize=ai_summarize,
+    submit=lambda key, fn, on_done, on_error: ai_pool.submit(key, fn, on_done, on_error, cls="background"),
+    budgets={
+        "free": int(os.getenv("MEMORY_TOKENS_FREE", "600")),
+        "pro": int(os.getenv("MEMORY_TOKENS_PRO", "2500")),
+    },
+    max_conversations=int(os.getenv("MEMORY_MAX_USERS", "20000")),
+    idle_ttl=float(os.getenv("MEMORY_IDLE_MIN", "30")) * 60,
+)
+
+def edit_when_sent(sent, chat_id: int, text: str):
+    """Отредактировать сообщение, как только outbox его отправит (без ожидания)."""
+    sent.add_done_callback(
+        lambda f: f.exception() is None and out.edit_message_text(text, chat_id, f.result().message_id)
+    )
+
+def ai_fallback_reply(prompt: str, tier: str, history=None) -> str:
+    """Ответ без OpenAI: похожий вопрос из кэша (если вопрос без контекста) или общие советы."""
+    if ANSWER_CACHE and not history:
+        cached = answers.lookup(tier, prompt)
+        if cached:
+            return cached
+    return AI_UNAVAILABLE
+
+def ask_ai(uid: int, chat_id: int, placeholder, prompt: str, pro: bool, history=None):
+    """
+    Ставит вопрос в пул AI. В режиме стриминга ответ пишется прямо
+    в заглушку placeholder (Future от out.send_message), иначе приходит
+    отдельным сообщением. Busy пробрасывается вызывающему.
+    history — контекст из memory.context(); ответы с контекстом в кэш не идут.
+    """
+    tier = "pro" if pro else "free"
+    asked = time.monotonic()
+
+    def remember(ans):
+        events.emit("ai_answer", uid, tier, time.monotonic() - asked)
+        memory.remember(uid, tier, prompt, ans)
+        # кэш — после доставки: его ошибка не должна съесть ответ
+        if ANSWER_CACHE and ans and not history:
+            try:
+                answers.put(tier, prompt, ans)
+            except Exception as e:
+                print(f"⚠️ answer-cache put: {e}")
+
+    def on_error(e):
+        if isinstance(e, Late):
+            # прождал в очереди дольше дедлайна — OpenAI даже не вызывали
+            edit_when_sent(placeholder, chat_id, AI_LATE)
+            return
+        if isinstance(e, StreamCut) and e.text:
+            # начало ответа пользователь уже видит — оставляем, но с пометкой, что это не всё;
+            # в кэш и в память обрывок не идёт
+            print(f"⚠️ AI for {uid}: stream cut at deadline ({len(e.text)} chars)")
+            events.emit("ai_error", uid, tier)
+            delivery.deliver(chat_id, e.text + AI_CUT_OFF, placeholder=placeholder, reply_markup=main_kb())
+            return
+        # пользователю — не текст исключения, а запасной ответ
+        print(f"⚠️ AI for {uid}: {type(e).__name__}: {e}")
+        events.emit("ai_error", uid, tier)
+        delivery.deliver(chat_id, ai_fallback_reply(prompt, tier, history), placeholder=placeholder,
+                         reply_markup=main_kb())
+
+    def on_cancel():
+        # пользователь задал новый вопрос раньше, чем пришёл ответ на этот
+        edit_when_sent(placeholder, chat_id, AI_SUPERSEDED)
+
+    if AI_STREAM:
+        # правки ждут результат (нужны ошибки parse mode), но идут через outbox
+        reply = StreamingReply(out.blocking, delivery, chat_id, None, min_interval=AI_STREAM_EDIT_INTERVAL)
+
+        def work(job):
+            # заглушка к этому моменту обычно уже отправлена
+            reply.message_id = placeholder.result().message_id
+            return ai_answer_career_stream(prompt, pro, reply.feed, job=job, user_id=uid, history=history)
+
+        def on_done(ans):
+            # edit не умеет reply-клавиатуру, main_kb() уже висит у пользователя
+            reply.finish(ans or "⚠️ Не получилось сформировать ответ. Попробуй спросить иначе.")
+            remember(ans)
+    else:
+        def work(job):
+            return ai_answer_career(prompt, pro=pro, user_id=uid, history=history)
+
+        def on_done(ans):
+            # ответ — на место заглушки «Принял!», а не вторым сообщением
+            delivery.deliver(chat_id, ans or "⚠️ Не получилось сформировать ответ. Попробуй спросить иначе.",
+                             placeholder=placeholder, reply_markup=main_kb())
+            remember(ans)
+
+    return ai_pool.submit(uid, work, on_done, on_error, on_cancel, cls=f"ai_{tier}")
+
+# PRO-разбор теста зависит только от результата — держим готовые планы
+PLAN_SUPERSEDED = "⏭ PRO-разбор пришлю по последнему пройденному тесту."
+PLAN_UNAVAILABLE = (
+    "⚠️ PRO-разбор сейчас не получился — AI перегружен. "
+    "Начни с плана выше, а за разбором возвращайся чуть позже: пройди тест ещё раз 🙏"
+)
+
+def pro_plan_prompt(result: str) -> str:
+    return (
+        f"Результат теста: {result}. "
+        f"Составь план развития на 30 дней по карьере: "
+        f"навыки, ежедневные задания, 3 идеи как заработать/стажировка, "
+        f"и 5 вопросов для самопроверки."
+    )
+
+plans = PlanCache(
+    db,
+    keys=BUCKETS,
+    generate=lambda result: ai_answer_career(pro_plan_prompt(result), pro=True),
+    variants=int(os.getenv("PLAN_VARIANTS", "3")),
+    ttl=float(os.getenv("PLAN_TTL_DAYS", "7")) * 86400,
+)
+
+# =========================
+# PRO: напоминания об окончании
+# =========================
+PRO_REMINDERS = os.getenv("PRO_REMINDERS", "1") != "0"
+
+PRO_EXPIRES_SOON = (
+    "⏳ <b>PRO заканчивается {until}</b>\n\n"
+    "Продли заранее, чтобы не потерять расширенный лимит AI и PRO-план."
+)
+PRO_EXPIRED = (
+    "⌛ <b>PRO закончился</b>\n\n"
+    "Бот работает в бесплатном режиме. Вернуть PRO можно в любой момент."
+)
+
+def _pro_until_ts(user_id: int):
+    rec = get_user(user_id)
+    return rec.pro_until_ts if rec else None
+
+def notify_pro_expiry(user_id: int, kind: str, pro_until_ts: int):
+    text = PRO_EXPIRES_SOON.format(until=fmt_utc(pro_until_ts)) if kind == SOON else PRO_EXPIRED
+    # личный чат: chat_id == user_id
+    out.send_message(user_id, text, priority=PRIO_BULK, reply_markup=pro_kb())
+
+# Таймеры только на ближайшую неделю: окно грузится по индексу pro_until_ts,
+# новые сроки досылает grant_pro_bulk (и в воркер 0 — через invalidate).
+expiry = ExpiryScheduler(
+    db,
+    load=user_repo.pro_expiring,
+    current=_pro_until_ts,
+    notify=notify_pro_expiry,
+    backlog=out.depth,
+    remind_before=float(os.getenv("PRO_REMIND_DAYS", "3")) * 86400,
+    batch=int(os.getenv("PRO_REMIND_BATCH", "100")),
+)
+
+# =========================
+# Аналитика (воронка)
+# =========================
+# Хендлеры только кладут события в буфер, в SQLite они уходят пачками.
+# События: start, test_start, test_answer(dim=шаг), test_cancel,
+# test_done(dim=результат), buy_pro(dim=tier), ai_answer(dim=tier,
+# value=секунды до ответа), ai_cached(dim=tier), ai_error(dim=tier).
+events = EventLog(
+    db,
+    capacity=int(os.getenv("EVENTS_BUFFER", "100000")),
+    flush_interval=float(os.getenv("EVENTS_FLUSH_INTERVAL", "5")),
+)
+
+RESULT_TITLES = {"it": "IT/ТЕХ", "bus": "Бизнес", "cre": "Креатив", "an": "Аналитика"}
+
+def funnel_report(days: int) -> str:
+    since = time.strftime("%Y-%m-%d", time.gmtime(time.time() - (days - 1) * 86400))
+    r = events.rollups(since)
+
+    def n(name, dim=""):
+        return r.get((name, str(dim)), (0, 0.0))[0]
+
+    def pct(x, base):
+        return f" ({x * 100 // base}%)" if base else ""
+
+    started = n("test_start")
+    lines = [f"🔻 <b>Воронка за {days} дн.</b> (с {since})\n", f"• /start: <b>{n('start')}</b>", "", "🧪 <b>Тест</b>",
+             f"• Начали: <b>{started}</b>"]
+    for step in range(len(TEST_QUESTIONS)):
+        k = n("test_answer", step)
+        lines.append(f"• Ответили на {step + 1}-й: {k}{pct(k, started)}")
+    done = sum(n("test_done", b) for b in BUCKETS)
+    lines.append(f"• Завершили: <b>{done}</b>{pct(done, started)}, отменили: {n('test_cancel')}")
+    lines.append("• Результаты: " + ", ".join(
+        f"{RESULT_TITLES.get(b, b)} {n('test_done', b)}" for b in BUCKETS))
+    lines += ["", "⭐ <b>PRO</b>", f"• «Купить»: free {n('buy_pro', 'free')}, pro {n('buy_pro', 'pro')}", "", "🤖 <b>AI</b>"]
+    for tier in ("free", "pro"):
+        answered, total_s = r.get(("ai_answer", tier), (0, 0.0))
+        avg = f", в среднем {total_s / answered:.1f} с" if answered else ""
+        lines.append(f"• {tier}: ответов {answered}{avg}; из кэша {n('ai_cached', tier)}; ошибок {n('ai_error', tier)}")
+    return "\n".join(lines)
+
+# =========================
+# Metrics
+# =========================
+metrics.describe("handler_seconds", "Время обработки апдейта хендлером")
+metrics.describe("db_seconds", "Время SQL-хелперов (включая попадания в кэш)")
+metrics.describe("openai_seconds", "Время вызова OpenAI целиком")
+metrics.describe("openai_tokens_per_second", "Скорость генерации (completion токенов/с)")
+metrics.gauge("outbox_queue_depth", out.depth, "Исходящие в очереди")
+metrics.gauge("ai_queue_depth", ai_pool.depth, "Вопросы к AI в пуле (в работе + ждут)")
+metrics.gauge("profile_writer_pending", profile_writer.pending)
+metrics.gauge("usage_flush_pending", usage.pending)
+metrics.gauge("user_cache_size", lambda: len(user_cache))
+metrics.gauge("user_cache_hit_ratio", lambda: user_cache.stats()["hit_rate"])
+metrics.gauge("answer_cache_hit_ratio", lambda: answers.stats()["hit_rate"])
+metrics.gauge("openai_circuit_open", lambda: resilient.breaker.is_open(), "1 — OpenAI считается недоступным")
+for _k in ("retries", "hedged", "hedge_wins", "fallbacks", "rejected"):
+    metrics.gauge("openai_resilience", lambda k=_k: getattr(resilient, k), result=_k)
+metrics.gauge("events_pending", events.pending, "События аналитики в буфере")
+metrics.gauge("events_dropped", lambda: events.dropped)
+metrics.gauge("slow_updates", lambda: tracer.slow_count, "Апдейты дольше TRACE_SLOW_MS")
+metrics.gauge("pro_expiry_timers", expiry.depth, "Таймеры напоминаний об окончании PRO")
+metrics.gauge("memory_conversations", lambda: memory.stats()["conversations"])
+metrics.gauge("plan_cache_hits", lambda: plans.hits)
+metrics.gauge("plan_cache_misses", lambda: plans.misses)
+metrics.gauge("outbox_latency_avg_seconds", lambda: out.stats()["latency_avg"])
+for _k in ("sent", "merged", "retried", "dropped", "failed"):
+    metrics.gauge("outbox_messages", lambda k=_k: getattr(out, k), result=_k)
+for _k in ("completed", "failed", "cancelled", "rejected"):
+    metrics.gauge("ai_jobs", lambda k=_k: getattr(ai_pool, k), result=_k)
+for _k in ("delivered", "edited", "plain", "failed"):
+    metrics.gauge("delivery_answers", lambda k=_k: getattr(delivery, k), result=_k)
+
+def metrics_summary() -> str:
+    """Короткая сводка для /metrics: число вызовов, p50/p99 по каждой гистограмме."""
+    _, hists = metrics.snapshot()
+    lines = []
+    for (name, labels), h in sorted(hists.items()):
+        n = sum(h[:-1])
+        if not n:
+            continue
+        bounds = metrics.buckets(name)
+        label = ",".join(str(v) for _, v in labels)
+        if name == "openai_tokens_per_second":
+            p50, p99 = quantile(bounds, h, 0.5), quantile(bounds, h, 0.99)
+            lines.append(f"{name} {label}: n={n} avg={h[-1] / n:.0f} p50≤{p50:g} p99≤{p99:g}")
+        else:
+            p50, p99 = quantile(bounds, h, 0.5) * 1000, quantile(bounds, h, 0.99) * 1000
+            lines.append(f"{name} {label}: n={n} avg={h[-1] / n * 1000:.1f}ms p50≤{p50:g}ms p99≤{p99:g}ms")
+    for (name, labels), v in sorted(metrics.gauges().items()):
+        if name.endswith("_depth") or name.endswith("_pending"):
+            lines.append(f"{name}: {v:g}")
+    return "\n".join(lines) or "пока пусто"
+
+# =========================
+# Router
+# =========================
+# Вместо цепочки lambda-фильтров telebot — один хендлер и поиск по dict
+COMMANDS = {}          # "start" -> handler(message)
+REPLY_BUTTONS = {}     # текст кнопки -> handler(message)
+CALLBACKS = {}         # callback_data -> handler(call)
+CALLBACK_PREFIXES = {} # "test" (из "test:<step>:<bucket>") -> handler(call)
+
+def command(*names):
+    def deco(fn):
+        for name in names:
+            COMMANDS[name] = fn
+        return fn
+    return deco
+
+def reply_button(text: str):
+    def deco(fn):
+        REPLY_BUTTONS[text] = fn
+        return fn
+    return deco
+
+def callback(data: str):
+    def deco(fn):
+        CALLBACKS[data] = fn
+        return fn
+    return deco
+
+def callback_prefix(prefix: str):
+    def deco(fn):
+        CALLBACK_PREFIXES[prefix] = fn
+        return fn
+    return deco
+
+# =========================
+# Commands
+# =========================
+@command("start")
+def cmd_start(message):
+    upsert_user(message.from_user)
+    # /start — разговор с AI с чистого листа
+    memory.forget(message.from_user.id)
+    events.emit("start", message.from_user.id)
+    out.send_message(message.chat.id, WELCOME, reply_markup=main_kb())
+
+@command("terms")
+def cmd_terms(message):
+    upsert_user(message.from_user)
+    out.send_message(message.chat.id, TERMS, reply_markup=main_kb())
+
+@command("profile")
+def cmd_profile(message):
+    uid = message.from_user.id
+    # все чтения/записи хендлера — одна транзакция
+    with user_repo.tx(uid):
+        upsert_user(message.from_user)
+        row = get_user(uid)
+        pro = is_pro(uid)
+        until = pro_until_str(uid)
+    if not row:
+        out.send_message(message.chat.id, "⚠️ Не нашёл профиль. Напиши /start", reply_markup=main_kb())
+        return
+
+    name = row.first_name or "User"
+
+    text = (
+        f"👤 <b>Профиль</b>\n\n"
+        f"• Имя: <b>{name}</b>\n"
+        f"• PRO: {'✅ <b>Активен</b>' if pro else '❌ <b>Нет</b>'}\n"
+        f"• До: <b>{until}</b>\n\n"
+        f"• Режим: <b>Карьера</b> 💼\n"
+    )
+    out.send_message(message.chat.id, text, reply_markup=main_kb())
+
+# Админ: выдать PRO вручную (одному, списку или по фильтру)
+GRANTPRO_USAGE = (
+    "Используй: /grantpro <user_id>[,<user_id>...] [days]\n"
+    "или: /grantpro pro|expired|all|new:<N> [days]"
+)
+
+@command("grantpro")
+def cmd_grantpro(message):
+    if message.from_user.id not in ADMIN_IDS:
+        out.send_message(message.chat.id, "⛔️ Нет доступа.")
+        return
+    parts = (message.text or "").split()
+    if len(parts) < 2 or (len(parts) >= 3 and not parts[2].isdigit()):
+        out.send_message(message.chat.id, GRANTPRO_USAGE)
+        return
+    target = parts[1]
+    days = int(parts[2]) if len(parts) >= 3 else PRO_DAYS
+
+    ids = [x for x in target.split(",") if x]
+    if ids and all(x.isdigit() for x in ids):
+        uids = [int(x) for x in ids]
+    else:
+        try:
+            uids = users_where(target)
+        except ValueError:
+            out.send_message(message.chat.id, GRANTPRO_USAGE)
+            return
+
+    n = grant_pro_bulk(uids, days=days)
+    if target.isdigit():
+        out.send_message(message.chat.id, f"✅ Выдал PRO пользователю {uids[0]} на {days} дней.")
+    else:
+        out.send_message(message.chat.id, f"✅ Выдал PRO на {days} дней: {n} из {len(uids)} пользователей.")
+
+# Админ: сводка
+@command("stats")
+def cmd_stats(message):
+    if message.from_user.id not in ADMIN_IDS:
+        out.send_message(message.chat.id, "⛔️ Нет доступа.")
+        return
+    st = stats_snapshot()
+    uc = user_cache.stats()
+    started, done = st["tests_started"], st["tests_completed"]
+    conv = f" ({done * 100 // started}%)" if started else ""
+    out.send_message(
+        message.chat.id,
+        "📈 <b>Статистика</b>\n\n"
+        f"• Пользователей: <b>{st['users_total']}</b>\n"
+        f"• Новых за 24ч / 7д: <b>{st['new_24h']}</b> / <b>{st['new_7d']}</b>\n"
+        f"• PRO активно: <b>{st['pro_active']}</b> (истекает за 7д: {st['pro_expiring_7d']})\n"
+        f"• Тестов начато / пройдено: <b>{started}</b> / <b>{done}</b>{conv}\n\n"
+        f"• Кэш профилей: {uc['size']} записей, hit rate {uc['hit_rate']:.0%}\n"
+        f"• Очередь AI: {ai_pool.depth()}, исходящих: {out.depth()}"
+    )
+
+# Админ: воронка по событиям (только дневные агрегаты, без сырых событий)
+@command("funnel")
+def cmd_funnel(message):
+    if message.from_user.id not in ADMIN_IDS:
+        out.send_message(message.chat.id, "⛔️ Нет доступа.")
+        return
+    parts = (message.text or "").split()
+    days = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 7
+    out.send_message(message.chat.id, funnel_report(max(1, min(days, 365))))
+
+# Админ: метрики (полный набор — METRICS_PORT, формат Prometheus)
+@command("metrics")
+def cmd_metrics(message):
+    if message.from_user.id not in ADMIN_IDS:
+        out.send_message(message.chat.id, "⛔️ Нет доступа.")
+        return
+    text = html.escape(metrics_summary())
+    if len(text) > 3900:
+        text = text[:3900] + "\n…"
+    out.send_message(message.chat.id, f"📊 <b>Метрики</b>\n\n<pre>{text}</pre>")
+
+def slow_report(limit: int) -> str:
+    """Последние медленные апдейты: корень и самые долгие спаны на любой глубине."""
+    if not tracer.enabled:
+        return "Трассировка выключена (включается TRACING=1)."
+    traces = list(tracer.recent)[-limit:]
+    if not traces:
+        return f"Медленных апдейтов (> {TRACE_SLOW_MS:g} ms) пока нет."
+    lines = [f"🐢 <b>Медленные апдейты</b> (> {TRACE_SLOW_MS:g} ms, всего {tracer.slow_count})"]
+    for t in reversed(traces):
+        when = datetime.fromtimestamp(t["ts"], tz=UTC).strftime("%H:%M:%S")
+        lines.append(f"\n<b>{t['total_ms']:.0f} ms</b> {when} user {t.get('user_id', '-')} ({t.get('cls', '-')})")
+        spans = sorted((s for _, s in flatten(t)), key=lambda s: -s["ms"])[:5]
+        lines += [f"• {html.escape(s['name'])}: {s['ms']:.0f} ms" for s in spans]
+    if TRACE_LOG:
+        lines.append(f"\nПолные деревья: {html.escape(TRACE_LOG)}")
+    return "\n".join(lines)
+
+# Админ: медленные апдейты
+@command("slow")
+def cmd_slow(message):
+    if message.from_user.id not in ADMIN_IDS:
+        out.send_message(message.chat.id, "⛔️ Нет доступа.")
+        return
+    parts = (message.text or "").split()
+    limit = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 5
+    text = slow_report(max(1, min(limit, 10)))
+    if len(text) > 3900:
+        text = text[:3900] + "\n…"
+    out.send_message(message.chat.id, text)
+
+# Админ: сэмплирующий профайлер на N секунд (этот процесс)
+@command("cpuprofile")
+def cmd_cpuprofile(message):
+    if message.from_user.id not in ADMIN_IDS:
+        out.send_message(message.chat.id, "⛔️ Нет доступа.")
+        return
+    if profiler.running:
+        out.send_message(message.chat.id, "⏳ Профайлер уже работает.")
+        return
+    parts = (message.text or "").split()
+    seconds = max(1, min(int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 30, 300))
+    chat_id = message.chat.id
+    path = os.path.join(PROFILE_DIR, f"profile-{os.getpid()}-{int(time.time())}.folded")
+
+    def done(path, result):
+        if path is None:
+            out.send_message(chat_id, f"⚠️ Профайлер: {html.escape(str(result))}")
+            return
+        lines = [f"🔥 <b>Профиль {seconds}s</b>: {sum(result.values())} сэмплов", html.escape(path), ""]
+        lines += [f"{share:.0%} {html.escape(frame)}" for frame, _, share in hot_frames(result)]
+        out.send_message(chat_id, "\n".join(lines))
+
+    profiler.start(seconds, path, done)
+    out.send_message(chat_id, f"🔥 Профайлер включён на {seconds}s, пришлю горячие стеки.")
+
+# Админ: расход токенов OpenAI
+@command("usage")
+def cmd_usage(message):
+    if message.from_user.id not in ADMIN_IDS:
+        out.send_message(message.chat.id, "⛔️ Нет доступа.")
+        return
+    parts = (message.text or "").split()
+    if len(parts) >= 2 and parts[1].isdigit():
+        uid = int(parts[1])
+        rows = usage.user_days(uid)
+        if not rows:
+            out.send_message(message.chat.id, f"Нет данных по {uid}.")
+            return
+        lines = [f"📊 <b>Usage {uid}</b> (день: запросы, prompt/completion)"]
+        for day, req, p, c in rows:
+            lines.append(f"• {day}: {req}, {p}/{c}")
+        out.send_message(message.chat.id, "\n".join(lines))
+        return
+
+    day = parts[1] if len(parts) >= 2 else None
+    (users, req, p, c), top = usage.day_totals(day)
+    lines = [
+        f"📊 <b>Usage {day or 'сегодня'}</b>",
+        f"• Пользователей: <b>{users}</b>",
+        f"• Запросов: <b>{req}</b>",
+        f"• Токены: <b>{p}</b> prompt / <b>{c}</b> completion",
+    ]
+    if top:
+        lines.append("\nТоп:")
+        lines += [f"• {uid}: {t}" for uid, t in top]
+    out.send_message(message.chat.id, "\n".join(lines))
+
+# =========================
+# Buttons (Reply keyboard)
+# =========================
+@reply_button("💼 Карьера")
+def btn_career(message):
+    with user_repo.tx(message.from_user.id):
+        upsert_user(message.from_user)
+        set_mode(message.from_user.id, "career")
+    out.send_message(message.chat.id, CAREER_INFO, reply_markup=main_kb())
+
+@reply_button("👤 Профиль")
+def btn_profile(message):
+    cmd_profile(message)
+
+@reply_button("🧪 Тест")
+def btn_test(message):
+    with user_repo.tx(message.from_user.id):
+        upsert_user(message.from_user)
+        tests.start(message.from_user.id)
+        bump("tests_started", user_id=message.from_user.id)
+    events.emit("test_start", message.from_user.id)
+    q_text, kb = test_kb(0)
+    out.send_message(message.chat.id, "🧪 <b>Карьерный тест</b>\nОтветь на 8 вопросов:", reply_markup=main_kb())
+    out.send_message(message.chat.id, q_text, reply_markup=kb)
+
+@reply_button("⭐ PRO")
+def btn_pro(message):
+    uid = message.from_user.id
+    with user_repo.tx(uid):
+        upsert_user(message.from_user)
+        pro = is_pro(uid)
+        until = pro_until_str(uid)
+    if pro:
+        out.send_message(
+            message.chat.id,
+            f"⭐ <b>PRO уже активен</b>\nДействует до: <b>{until}</b>",
+            reply_markup=main_kb()
+        )
+    else:
+        out.send_message(
+            message.chat.id,
+            f"⭐ <b>PRO-подписка</b>\n\n"
+            f"• Цена: <b>{PRO_PRICE_STARS} Stars</b>\n"
+            f"• Длительность: <b>{PRO_DAYS} дней</b>\n\n"
+            f"Что даёт PRO:\n"
+            f"✅ более сильные ответы AI\n"
+            f"✅ PRO-разбор результатов теста\n",
+            reply_markup=pro_kb()
+        )
+
+@reply_button("ℹ️ Помощь")
+def btn_help(message):
+    upsert_user(message.from_user)
+    out.send_message(
+        message.chat.id,
+        "ℹ️ <b>Помощь</b>\n\n"
+        "💼 Карьера — задавай вопросы про работу.\n"
+        "🧪 Тест — определим направление.\n"
+        "👤 Профиль — статус PRO.\n"
+        "⭐ PRO — расширенный разбор.\n\n"
+        "Команды:\n"
+        "/start /profile /terms\n",
+        reply_markup=main_kb()
+    )
+
+# =========================
+# Inline callbacks
+# =========================
+@callback("test_cancel")
+def cb_test_cancel(call):
+    uid = call.from_user.id
+    with user_repo.tx(uid):
+        upsert_user(call.from_user)
+        tests.cancel(uid)
+    events.emit("test_cancel", uid)
+    out.answer_callback_query(call.id, "Тест отменён")
+    out.send_message(call.message.chat.id, "⛔️ Тест отменён.", reply_markup=main_kb())
+
+@callback_prefix("test")
+def cb_test_answer(call):
+    uid = call.from_user.id
+    # test:<step>:<bucket>
+    try:
+        _, step_s, bucket = call.data.split(":")
+        step = int(step_s)
+    except Exception:
+        out.answer_callback_query(call.id, "Ошибка данных теста")
+        return
+
+    # Один атомарный переход сессии; сеть — после commit
+    with user_repo.tx(uid):
+        upsert_user(call.from_user)
+        status, sess = tests.answer(uid, step, bucket)
+        pro = status == testflow.DONE and is_pro(uid)
+        if status == testflow.DONE:
+            bump("tests_completed", user_id=uid)
+    if status == testflow.BAD:
+        out.answer_callback_query(call.id, "Ошибка данных теста")
+        return
+    if status == testflow.NO_TEST:
+        out.answer_callback_query(call.id, "Состояние теста не найдено. Нажми «Тест» ещё раз.")
+        return
+    if status == testflow.STALE:
+        # двойной тап / старая клавиатура — баллы уже учтены
+        out.answer_callback_query(call.id, "Ответ уже принят")
+        return
+
+    out.answer_callback_query(call.id, "✅ Принято")
+    events.emit("test_answer", uid, step)
+
+    # следующий вопрос
+    if status == testflow.OK:
+        q_text, kb = test_kb(sess.step)
+        out.edit_message_text(q_text, call.message.chat.id, call.message.message_id, reply_markup=kb)
+        return
+
+    # финал
+    result = calc_test_result(sess.scores)
+    events.emit("test_done", uid, result)
+    out.edit_message_text("✅ Тест завершён!", call.message.chat.id, call.message.message_id)
+    out.send_message(call.message.chat.id, base_plan_for(result), reply_markup=main_kb())
+
+    # PRO-разбор теста (AI) — только если PRO
+    if pro:
+        chat_id = call.message.chat.id
+        plan = plans.pick(result)
+        if plan:
+            delivery.deliver(chat_id, plan, reply_markup=main_kb())
+            return
+
+        # пул вариантов ещё пуст — ждём генерацию (одну на всех с таким результатом)
+        placeholder = out.send_message(chat_id, "⭐ <b>PRO-разбор:</b> делаю персональный план на 30 дней… ⏳", merge=False)
+        try:
+            # свой ключ: следующий вопрос пользователя не должен отменять план
+            ai_pool.submit(
+                ("plan", uid),
+                lambda job: plans.get(result),
+                on_done=lambda ans: delivery.deliver(chat_id, ans, placeholder=placeholder, reply_markup=main_kb()),
+                on_error=lambda e: delivery.deliver(chat_id, PLAN_UNAVAILABLE, placeholder=placeholder,
+                                                    reply_markup=main_kb()),
+                # план заменён планом по тесту, пройденному заново
+                on_cancel=lambda: edit_when_sent(placeholder, chat_id, PLAN_SUPERSEDED),
+                cls="ai_pro",
+            )
+        except Busy:
+            edit_when_sent(placeholder, chat_id, AI_BUSY)
+    else:
+        out.send_message(
+            call.message.chat.id,
+            f"⭐ Хочешь PRO-разбор теста (план на 30 дней)?\n"
+            f"Нажми: ⭐ PRO → купить за {PRO_PRICE_STARS} Stars",
+            reply_markup=main_kb()
+        )
+
+@callback("buy_pro")
+def cb_buy_pro(call):
+    upsert_user(call.from_user)
+    events.emit("buy_pro", call.from_user.id, "pro" if is_pro(call.from_user.id) else "free")
+    out.answer_callback_query(call.id, "Открываю оплату…")
+    out.send_message(call.message.chat.id, PAY_SUPPORT, reply_markup=main_kb())
+
+@callback("contact_admin")
+def cb_contact_admin(call):
+    upsert_user(call.from_user)
+    out.answer_callback_query(call.id, "Ок")
+    admin_text = "📩 Напиши админу: (добавь контакт тут)\n\nИли попроси /grantpro (если ты админ)."
+    out.send_message(call.message.chat.id, admin_text, reply_markup=main_kb())
+
+def cb_unknown(call):
+    upsert_user(call.from_user)
+    out.answer_callback_query(call.id, "Ок")
+
+# =========================
+# Main text handler (career-only AI)
+# =========================
+def handle_text(message):
+    text = (message.text or "").strip()
+    uid = message.from_user.id
+
+    with user_repo.tx(uid):
+        upsert_user(message.from_user)
+        if not text:
+            return
+
+        # Если это команды/кнопки — их уже разобрал route_message.
+        # Здесь — обычный текст.
+
+        # Проверим, не идёт ли тест (чтобы пользователь не ломал поток)
+        in_test = tests.in_test(uid)
+        if not in_test:
+            # Режим — только карьера
+            row = get_user(uid)
+            mode = row.mode if row else "career"
+            if mode != "career":
+                set_mode(uid, "career")
+
+            pro = is_pro(uid)
+
+    if in_test:
+        out.send_message(message.chat.id, "🧪 Ты сейчас проходишь тест. Ответь кнопками под вопросом 🙂", reply_markup=main_kb())
+        return
+
+    chat_id = message.chat.id
+    tier = "pro" if pro else "free"
+    allowed, wait_s = ai_rate[tier].allow(uid)
+    if not allowed:
+        out.send_message(chat_id, f"🐢 Слишком много вопросов подряд. Подожди {int(wait_s) + 1} сек. и спроси снова.", reply_markup=main_kb())
+        return
+
+    # Ответ, зависящий от прошлых реплик («а подробнее?»), из кэша брать нельзя
+    history = memory.context(uid, tier)
+    if ANSWER_CACHE and not history:
+        cached = answers.lookup(tier, text)
+        if cached:
+            delivery.deliver(chat_id, cached, reply_markup=main_kb())
+            memory.remember(uid, tier, text, cached)
+            events.emit("ai_cached", uid, tier)
+            return
+
+    # Дневной бюджет считается в памяти — без SQL
+    if usage.over_cap(uid, AI_DAILY_TOKENS[tier]):
+        text_cap = "📊 Дневной лимит AI-ответов исчерпан. Возвращайся завтра 🙂"
+        if not pro:
+            text_cap += f"\n\n⭐ В PRO лимит больше — {PRO_PRICE_STARS} Stars / {PRO_DAYS} дней."
+        out.send_message(chat_id, text_cap, reply_markup=main_kb())
+        return
+
+    # OpenAI лежит — не ставим вопрос в очередь, отвечаем сразу
+    if resilient.breaker.is_open():
+        out.send_message(chat_id, AI_UNAVAILABLE, reply_markup=main_kb())
+        return
+
+    # “Типичный ответ” перед AI (как ты просил)
+    placeholder = out.send_message(chat_id, "✅ Принял! Сейчас подумаю и дам карьерный ответ… 🤝", merge=False)
+
+    # Ответ придёт асинхронно из пула AI, хендлер освобождается сразу
+    try:
+        ask_ai(uid, chat_id, placeholder, text, pro=pro, history=history)
+    except Busy:
+        edit_when_sent(placeholder, chat_id, AI_BUSY)
+
+# =========================
+# Dispatch
+# =========================
+@bot.message_handler(content_types=["text"])
+def route_message(message):
+    text = message.text or ""
+    if text.startswith("/"):
+        # /cmd@BotName args -> cmd
+        name = text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+        handler = COMMANDS.get(name)
+    else:
+        handler = REPLY_BUTTONS.get(text)
+    handler = handler or handle_text
+    with metrics.timer("handler_seconds", handler=handler.__name__), tracer.span(f"handler:{handler.__name__}"):
+        handler(message)
+
+@bot.callback_query_handler(func=lambda c: True)
+def callbacks(call):
+    data = call.data or ""
+    handler = CALLBACKS.get(data)
+    if handler is None:
+        prefix, sep, _ = data.partition(":")
+        handler = CALLBACK_PREFIXES.get(prefix) if sep else None
+    handler = handler or cb_unknown
+    with metrics.timer("handler_seconds", handler=handler.__name__), tracer.span(f"handler:{handler.__name__}"):
+        handler(call)
+
+def classify_update(update) -> str:
+    """Класс допуска по сырому апдейту — до хендлера, поэтому только дешёвые проверки."""
+    call = update.callback_query
+    if call is not None:
+        data = call.data or ""
+        return "test" if data.startswith("test:") or data == "test_cancel" else "interactive"
+    message = update.message
+    text = (message.text or "") if message is not None else ""
+    if not text or text.startswith("/") or text in REPLY_BUTTONS:
+        return "interactive"
+    # обычный текст — вопрос к AI; tier только из кэша профилей: classify зовётся
+    # в потоке приёма (HTTP webhook), в базу отсюда не ходим. Нет в кэше — ai_free
+    rec = user_cache.peek(message.from_user.id)
+    return "ai_pro" if rec is not None and rec.pro_until_ts > int(time.time()) else "ai_free"
+
+def shed_update(update, cls: str):
+    """Апдейт прождал дольше дедлайна класса: короткий ответ вместо обработки."""
+    if update.callback_query is not None:
+        out.answer_callback_query(update.callback_query.id, "⏳ Бот был перегружен — нажми ещё раз")
+    elif update.message is not None:
+        text = AI_LATE if cls.startswith("ai_") else UPDATE_LATE
+        out.send_message(update.message.chat.id, text, reply_markup=main_kb())
+
+# =========================
+# Run
+# =========================
+recorder = TrafficRecorder(
+    RECORD_PATH,
+    salt=RECORD_SALT,
+    keep_text=lambda text: text in REPLY_BUTTONS,
+    mask_text=RECORD_TEXT != "keep",
+    max_bytes=RECORD_MAX_MB * 1024 * 1024,
+) if RECORD_PATH else None
+
+def ingress(target):
+    """Приёмник апдейтов (диспетчер / роутер процессов) — с записью трафика, если она включена."""
+    return recorder.wrap(target) if recorder is not None else target
+
+def make_dispatcher(handle=None):
+    """Очереди по пользователю с классами допуска — между приёмом апдейтов и хендлерами."""
+    dispatcher = UpdateDispatcher(
+        handle or (lambda update: bot.process_new_updates([update])),
+        workers=UPDATE_WORKERS,
+        max_queue=UPDATE_QUEUE,
+        classify=classify_update,
+        classes=ADMISSION_CLASSES,
+        on_shed=shed_update,
+        observe=observe_admission("updates"),
+        tracer=tracer,
+    )
+    metrics.gauge("update_queue_depth", dispatcher.depth, "Апдейты в очереди диспетчера")
+    return dispatcher
+
+def run_polling():
+    print("✅ Bot started (polling)...")
+    # на случай, если раньше стоял webhook
+    bot.remove_webhook()
+    # сырые апдейты -> диспетчер (как в webhook), не пул telebot
+    bot.threaded = False
+    dispatcher = make_dispatcher()
+    dispatcher.start()
+    target = ingress(dispatcher)
+    stop = threading.Event()
+
+    def submit(data):
+        # очередь полна — держим offset, пока не освободится место
+        while not target.submit_json(data) and not stop.is_set():
+            time.sleep(0.05)
+
+    try:
+        poll_updates(TELEGRAM_TOKEN, submit, stop, allowed_updates=["message", "callback_query"])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        dispatcher.stop()
+
+def run_webhook():
+    # Хендлеры крутятся в потоках диспетчера (порядок по пользователю),
+    # а не в пуле telebot
+    bot.threaded = False
+    dispatcher = make_dispatcher()
+    server = WebhookServer(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, ingress(dispatcher))
+    dispatcher.start()
+    bot.set_webhook(
+        url=WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=40,
+        allowed_updates=["message", "callback_query"],
+    )
+    print(f"✅ Bot started (webhook on :{WEBHOOK_PORT}{WEBHOOK_PATH})...")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        dispatcher.stop()
+
+def run_worker(index: int, inbox, events):
+    """Процесс-воркер (WORKER_PROCESSES > 0): свои соединения SQLite, кэши и outbox."""
+    # останавливает входной процесс — стоп-маркером в очереди
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    bot.threaded = False
+    # недостающие PRO-планы догенерирует один воркер, остальные возьмут их из plan_cache
+    startup(warm=index == 0)
+    users_changed_hooks.append(lambda uids: events.put(("invalidate", index, uids)))
+    if METRICS_PORT:
+        MetricsServer(METRICS_HOST, METRICS_PORT + index, metrics).start()
+    dispatcher = make_dispatcher()
+    dispatcher.start()
+    print(f"✅ worker {index} started (pid {os.getpid()})")
+    try:
+        while True:
+            item = inbox.get()
+            if item is None:
+                break
+            kind, payload = item
+            if kind == "update":
+                # порядок важнее: ждём место, а не выкидываем
+                while not dispatcher.submit_json(payload):
+                    time.sleep(0.01)
+            elif kind == "invalidate":
+                invalidate_users(payload)
+                expiry.refresh(payload)
+    finally:
+        dispatcher.stop()
+        shutdown()
+
+def run_multiprocess():
+    # общий лимит Telegram (~30/s) делим между воркерами; лимит на чат — нет,
+    # чат пользователя всегда в одном воркере
+    os.environ["OUTBOX_GLOBAL_RATE"] = str(float(os.getenv("OUTBOX_GLOBAL_RATE", "30")) / WORKER_PROCESSES)
+    router = ProcessRouter(run_worker, WORKER_PROCESSES, max_queue=UPDATE_QUEUE)
+    router.start()
+    target = ingress(router)
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    server = None
+    if BOT_MODE == "webhook":
+        server = WebhookServer(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, target)
+        threading.Thread(target=server.serve_forever, name="webhook", daemon=True).start()
+        bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=40,
+            allowed_updates=["message", "callback_query"],
+        )
+    else:
+        bot.remove_webhook()
+        threading.Thread(
+            target=poll_updates,
+            args=(TELEGRAM_TOKEN, lambda data: target.submit_json(data, block=True), stop),
+            kwargs={"allowed_updates": ["message", "callback_query"]},
+            name="polling", daemon=True,
+        ).start()
+    print(f"✅ Bot started ({BOT_MODE}, {WORKER_PROCESSES} worker processes)...")
+    try:
+        stop.wait()
+    finally:
+        print("⏹ stopping workers...")
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        router.stop()
+        if recorder is not None:
+            recorder.stop()
+
+def startup(warm: bool = True):
+    """Таблицы, кэши и фоновые потоки (без приёма апдейтов — его делает run_*)."""
+    init_db()
+    plans.init_table()
+    usage.init_table()
+    usage.start()
+    if ANSWER_CACHE:
+        answers.init_table()
+    expiry.init_table()
+    events.init_table()
+    events.start()
+    if warm:
+        plans.warm()
+        # напоминания шлёт один процесс (в режиме воркеров — нулевой)
+        if PRO_REMINDERS:
+            expiry.start()
+    if PROFILE_WRITE_BEHIND:
+        profile_writer.start()
+
+def shutdown():
+    expiry.stop()
+    ai_pool.shutdown(wait=False)
+    resilient.shutdown()
+    profile_writer.stop()
+    answers.stop()
+    events.stop()
+    usage.stop()
+    if recorder is not None:
+        recorder.stop()
+    out.stop()
+    user_repo.close()
+    db.close_all()
+
+def main():
+    if WORKER_PROCESSES > 0 and STORAGE == "memory":
+        raise SystemExit("STORAGE=memory is per-process, use sqlite or sharded with WORKER_PROCESSES")
+    if WORKER_PROCESSES > 0:
+        # схема — один раз до старта воркеров, остальное они поднимают сами
+        init_db()
+        run_multiprocess()
+        return
+    startup()
+    if METRICS_PORT:
+        MetricsServer(METRICS_HOST, METRICS_PORT, metrics).start()
+        print(f"📊 Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    try:
+        if BOT_MODE == "webhook":
+            run_webhook()
+        else:
+            run_polling()
+    finally:
+        shutdown()
+
+if __name__ == "__main__":
+    main()
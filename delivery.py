@@ -0,0 +1,112 @@
+from concurrent.futures import Future
+
+from telebot.apihelper import ApiTelegramException
+
+from formatting import sanitize_html, split_html, strip_html
+
+
+TG_TEXT_LIMIT = 4096
+
+
+def _description(e) -> str:
+    return (getattr(e, "description", None) or str(e)).lower()
+
+
+def _parse_error(e) -> bool:
+    return isinstance(e, ApiTelegramException) and "can't parse entities" in _description(e)
+
+
+def _not_modified(e) -> bool:
+    return isinstance(e, ApiTelegramException) and "message is not modified" in _description(e)
+
+
+# =========================
+# Доставка ответов модели
+# =========================
+class Delivery:
+    """
+    Готовый ответ модели -> сообщения Telegram, через outbox и без ожидания:
+
+    - HTML модели чистится (formatting.sanitize_html): parse_mode="HTML"
+      не упадёт из-за <, & или чужих тегов;
+    - длинный ответ режется по абзацам на части до 4096 с закрытыми и
+      заново открытыми тегами (formatting.split_html);
+    - первая часть заменяет заглушку (placeholder — Future от
+      out.send_message, или message_id), остальные — новыми сообщениями
+      по порядку (следующая — после ответа на предыдущую);
+    - если Telegram всё же не разобрал разметку — та же часть уходит
+      обычным текстом; если заглушку не отредактировать — новым сообщением.
+
+    Ошибки доставки только считаются и пишутся в лог: ответ модели уже
+    получен и оплачен, повторно её не вызываем. deliver() возвращает
+    Future -> True (доставлено) / False.
+    reply_markup — для последней части, если она уходит новым сообщением
+    (edit не умеет reply-клавиатуру).
+    """
+
+    def __init__(self, out, limit: int = TG_TEXT_LIMIT):
+        self.out = out
+        self.limit = limit
+        self.delivered = 0
+        self.parts = 0
+        self.edited = 0
+        self.plain = 0
+        self.failed = 0
+
+    def deliver(self, chat_id: int, text: str, placeholder=None, message_id: int = None,
+                reply_markup=None) -> Future:
+        done = Future()
+        parts = split_html(sanitize_html(text or ""), self.limit) or [""]
+        if placeholder is None:
+            self._step(chat_id, parts, 0, message_id, reply_markup, done)
+            return done
+
+        def ready(f):
+            # заглушка не ушла — отвечаем новым сообщением
+            target = f.result().message_id if f.exception() is None else None
+            self._step(chat_id, parts, 0, target, reply_markup, done)
+        placeholder.add_done_callback(ready)
+        return done
+
+    def _step(self, chat_id, parts, i, target, reply_markup, done, plain: bool = False):
+        if i == len(parts):
+            self.delivered += 1
+            done.set_result(True)
+            return
+        text = strip_html(parts[i]) if plain else parts[i]
+        kwargs = {"parse_mode": ""} if plain else {}
+        if target is not None and i == 0:
+            sent = self.out.edit_message_text(text, chat_id, target, **kwargs)
+        else:
+            markup = reply_markup if i == len(parts) - 1 else None
+            sent = self.out.send_message(chat_id, text, merge=False, reply_markup=markup, **kwargs)
+
+        def after(f):
+            e = f.exception()
+            if e is None or _not_modified(e):
+                self.parts += 1
+                if target is not None and i == 0:
+                    self.edited += 1
+                self._step(chat_id, parts, i + 1, target, reply_markup, done)
+            elif _parse_error(e) and not plain:
+                self.plain += 1
+                self._step(chat_id, parts, i, target, reply_markup, done, plain=True)
+            elif target is not None and i == 0:
+                # заглушку удалили / слишком старая — первую часть новым сообщением
+                print(f"⚠️ delivery: edit {chat_id}/{target}: {e}")
+                self._step(chat_id, parts, 0, None, reply_markup, done, plain=plain)
+            else:
+                # пользователь заблокировал бота и т.п. — дальше слать бессмысленно
+                self.failed += 1
+                print(f"⚠️ delivery: {chat_id} part {i + 1}/{len(parts)}: {e}")
+                done.set_result(False)
+        sent.add_done_callback(after)
+
+    def stats(self) -> dict:
+        return {
+            "delivered": self.delivered,
+            "parts": self.parts,
+            "edited": self.edited,
+            "plain": self.plain,
+            "failed": self.failed,
+        }
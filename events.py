@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import deque
+
+
+# =========================
+# Аналитика: журнал событий
+# =========================
+class EventLog:
+    """
+    emit() кладёт событие (ts, name, user_id, dim, value) в кольцевой буфер
+    в памяти — без SQL и lock'ов на пути хендлера. Фоновый поток раз в
+    flush_interval (или когда набралось batch) пишет всё накопленное одной
+    транзакцией:
+
+    - в events — append-only, сырые события (для разборов вручную);
+    - в event_rollups — счётчики (день, name, dim): count и сумма value,
+      досчитываются по пачке в памяти и прибавляются UPSERT'ом.
+
+    Отчёты (/funnel) читают только event_rollups. Если буфер переполнен
+    (запись не успевает), старые события вытесняются — их число в dropped.
+    """
+
+    def __init__(self, db, capacity: int = 100000, flush_interval: float = 5.0,
+                 batch: int = 5000, name: str = "event-log"):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch = batch
+        self.name = name
+        self._buf = deque(maxlen=capacity)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self.emitted = 0
+        self.dropped = 0
+        self.flushed = 0
+
+    def init_table(self):
+        with self.db.tx():
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS events(
+                    id INTEGER PRIMARY KEY,
+                    ts INTEGER,
+                    name TEXT,
+                    user_id INTEGER,
+                    dim TEXT,
+                    value REAL
+                )
+            """)
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS event_rollups(
+                    day TEXT,
+                    name TEXT,
+                    dim TEXT,
+                    count INTEGER DEFAULT 0,
+                    value_sum REAL DEFAULT 0,
+                    PRIMARY KEY(day, name, dim)
+                )
+            """)
+
+    def emit(self, name: str, user_id: int = 0, dim="", value: float = 0.0):
+        buf = self._buf
+        if len(buf) == buf.maxlen:
+            self.dropped += 1
+        buf.append((int(time.time()), name, user_id, str(dim), value))
+        self.emitted += 1
+        if len(buf) >= self.batch:
+            self._wake.set()
+
+    def pending(self) -> int:
+        return len(self._buf)
+
+    def flush(self) -> int:
+        # flush из потока и из stop() не должны делить одну пачку
+        with self._flush_lock:
+            rows = []
+            buf = self._buf
+            while buf:
+                try:
+                    rows.append(buf.popleft())
+                except IndexError:
+                    break
+            if not rows:
+                return 0
+            days = {}
+            rollups = {}
+            for ts, name, _, dim, value in rows:
+                day = days.get(ts // 86400)
+                if day is None:
+                    day = days[ts // 86400] = time.strftime("%Y-%m-%d", time.gmtime(ts))
+                acc = rollups.get((day, name, dim))
+                if acc is None:
+                    rollups[(day, name, dim)] = [1, value]
+                else:
+                    acc[0] += 1
+                    acc[1] += value
+            with self.db.tx():
+                self.db.executemany(
+                    "INSERT INTO events(ts, name, user_id, dim, value) VALUES(?,?,?,?,?)", rows)
+                self.db.executemany("""
+                    INSERT INTO event_rollups(day, name, dim, count, value_sum) VALUES(?,?,?,?,?)
+                    ON CONFLICT(day, name, dim) DO UPDATE SET
+                        count=count+excluded.count, value_sum=value_sum+excluded.value_sum
+                """, [(day, name, dim, n, total) for (day, name, dim), (n, total) in rollups.items()])
+            self.flushed += len(rows)
+            return len(rows)
+
+    def rollups(self, since_day: str):
+        """{(name, dim): (count, value_sum)} за дни >= since_day (YYYY-MM-DD)."""
+        rows = self.db.all("""
+            SELECT name, dim, SUM(count), SUM(value_sum) FROM event_rollups
+            WHERE day >= ? GROUP BY name, dim
+        """, (since_day,))
+        return {(name, dim): (int(n), float(total or 0)) for name, dim, n, total in rows}
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # пачка потеряна: аналитика не стоит того, чтобы копить её без конца
+                print(f"⚠️ {self.name}: flush failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._buf),
+            "emitted": self.emitted,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,212 @@
+import heapq
+import threading
+import time
+
+
+# Виды напоминаний
+SOON = "soon"        # за remind_before до конца PRO
+EXPIRED = "expired"  # PRO закончился
+
+
+# =========================
+# Окончание PRO: таймеры
+# =========================
+class ExpiryScheduler:
+    """
+    Напоминания об окончании PRO без опроса всей таблицы users.
+
+    В памяти — куча таймеров (fire_ts, user_id, kind, pro_until_ts) только
+    на ближайший горизонт: её заполняет один диапазонный запрос по индексу
+    pro_until_ts (load), повторяемый раз в reload_interval, а выдача PRO
+    досылает новые сроки через refresh(). Поток спит до ближайшего таймера.
+
+    - при срабатывании срок сверяется с текущим (current): если PRO
+      продлили, таймер устарел и просто выбрасывается (новый уже в куче);
+    - отправленное пишется в pro_reminders, поэтому после рестарта и
+      перезагрузки окна напоминание не повторится;
+    - срабатывания идут пачками до batch; пока очередь исходящих
+      (backlog) длиннее max_backlog, новые не отдаём.
+
+    load(after, upto) -> [(user_id, pro_until_ts)]; current(user_id) -> pro_until_ts | None;
+    notify(user_id, kind, pro_until_ts) — отправка (снаружи, через outbox).
+    """
+
+    def __init__(self, db, load, current, notify, backlog=None,
+                 remind_before: float = 3 * 86400, horizon: float = 7 * 86400,
+                 lookback: float = 86400, reload_interval: float = 6 * 3600,
+                 batch: int = 100, max_backlog: int = 500):
+        self.db = db
+        self.load = load
+        self.current = current
+        self.notify = notify
+        self.backlog = backlog or (lambda: 0)
+        self.remind_before = int(remind_before)
+        self.horizon = int(horizon)
+        self.lookback = int(lookback)
+        self.reload_interval = reload_interval
+        self.batch = max(1, batch)
+        self.max_backlog = max_backlog
+        self._heap = []
+        self._queued = set()     # (user_id, kind, pro_until_ts) в куче
+        self._cv = threading.Condition()
+        self._loaded_upto = 0    # сроки <= этого уже загружены в кучу
+        self._next_reload = 0.0
+        self._stopping = False
+        self._thread = None
+        self.loaded = 0
+        self.sent = 0
+        self.stale = 0
+        self.failed = 0
+
+    def init_table(self):
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS pro_reminders(
+                user_id INTEGER,
+                pro_until_ts INTEGER,
+                kind TEXT,
+                sent_ts INTEGER,
+                PRIMARY KEY(user_id, pro_until_ts, kind)
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_pro_reminders_until ON pro_reminders(pro_until_ts)")
+
+    # ---- куча ----
+    def _push(self, user_id: int, until: int, now: float, sent=()):
+        """Под self._cv."""
+        for kind, fire in ((SOON, until - self.remind_before), (EXPIRED, until)):
+            if kind == SOON and until <= now:
+                continue  # предупреждать поздно, придёт «закончился»
+            key = (user_id, kind, until)
+            if key in self._queued or key in sent:
+                continue
+            self._queued.add(key)
+            heapq.heappush(self._heap, (fire, user_id, kind, until))
+
+    def reload(self):
+        """Окно (сейчас - lookback, сейчас + horizon + remind_before] — один запрос по индексу."""
+        now = int(time.time())
+        after = now - self.lookback
+        upto = now + self.horizon + self.remind_before
+        rows = self.load(after, upto)
+        sent = set(self.db.all(
+            "SELECT user_id, kind, pro_until_ts FROM pro_reminders WHERE pro_until_ts > ? AND pro_until_ts <= ?",
+            (after, upto),
+        ))
+        with self._cv:
+            self._loaded_upto = upto
+            self._next_reload = time.time() + self.reload_interval
+            for user_id, until in rows:
+                self._push(int(user_id), int(until), now, sent)
+            self._cv.notify()
+        self.loaded += len(rows)
+        # старые отметки больше не нужны: их сроки вне любого окна
+        self.db.execute("DELETE FROM pro_reminders WHERE pro_until_ts <= ?", (after - 30 * 86400,))
+
+    def refresh(self, user_ids):
+        """Сроки этих пользователей поменялись (выдача PRO); None — перечитать окно."""
+        if self._thread is None:
+            return
+        if user_ids is None:
+            with self._cv:
+                self._next_reload = 0.0
+                self._cv.notify()
+            return
+        now = time.time()
+        for user_id in user_ids:
+            until = self.current(user_id)
+            if not until:
+                continue
+            with self._cv:
+                # дальше горизонта — подберёт следующая загрузка окна
+                if until <= self._loaded_upto:
+                    self._push(user_id, until, now)
+                    self._cv.notify()
+
+    def depth(self) -> int:
+        return len(self._heap)
+
+    # ---- поток ----
+    def _take(self):
+        """Под self._cv: ждём ближайший таймер или перезагрузку окна."""
+        while not self._stopping:
+            now = time.time()
+            if now >= self._next_reload or (self._heap and self._heap[0][0] <= now):
+                break
+            wait = self._next_reload - now
+            if self._heap:
+                wait = min(wait, self._heap[0][0] - now)
+            self._cv.wait(wait)
+        due = []
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch:
+            fire, user_id, kind, until = heapq.heappop(self._heap)
+            self._queued.discard((user_id, kind, until))
+            due.append((user_id, kind, until))
+        return due, now >= self._next_reload
+
+    def _fire(self, due):
+        now = int(time.time())
+        fresh = []
+        for user_id, kind, until in due:
+            if self.current(user_id) != until or (kind == SOON and until <= now):
+                self.stale += 1
+                continue
+            fresh.append((user_id, kind, until))
+        send = []
+        with self.db.tx():
+            for user_id, kind, until in fresh:
+                cur = self.db.execute("""
+                    INSERT OR IGNORE INTO pro_reminders(user_id, pro_until_ts, kind, sent_ts)
+                    VALUES(?,?,?,?)
+                """, (user_id, until, kind, now))
+                if cur.rowcount:
+                    send.append((user_id, kind, until))
+        for user_id, kind, until in send:
+            try:
+                self.notify(user_id, kind, until)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"⚠️ expiry: notify {user_id} failed: {e}")
+
+    def _run(self):
+        while True:
+            # исходящие не успевают — напоминания подождут
+            while not self._stopping and self.backlog() > self.max_backlog:
+                time.sleep(1.0)
+            with self._cv:
+                due, reload = self._take()
+                if self._stopping:
+                    return
+            try:
+                if reload:
+                    self.reload()
+                if due:
+                    self._fire(due)
+            except Exception as e:
+                # не записанные в pro_reminders вернутся со следующей загрузкой окна
+                print(f"⚠️ expiry: {e}")
+                with self._cv:
+                    self._next_reload = max(self._next_reload, time.time() + 60)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="pro-expiry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cv:
+            self._stopping = True
+            self._cv.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._heap),
+            "loaded": self.loaded,
+            "sent": self.sent,
+            "stale": self.stale,
+            "failed": self.failed,
+        }
@@ -0,0 +1,220 @@
+import html
+import re
+
+
+# =========================
+# Telegram HTML
+# =========================
+# Теги, которые понимает parse_mode="HTML"
+TG_TAGS = {"b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+           "code", "pre", "a", "tg-spoiler", "blockquote", "span"}
+
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^<>]*>")
+
+
+def open_tags(text: str):
+    """Стек незакрытых тегов (имена) в тексте."""
+    stack = []
+    for m in _TAG_RE.finditer(text):
+        closing, name = m.group(1), m.group(2).lower()
+        if name not in TG_TAGS:
+            continue
+        if closing:
+            # закрываем ближайший такой же тег
+            for i in range(len(stack) - 1, -1, -1):
+                if stack[i] == name:
+                    del stack[i:]
+                    break
+        else:
+            stack.append(name)
+    return stack
+
+
+def close_tags(stack) -> str:
+    return "".join(f"</{name}>" for name in reversed(stack))
+
+
+def html_safe_prefix(text: str) -> str:
+    """
+    Частичный ответ модели -> валидный HTML для промежуточного edit:
+    отрезаем недописанный тег/сущность в хвосте и закрываем открытые теги.
+    """
+    lt = text.rfind("<")
+    if lt != -1 and text.find(">", lt) == -1:
+        text = text[:lt]
+    amp = text.rfind("&")
+    if amp != -1 and text.find(";", amp) == -1 and len(text) - amp <= 10:
+        text = text[:amp]
+    return text + close_tags(open_tags(text))
+
+
+def tg_len(text: str) -> int:
+    """Длина так, как её считает Telegram (UTF-16: эмодзи — 2)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+# =========================
+# Ответ модели -> безопасный HTML
+# =========================
+_TAG_ATTRS_RE = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9-]*)([^<>]*)>")
+_ATTR_RE = re.compile(r"""([a-zA-Z][a-zA-Z0-9-]*)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+_ENTITY_RE = re.compile(r"&(?:#\d{1,7}|#x[0-9a-fA-F]{1,6}|lt|gt|amp|quot);")
+_URL_RE = re.compile(r"^(?:https?://|tg://|mailto:)", re.I)
+# внутри pre/code Telegram другие теги не разбирает
+_RAW_TAGS = {"pre", "code"}
+
+
+def _open_tag(name: str, attrs: str):
+    """Нормализованный открывающий тег или None (тег с такими атрибутами не пропускаем)."""
+    found = {}
+    for m in _ATTR_RE.finditer(attrs):
+        value = m.group(2) if m.group(2) is not None else (m.group(3) if m.group(3) is not None else m.group(4))
+        found[m.group(1).lower()] = value
+    if name == "a":
+        href = html.unescape(found.get("href", "")).strip()
+        if not _URL_RE.match(href):
+            return None
+        return f'<a href="{html.escape(href, quote=True)}">'
+    if name == "span":
+        return '<span class="tg-spoiler">' if found.get("class") == "tg-spoiler" else None
+    if name == "code":
+        lang = found.get("class", "")
+        if re.fullmatch(r"language-[\w+#.-]{1,32}", lang):
+            return f'<code class="{lang}">'
+    return f"<{name}>"
+
+
+def sanitize_html(text: str) -> str:
+    """
+    Текст модели -> HTML, который parse_mode="HTML" точно примет:
+    теги из TG_TAGS (с допустимыми атрибутами) остаются и выравниваются по
+    вложенности, всё остальное — как текст: <, >, & экранируются, лишние
+    закрывающие теги выбрасываются, незакрытые — закрываются в конце.
+    """
+    res = []
+    stack = []  # имена открытых тегов
+    i = 0
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if ch == "<":
+            m = _TAG_ATTRS_RE.match(text, i)
+            if m is not None:
+                closing, name, attrs = m.group(1), m.group(2).lower(), m.group(3)
+                raw = bool(stack) and stack[-1] in _RAW_TAGS
+                if name in TG_TAGS:
+                    if closing and name in stack:
+                        # закрываем и всё, что открыто внутри
+                        while stack:
+                            top = stack.pop()
+                            res.append(f"</{top}>")
+                            if top == name:
+                                break
+                        i = m.end()
+                        continue
+                    if not closing and (not raw or (name == "code" and stack[-1] == "pre")):
+                        tag = _open_tag(name, attrs)
+                        if tag is not None:
+                            stack.append(name)
+                            res.append(tag)
+                        i = m.end()
+                        continue
+                    if closing and not raw:
+                        # закрывающий без открывающего — выбрасываем
+                        i = m.end()
+                        continue
+            res.append("&lt;")
+        elif ch == ">":
+            res.append("&gt;")
+        elif ch == "&":
+            m = _ENTITY_RE.match(text, i)
+            if m is not None:
+                res.append(m.group())
+                i = m.end()
+                continue
+            res.append("&amp;")
+        else:
+            res.append(ch)
+        i += 1
+    res.append(close_tags(stack))
+    return "".join(res)
+
+
+def strip_html(text: str) -> str:
+    """Безопасный HTML -> обычный текст (для отправки без parse_mode)."""
+    return html.unescape(_TAG_RE.sub(lambda m: "" if m.group(2).lower() in TG_TAGS else m.group(), text))
+
+
+def _open_tag_strs(text: str):
+    """Как open_tags, но с исходными открывающими тегами (чтобы открыть их заново)."""
+    stack = []
+    for m in _TAG_RE.finditer(text):
+        closing, name = m.group(1), m.group(2).lower()
+        if name not in TG_TAGS:
+            continue
+        if closing:
+            for i in range(len(stack) - 1, -1, -1):
+                if stack[i][0] == name:
+                    del stack[i:]
+                    break
+        else:
+            stack.append((name, m.group()))
+    return stack
+
+
+def _safe_cut(text: str, pos: int) -> int:
+    """Сдвинуть позицию разреза назад, чтобы не резать тег или сущность."""
+    lt = text.rfind("<", 0, pos)
+    if lt != -1 and text.find(">", lt, pos) == -1:
+        pos = lt
+    amp = text.rfind("&", 0, pos)
+    if amp != -1 and pos - amp <= 10 and text.find(";", amp, pos) == -1:
+        pos = amp
+    return pos
+
+
+def _cut_point(text: str, limit: int) -> int:
+    """Где резать text (не длиннее limit): абзац, строка, предложение, слово — что найдётся."""
+    window = text[:limit]
+    for sep in ("\n\n", "\n", ". ", " "):
+        cut = window.rfind(sep)
+        if cut > limit // 3:
+            cut = _safe_cut(text, cut + len(sep))
+            if cut > 0:
+                return cut
+    cut = _safe_cut(text, limit)
+    if cut:
+        return cut
+    # тег/сущность в самом начале длиннее limit — целиком, резать нельзя
+    end = text.find(">" if text[0] == "<" else ";") + 1
+    return end or limit
+
+
+def split_html(text: str, limit: int = 4096):
+    """
+    Безопасный HTML (см. sanitize_html) -> части не длиннее limit. Режем по
+    абзацам/строкам/словам, не внутри тега; открытые на разрезе теги
+    закрываем в конце части и открываем заново в начале следующей.
+    """
+    parts = []
+    prefix = ""
+    rest = text
+    while rest:
+        body = prefix + rest
+        if tg_len(body) <= limit:
+            parts.append(body)
+            break
+        budget = limit - tg_len(prefix)
+        while True:
+            # budget в символах Python: с эмодзи отступаем, пока не влезет
+            cut = _cut_point(rest, max(1, budget))
+            chunk = prefix + rest[:cut]
+            stack = _open_tag_strs(chunk)
+            chunk = chunk.rstrip() + close_tags([name for name, _ in stack])
+            if tg_len(chunk) <= limit or budget <= 1:
+                break
+            budget -= max(1, tg_len(chunk) - limit)
+        parts.append(chunk)
+        prefix = "".join(tag for _, tag in stack)
+        rest = rest[cut:].lstrip()
+    return parts
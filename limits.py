@@ -0,0 +1,201 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+
+# =========================
+# Token bucket
+# =========================
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """
+    Token bucket на ключ (user_id): rate токенов в секунду, ёмкость burst.
+    Полные (давно не трогали) корзины выкидываем, чтобы dict не рос.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def allow(self, key, cost: float = 1.0):
+        """(True, 0) или (False, сколько секунд подождать)."""
+        now = time.monotonic()
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now)
+                b = self._buckets[key] = TokenBucket(self.burst, now)
+            else:
+                b.tokens = min(self.burst, b.tokens + (now - b.updated) * self.rate)
+                b.updated = now
+            if b.tokens >= cost:
+                b.tokens -= cost
+                return True, 0.0
+            self.limited += 1
+            return False, (cost - b.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def _prune(self, now: float):
+        full_after = self.burst / self.rate if self.rate > 0 else float("inf")
+        for key in [k for k, b in self._buckets.items() if now - b.updated >= full_after]:
+            del self._buckets[key]
+
+
+# =========================
+# Usage ledger (OpenAI tokens)
+# =========================
+def utc_day(ts: float = None) -> str:
+    return datetime.fromtimestamp(ts if ts is not None else time.time(), tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+class UsageLedger:
+    """
+    Учёт токенов OpenAI по пользователю и дню (ai_usage).
+    Сегодняшние суммы — в памяти (проверка лимита без SQL),
+    приращения копятся и пишутся одним executemany-upsert'ом.
+    """
+
+    UPSERT_SQL = """
+        INSERT INTO ai_usage(user_id, day, prompt_tokens, completion_tokens, requests)
+        VALUES(?,?,?,?,?)
+        ON CONFLICT(user_id, day) DO UPDATE SET
+            prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+            completion_tokens = completion_tokens + excluded.completion_tokens,
+            requests = requests + excluded.requests
+    """
+
+    def __init__(self, db, flush_interval: float = 10.0, max_pending: int = 500):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._day = utc_day()
+        self._today = {}    # user_id -> total tokens за self._day
+        self._pending = {}  # (user_id, day) -> [prompt, completion, requests]
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def init_table(self):
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS ai_usage(
+                user_id INTEGER,
+                day TEXT,
+                prompt_tokens INTEGER DEFAULT 0,
+                completion_tokens INTEGER DEFAULT 0,
+                requests INTEGER DEFAULT 0,
+                PRIMARY KEY(user_id, day)
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_ai_usage_day ON ai_usage(day)")
+        day = utc_day()
+        rows = self.db.all(
+            "SELECT user_id, prompt_tokens + completion_tokens FROM ai_usage WHERE day=?", (day,))
+        with self._lock:
+            self._day = day
+            self._today = {uid: int(total or 0) for uid, total in rows}
+
+    def _roll(self, day: str):
+        if day != self._day:
+            self._day = day
+            self._today = {}
+
+    def used_today(self, user_id: int) -> int:
+        with self._lock:
+            self._roll(utc_day())
+            return self._today.get(user_id, 0)
+
+    def over_cap(self, user_id: int, cap: int) -> bool:
+        return cap > 0 and self.used_today(user_id) >= cap
+
+    def record(self, user_id: int, prompt_tokens: int, completion_tokens: int):
+        day = utc_day()
+        with self._lock:
+            self._roll(day)
+            self._today[user_id] = self._today.get(user_id, 0) + prompt_tokens + completion_tokens
+            row = self._pending.setdefault((user_id, day), [0, 0, 0])
+            row[0] += prompt_tokens
+            row[1] += completion_tokens
+            row[2] += 1
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        rows = [(uid, day, p, c, r) for (uid, day), (p, c, r) in batch.items()]
+        try:
+            with self.db.tx():
+                self.db.executemany(self.UPSERT_SQL, rows)
+        except Exception:
+            # не теряем: вернём в буфер; это приращения — складываем с успевшими новыми
+            with self._lock:
+                for key, (p, c, r) in batch.items():
+                    row = self._pending.setdefault(key, [0, 0, 0])
+                    row[0] += p
+                    row[1] += c
+                    row[2] += r
+            raise
+        return len(rows)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ usage-ledger: flush failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    # ---- отчёты (для админа) ----
+    def day_totals(self, day: str = None):
+        """(users, requests, prompt, completion), top-5 [(user_id, tokens)]."""
+        self.flush()
+        day = day or utc_day()
+        total = self.db.one("""
+            SELECT COUNT(*), COALESCE(SUM(requests), 0),
+                   COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0)
+            FROM ai_usage WHERE day=?
+        """, (day,))
+        top = self.db.all("""
+            SELECT user_id, prompt_tokens + completion_tokens AS t
+            FROM ai_usage WHERE day=? ORDER BY t DESC LIMIT 5
+        """, (day,))
+        return total, top
+
+    def user_days(self, user_id: int, limit: int = 7):
+        self.flush()
+        return self.db.all("""
+            SELECT day, requests, prompt_tokens, completion_tokens
+            FROM ai_usage WHERE user_id=? ORDER BY day DESC LIMIT ?
+        """, (user_id, limit))
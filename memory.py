@@ -0,0 +1,186 @@
+import threading
+from collections import deque
+
+from ai_pool import Busy
+from cache import LRUCache
+
+
+# =========================
+# Память диалога (контекст для AI)
+# =========================
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка без токенизатора: для русского текста у gpt-4o-mini
+    выходит ~3 символа на токен. Нужна только для бюджета контекста.
+    """
+    return len(text) // 3 + 1
+
+
+class Turn:
+    __slots__ = ("role", "text", "tokens")
+
+    def __init__(self, role: str, text: str):
+        self.role = role
+        self.text = text
+        self.tokens = estimate_tokens(text)
+
+
+class Conversation:
+    __slots__ = ("turns", "summary", "summary_tokens", "summarizing", "lock")
+
+    def __init__(self):
+        self.turns = deque()   # Turn, от старых к новым
+        self.summary = ""
+        self.summary_tokens = 0
+        self.summarizing = False
+        self.lock = threading.Lock()
+
+    def turn_tokens(self) -> int:
+        return sum(t.tokens for t in self.turns)
+
+
+class ConversationMemory:
+    """
+    Последние реплики пользователя и бота + сжатое резюме всего, что раньше.
+
+    - context(uid, tier) собирает историю под бюджет токенов tier'а:
+      резюме + столько свежих реплик, сколько влезает;
+    - remember(...) после ответа добавляет пару реплик; если реплики
+      перестали влезать в бюджет, старые уходят в резюме — его пишет
+      модель, в фоне (через submit, то есть пул AI);
+    - разговоры, которых не трогали idle_ttl секунд, и всё сверх
+      max_conversations вытесняются (LRU + TTL).
+
+    summarize(user_id, summary, [(role, text)], max_tokens) -> str — вызов модели (снаружи).
+    submit(key, fn, on_done, on_error) — как AIPool.submit.
+    """
+
+    def __init__(self, summarize, submit, budgets: dict, max_conversations: int = 20000,
+                 idle_ttl: float = 1800.0, summary_share: float = 0.3):
+        self.summarize = summarize
+        self.submit = submit
+        self.budgets = dict(budgets)
+        self.summary_share = summary_share
+        self._convs = LRUCache(maxsize=max_conversations, ttl=idle_ttl)
+        self.summaries = 0
+        self.summary_failed = 0
+
+    def _budget(self, tier: str) -> int:
+        return self.budgets.get(tier, 0)
+
+    def has_context(self, user_id: int) -> bool:
+        conv = self._convs.get(user_id)
+        return conv is not None and (bool(conv.turns) or bool(conv.summary))
+
+    def context(self, user_id: int, tier: str):
+        """[{"role", "content"}] для вставки перед текущим вопросом (может быть пустым)."""
+        conv = self._convs.get(user_id)
+        budget = self._budget(tier)
+        if conv is None or budget <= 0:
+            return []
+        with conv.lock:
+            summary, summary_tokens = conv.summary, conv.summary_tokens
+            turns = list(conv.turns)
+        msgs = []
+        left = budget
+        if summary and summary_tokens <= left:
+            left -= summary_tokens
+        else:
+            summary = ""
+        # свежие реплики — с конца, пока влезают
+        for t in reversed(turns):
+            if t.tokens > left:
+                break
+            left -= t.tokens
+            msgs.append({"role": t.role, "content": t.text})
+        msgs.reverse()
+        # история начинается с вопроса пользователя
+        while msgs and msgs[0]["role"] != "user":
+            msgs.pop(0)
+        if summary:
+            msgs.insert(0, {"role": "system", "content": f"Кратко о предыдущем разговоре: {summary}"})
+        return msgs
+
+    def remember(self, user_id: int, tier: str, question: str, answer: str):
+        if self._budget(tier) <= 0 or not answer:
+            return
+        conv = self._convs.get(user_id)
+        if conv is None:
+            conv = Conversation()
+        # put — заодно продлевает TTL активного разговора
+        self._convs.put(user_id, conv)
+        with conv.lock:
+            conv.turns.append(Turn("user", question))
+            conv.turns.append(Turn("assistant", answer))
+            fold = self._take_fold(conv, tier)
+        if fold:
+            self._summarize_async(user_id, conv, fold, tier)
+
+    def _take_fold(self, conv: Conversation, tier: str):
+        """Под conv.lock: какие старые реплики пора свернуть в резюме (пока не удаляем)."""
+        budget = self._budget(tier)
+        if conv.summarizing or conv.summary_tokens + conv.turn_tokens() <= budget:
+            return []
+        # оставляем свежие реплики примерно на половину бюджета
+        keep, kept = budget // 2, 0
+        n_keep = 0
+        for t in reversed(conv.turns):
+            if kept + t.tokens > keep:
+                break
+            kept += t.tokens
+            n_keep += 1
+        n_fold = len(conv.turns) - n_keep
+        # сворачиваем парами (вопрос + ответ), чтобы история не начиналась с ответа
+        n_fold += n_fold % 2
+        fold = list(conv.turns)[:n_fold]
+        if not fold:
+            return []
+        conv.summarizing = True
+        return fold
+
+    def _summarize_async(self, user_id: int, conv: Conversation, fold, tier: str):
+        with conv.lock:
+            old_summary = conv.summary
+        max_tokens = max(60, int(self._budget(tier) * self.summary_share))
+
+        def work(job):
+            return self.summarize(user_id, old_summary, [(t.role, t.text) for t in fold], max_tokens)
+
+        def on_done(summary):
+            summary = (summary or "").strip()
+            with conv.lock:
+                conv.summarizing = False
+                if not summary:
+                    return
+                # свёрнутые реплики всё ещё в начале очереди — новые только дописывались в конец
+                for t in fold:
+                    if conv.turns and conv.turns[0] is t:
+                        conv.turns.popleft()
+                conv.summary = summary
+                conv.summary_tokens = estimate_tokens(summary)
+            self.summaries += 1
+
+        def on_error(e):
+            with conv.lock:
+                conv.summarizing = False
+            self.summary_failed += 1
+            print(f"⚠️ memory: summary for {user_id} failed: {e}")
+
+        try:
+            # отдельный ключ: резюме не должно отменять вопрос пользователя в пуле
+            self.submit(("summary", user_id), work, on_done, on_error)
+        except Busy:
+            # пул занят — попробуем при следующей реплике
+            with conv.lock:
+                conv.summarizing = False
+
+    def forget(self, user_id: int):
+        self._convs.pop(user_id)
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._convs),
+            "evictions": self._convs.evictions,
+            "summaries": self.summaries,
+            "summary_failed": self.summary_failed,
+        }
@@ -0,0 +1,276 @@
+import functools
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Секунды: от попадания в кэш до долгого ответа модели
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Токены в секунду (скорость генерации OpenAI)
+RATE_BUCKETS = (5, 10, 20, 40, 60, 80, 120, 200, 400, 1000)
+
+
+def _labels(kw) -> tuple:
+    return tuple(sorted(kw.items()))
+
+
+class _Shard:
+    """Данные одного потока: пишет только он сам, поэтому без lock."""
+    __slots__ = ("counters", "hists")
+
+    def __init__(self):
+        self.counters = {}  # (name, labels) -> value
+        self.hists = {}     # (name, labels) -> [count_b0, ..., count_inf, sum]
+
+    def merge(self, other: "_Shard"):
+        # list(): поток живого шарда может дописывать ключи, пока мы читаем
+        for key, v in list(other.counters.items()):
+            self.counters[key] = self.counters.get(key, 0) + v
+        for key, h in list(other.hists.items()):
+            acc = self.hists.get(key)
+            if acc is None:
+                self.hists[key] = list(h)
+            else:
+                for i, x in enumerate(h):
+                    acc[i] += x
+
+
+class _Owner:
+    """Живёт только в threading.local потока: умер поток — собран и он (см. Registry._retire)."""
+    __slots__ = ("__weakref__",)
+
+
+# =========================
+# Registry
+# =========================
+class Registry:
+    """
+    Счётчики и гистограммы с фиксированными корзинами.
+
+    Каждый поток пишет в свой шард (threading.local), на горячем пути нет
+    lock'ов — только dict.get и += у своего списка. Шарды суммируются при
+    чтении (snapshot/render), это редкая операция.
+
+    Короткоживущие потоки (по потоку на HTTP-запрос у webhook-сервера) не
+    копят шарды: когда поток завершается, его шард вливается в общий
+    _base и убирается из списка.
+
+    Гейджи — функции, которые зовутся при чтении (глубина очередей и т.п.).
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._base = _Shard()  # данные завершившихся потоков, под _shards_lock
+        self._buckets = {}  # name -> корзины гистограммы
+        self._gauges = {}   # (name, labels) -> fn
+        self._help = {}
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            owner = self._local.owner = _Owner()
+            # finalize держит шард, но не owner: owner умрёт вместе с local потока
+            weakref.finalize(owner, self._retire, shard)
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard: _Shard):
+        with self._shards_lock:
+            self._base.merge(shard)
+            try:
+                self._shards.remove(shard)
+            except ValueError:
+                pass
+
+    # ---- запись ----
+    def inc(self, name: str, value: float = 1, **labels):
+        counters = self._shard().counters
+        key = (name, _labels(labels))
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        self._observe(name, _labels(labels), value, buckets)
+
+    def _observe(self, name: str, labels: tuple, value: float, buckets=LATENCY_BUCKETS):
+        bounds = self._buckets.setdefault(name, buckets)
+        hists = self._shard().hists
+        key = (name, labels)
+        h = hists.get(key)
+        if h is None:
+            h = hists[key] = [0] * (len(bounds) + 2)
+        h[bisect_left(bounds, value)] += 1
+        h[-1] += value
+
+    def gauge(self, name: str, fn, help: str = "", **labels):
+        self._gauges[(name, _labels(labels))] = fn
+        if help:
+            self._help[name] = help
+
+    def describe(self, name: str, help: str):
+        self._help[name] = help
+
+    def timer(self, name: str, **labels):
+        return _Timer(self, name, _labels(labels))
+
+    def timed(self, name: str, **labels):
+        """Декоратор: время вызова в гистограмму name (label fn=имя функции) + счётчик ошибок."""
+        def deco(fn):
+            lbl = dict(labels)
+            lbl.setdefault("fn", fn.__name__)
+            key = _labels(lbl)
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with _Timer(self, name, key):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return deco
+
+    # ---- чтение ----
+    def snapshot(self):
+        """({(name, labels): value}, {(name, labels): [counts..., sum]}) по всем потокам."""
+        total = _Shard()
+        # под lock: иначе шард, влитый в _base посреди обхода, посчитался бы дважды
+        with self._shards_lock:
+            total.merge(self._base)
+            for s in self._shards:
+                total.merge(s)
+        return total.counters, total.hists
+
+    def gauges(self):
+        res = {}
+        for key, fn in list(self._gauges.items()):
+            try:
+                res[key] = float(fn())
+            except Exception:
+                continue
+        return res
+
+    def buckets(self, name: str):
+        return self._buckets.get(name, LATENCY_BUCKETS)
+
+    def render(self) -> str:
+        """Prometheus text format 0.0.4."""
+        counters, hists = self.snapshot()
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), v in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_fmt_labels(labels)} {_fmt_num(v)}")
+        for (name, labels), h in sorted(hists.items()):
+            header(name, "histogram")
+            acc = 0
+            for bound, n in zip(self.buckets(name), h):
+                acc += n
+                lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', _fmt_num(bound)),))} {acc}")
+            total = acc + h[-2]
+            lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', '+Inf'),))} {total}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_num(h[-1])}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {total}")
+        for (name, labels), v in sorted(self.gauges().items()):
+            header(name, "gauge")
+            lines.append(f"{name}{_fmt_labels(labels)} {_fmt_num(v)}")
+        return "\n".join(lines) + "\n"
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "labels", "started")
+
+    def __init__(self, registry: Registry, name: str, labels: tuple):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        r = self.registry
+        r._observe(self.name, self.labels, time.perf_counter() - self.started)
+        if exc_type is not None:
+            counters = r._shard().counters
+            key = (self.name + "_errors_total", self.labels)
+            counters[key] = counters.get(key, 0) + 1
+        return False
+
+
+def _fmt_labels(labels) -> str:
+    if not labels:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + body + "}"
+
+
+def _fmt_num(v) -> str:
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+def quantile(bounds, hist, q: float) -> float:
+    """Оценка квантиля по корзинам (верхняя граница корзины, как histogram_quantile без интерполяции)."""
+    counts = hist[:-1]
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = q * total
+    acc = 0
+    for i, n in enumerate(counts):
+        acc += n
+        if acc >= rank:
+            return bounds[i] if i < len(bounds) else float("inf")
+    return float("inf")
+
+
+# =========================
+# HTTP endpoint (/metrics)
+# =========================
+class _MetricsHandler(BaseHTTPRequestHandler):
+    server_version = "CapitalMind"
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, registry: Registry):
+        super().__init__((host, port), _MetricsHandler)
+        self.registry = registry
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="metrics-http", daemon=True).start()
@@ -0,0 +1,78 @@
+"""
+Перенос users / test_state / counters между движками хранилища.
+
+    python migrate_storage.py --to sharded --shards 8            # data.db -> data.users{0..7}.db
+    python migrate_storage.py --from sharded --shards 8 --to sqlite   # обратно
+
+Бот в это время должен быть остановлен. Источник открывается только на
+чтение и не меняется (старые таблицы остаются в data.db как резервная
+копия). Приёмник должен быть пустым; при обратном переносе в data.db там
+обычно лежит та самая старая копия — её перезаписывает явный --overwrite
+(или пишите в другой файл через --target-db). После переноса запускать
+бота с теми же STORAGE/STORAGE_SHARDS.
+"""
+import argparse
+import sqlite3
+import sys
+import time
+
+from repository import ShardedUserRepo, open_repository
+from storage import Database
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Перенос пользователей между движками хранилища")
+    p.add_argument("--db", default="data.db", help="основная база (DB_PATH)")
+    p.add_argument("--from", dest="src", default="sqlite", choices=("sqlite", "sharded"))
+    p.add_argument("--to", dest="dst", required=True, choices=("sqlite", "sharded"))
+    p.add_argument("--shards", type=int, default=4, help="STORAGE_SHARDS для sharded")
+    p.add_argument("--from-shards", type=int, default=0, help="если у источника другое число шардов")
+    p.add_argument("--target-db", default="", help="другая основная база для приёмника")
+    p.add_argument("--overwrite", action="store_true",
+                   help="приёмник не пуст (старая копия в data.db после --to sharded): "
+                        "удалить в нём пользователей, test_state и счётчики перед переносом")
+    p.add_argument("--questions", type=int, default=8, help="длина теста (для досчёта счётчиков)")
+    p.add_argument("--batch", type=int, default=1000)
+    return p.parse_args(argv)
+
+
+def migrate(src, dst, batch: int = 1000, overwrite: bool = False) -> int:
+    if not dst.is_empty():
+        if not overwrite:
+            raise SystemExit("target storage is not empty, refusing to overwrite "
+                             "(stale copy? pass --overwrite, or use --target-db)")
+        dst.clear()
+    users, tests, counters = src.export_rows()
+    return dst.import_rows(users, tests, counters, batch=batch)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    src_shards = args.from_shards or args.shards
+    if args.src == args.dst and (args.target_db or args.db) == args.db and src_shards == args.shards:
+        raise SystemExit("source and target are the same storage")
+
+    # источник — только чтение и без init(): его схему не трогаем
+    src = open_repository(args.src, Database(args.db, readonly=True), shards=src_shards, readonly=True)
+    try:
+        if isinstance(src, ShardedUserRepo):
+            src.check_layout()
+        src.count_users()
+    except (sqlite3.Error, RuntimeError) as e:
+        raise SystemExit(f"source {args.src} ({args.db}): {e}")
+    dst = open_repository(args.dst, Database(args.target_db or args.db), shards=args.shards)
+    dst.init(args.questions)
+
+    started = time.time()
+    n = migrate(src, dst, batch=args.batch, overwrite=args.overwrite)
+    if dst.count_users() != src.count_users():
+        print(f"⚠️ users: source {src.count_users()}, target {dst.count_users()}", file=sys.stderr)
+        return 1
+    print(f"✅ {n} users: {args.src} -> {args.dst} за {time.time() - started:.1f}s")
+    src.close()
+    dst.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+import heapq
+import itertools
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future
+
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+
+from formatting import tg_len
+from limits import RateLimiter
+
+
+# Приоритеты (меньше — раньше)
+PRIO_CALLBACK = 0     # answer_callback_query: крутилка на кнопке
+PRIO_INTERACTIVE = 1  # ответы на действия пользователя
+PRIO_BULK = 5         # рассылки, напоминания
+
+TG_TEXT_LIMIT = 4096
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+
+
+class QueueFull(Exception):
+    """Очередь исходящих переполнена, низкоприоритетное сообщение отброшено."""
+
+
+class OutboxClosed(Exception):
+    """Outbox остановлен (stop()), новые вызовы не принимаются."""
+
+
+class _Out:
+    __slots__ = ("seq", "priority", "key", "limited", "method", "args", "kwargs",
+                 "future", "enqueued", "attempts", "merge", "trace")
+
+    def __init__(self, seq, priority, key, limited, method, args, kwargs, merge=False):
+        self.seq = seq
+        self.priority = priority
+        self.key = key
+        self.limited = limited
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+        self.merge = merge
+        self.trace = None
+
+    def mergeable(self) -> bool:
+        # сообщения с inline-кнопками потом редактируют — их не склеиваем
+        markup = self.kwargs.get("reply_markup")
+        return (self.merge and self.method == "send_message"
+                and set(self.kwargs) <= {"reply_markup", "parse_mode"}
+                and not isinstance(getattr(markup, "markup", markup), types.InlineKeyboardMarkup))
+
+
+class _Chat:
+    __slots__ = ("queue", "busy", "scheduled")
+
+    def __init__(self):
+        self.queue = deque()
+        self.busy = False
+        self.scheduled = False
+
+
+def _retry_after(e: ApiTelegramException) -> float:
+    params = (e.result_json or {}).get("parameters") or {}
+    return float(params.get("retry_after", 1))
+
+
+# =========================
+# Outbox
+# =========================
+class Outbox:
+    """
+    Все исходящие вызовы Telegram идут через очередь:
+
+    - FIFO на каждый чат (порядок сообщений сохраняется), между чатами —
+      по приоритету, затем по времени постановки;
+    - token bucket на чат (~1 msg/s с небольшим burst) и общий (~30 msg/s);
+    - подряд идущие простые send_message в один чат, если успели
+      накопиться, склеиваются в одно сообщение (до 4096 символов);
+    - 429 -> ждём retry_after и повторяем (до max_attempts);
+    - постановка не блокирует: методы возвращают Future.
+
+    answer_callback_query живёт в своей очереди (не ждёт сообщения чата)
+    и не тратит лимит чата.
+
+    С tracer (tracing.Tracer) каждый вызов попадает в трассу апдейта,
+    который его поставил: спан "telegram:<method>" с ожиданием в очереди.
+    """
+
+    def __init__(self, bot, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 workers: int = 4, max_pending: int = 10000, max_attempts: int = 5, merge: bool = True,
+                 tracer=None):
+        self.bot = bot
+        self.tracer = tracer
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.merge = merge
+        self._global = RateLimiter(global_rate, global_rate)
+        self._per_chat = RateLimiter(chat_rate, chat_burst)
+        self._cv = threading.Condition()
+        self._seq = itertools.count()
+        self._chats = {}
+        self._ready = []    # (priority, seq, key)
+        self._delayed = []  # (due, priority, seq, key)
+        self._pending = 0
+        self._stopping = False
+        self._closed = False
+        self._threads = []
+        self.workers = workers
+        self.blocking = _BlockingOutbox(self)
+        # метрики
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.dropped = 0
+        self.failed = 0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+
+    # ---- постановка ----
+    def _enqueue(self, priority, key, limited, method, args, kwargs, merge=False) -> Future:
+        item = _Out(next(self._seq), priority, key, limited, method, args, kwargs, merge)
+        if self.tracer is not None:
+            item.trace = self.tracer.hold()
+        with self._cv:
+            if self._closed:
+                # после stop() воркеры не перезапускаются
+                self.dropped += 1
+                self._traced(item, "closed")
+                item.future.set_exception(OutboxClosed())
+                return item.future
+            if not self._threads:
+                self.start()
+            if self._pending >= self.max_pending and priority > PRIO_INTERACTIVE:
+                self.dropped += 1
+                self._traced(item, "dropped")
+                item.future.set_exception(QueueFull())
+                return item.future
+            chat = self._chats.get(key)
+            if chat is None:
+                chat = self._chats[key] = _Chat()
+            chat.queue.append(item)
+            self._pending += 1
+            if not chat.busy and not chat.scheduled:
+                self._schedule(key, chat)
+            self._cv.notify()
+        return item.future
+
+    def _schedule(self, key, chat: _Chat, due: float = 0.0):
+        head = chat.queue[0]
+        chat.scheduled = True
+        if due:
+            heapq.heappush(self._delayed, (due, head.priority, head.seq, key))
+        else:
+            heapq.heappush(self._ready, (head.priority, head.seq, key))
+
+    def send_message(self, chat_id, text, priority: int = PRIO_INTERACTIVE, merge: bool = True, **kwargs) -> Future:
+        """merge=False — если message_id понадобится (например, заглушку потом редактируют)."""
+        return self._enqueue(priority, chat_id, True, "send_message", (chat_id, text), kwargs, merge)
+
+    def edit_message_text(self, text, chat_id, message_id, priority: int = PRIO_INTERACTIVE, **kwargs) -> Future:
+        return self._enqueue(priority, chat_id, True, "edit_message_text", (text, chat_id, message_id), kwargs)
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs) -> Future:
+        return self._enqueue(PRIO_CALLBACK, ("cbq", callback_query_id), False,
+                             "answer_callback_query", (callback_query_id, text), kwargs)
+
+    # ---- рабочие потоки ----
+    def _take(self):
+        """Под self._cv: следующий пакет на отправку или None (ждать)."""
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, prio, seq, key = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (prio, seq, key))
+        while self._ready:
+            prio, seq, key = heapq.heappop(self._ready)
+            chat = self._chats.get(key)
+            if chat is None or chat.busy or not chat.queue:
+                continue
+            head = chat.queue[0]
+            if head.limited:
+                ok, wait = self._per_chat.allow(key)
+                if not ok:
+                    heapq.heappush(self._delayed, (now + wait, prio, seq, key))
+                    continue
+            ok, wait = self._global.allow(0)
+            if not ok:
+                heapq.heappush(self._delayed, (now + wait, prio, seq, key))
+                continue
+            chat.scheduled = False
+            chat.busy = True
+            batch = [chat.queue.popleft()]
+            if self.merge and head.mergeable():
+                # лимит Telegram — в единицах UTF-16 (эмодзи — 2), не в символах Python
+                size = tg_len(head.args[1])
+                while chat.queue and chat.queue[0].mergeable():
+                    nxt = chat.queue[0]
+                    prev_markup = batch[-1].kwargs.get("reply_markup")
+                    if prev_markup is not None and prev_markup is not nxt.kwargs.get("reply_markup"):
+                        break
+                    if nxt.kwargs.get("parse_mode") != head.kwargs.get("parse_mode"):
+                        break
+                    size += 2 + tg_len(nxt.args[1])
+                    if size > TG_TEXT_LIMIT:
+                        break
+                    batch.append(chat.queue.popleft())
+            return key, chat, batch
+        return None
+
+    def _next_wait(self) -> float:
+        if not self._delayed:
+            return 1.0
+        return max(0.0, min(1.0, self._delayed[0][0] - time.monotonic()))
+
+    def _call(self, batch):
+        head = batch[0]
+        if len(batch) == 1:
+            return getattr(self.bot, head.method)(*head.args, **head.kwargs)
+        text = "\n\n".join(item.args[1] for item in batch)
+        kwargs = dict(head.kwargs)
+        markup = batch[-1].kwargs.get("reply_markup")
+        if markup is not None:
+            kwargs["reply_markup"] = markup
+        return self.bot.send_message(head.args[0], text, **kwargs)
+
+    def _traced(self, item: _Out, outcome: str, started: float = 0.0, now: float = 0.0):
+        if item.trace is None:
+            return
+        now = now or time.monotonic()
+        self.tracer.record(item.trace, f"telegram:{item.method}", started or now, now,
+                           queued_ms=round(((started or now) - item.enqueued) * 1000, 2),
+                           attempts=item.attempts, outcome=outcome)
+        self.tracer.release(item.trace)
+        item.trace = None
+
+    def _observe(self, item: _Out, now: float):
+        dt = now - item.enqueued
+        self.latency_sum += dt
+        self.latency_counts[bisect_left(LATENCY_BUCKETS, dt)] += 1
+
+    def _run(self):
+        while True:
+            with self._cv:
+                job = self._take()
+                while job is None:
+                    if self._stopping and self._pending == 0:
+                        return
+                    self._cv.wait(self._next_wait())
+                    job = self._take()
+            key, chat, batch = job
+            for item in batch:
+                item.attempts += 1
+            retry_in = 0.0
+            result = error = None
+            started = time.monotonic()
+            try:
+                result = self._call(batch)
+            except ApiTelegramException as e:
+                if e.error_code == 429 and batch[0].attempts < self.max_attempts:
+                    retry_in = _retry_after(e)
+                else:
+                    error = e
+            except Exception as e:
+                error = e
+
+            now = time.monotonic()
+            with self._cv:
+                chat.busy = False
+                if retry_in:
+                    # вернуть в начало очереди чата и подождать, сколько сказал Telegram
+                    self.retried += 1
+                    for item in reversed(batch):
+                        chat.queue.appendleft(item)
+                    self._schedule(key, chat, due=now + retry_in)
+                else:
+                    self._pending -= len(batch)
+                    if error is None:
+                        self.sent += 1
+                        self.merged += len(batch) - 1
+                    else:
+                        self.failed += len(batch)
+                    for item in batch:
+                        self._observe(item, now)
+                        self._traced(item, "ok" if error is None else type(error).__name__, started, now)
+                    if chat.queue:
+                        self._schedule(key, chat)
+                    else:
+                        del self._chats[key]
+                self._cv.notify()
+            if retry_in:
+                continue
+            for item in batch:
+                if error is None:
+                    item.future.set_result(result)
+                else:
+                    item.future.set_exception(error)
+            if error is not None:
+                print(f"⚠️ outbox {batch[0].method} -> {key}: {error}")
+
+    def start(self):
+        with self._cv:
+            if self._threads or self._closed:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"outbox-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout: float = 10.0):
+        """Дослать всё, что в очереди, и остановиться; дальше вызовы -> Future с OutboxClosed."""
+        with self._cv:
+            self._stopping = True
+            self._closed = True
+            self._cv.notify_all()
+        for t in self._threads:
+            t.join(timeout=timeout)
+        self._threads = []
+
+    def depth(self) -> int:
+        return self._pending
+
+    def stats(self) -> dict:
+        done = sum(self.latency_counts)
+        return {
+            "depth": self._pending,
+            "sent": self.sent,
+            "merged": self.merged,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "latency_avg": (self.latency_sum / done) if done else 0.0,
+            "latency_buckets": dict(zip([*map(str, LATENCY_BUCKETS), "+Inf"], self.latency_counts)),
+        }
+
+
+class _BlockingOutbox:
+    """Тот же Outbox, но методы ждут результат (для кода, которому нужен message_id/исключение)."""
+
+    def __init__(self, outbox: Outbox):
+        self._outbox = outbox
+
+    def send_message(self, *args, **kwargs):
+        return self._outbox.send_message(*args, **kwargs).result()
+
+    def edit_message_text(self, *args, **kwargs):
+        return self._outbox.edit_message_text(*args, **kwargs).result()
+
+    def answer_callback_query(self, *args, **kwargs):
+        return self._outbox.answer_callback_query(*args, **kwargs).result()
@@ -0,0 +1,138 @@
+import random
+import threading
+import time
+
+from cache import SingleFlight
+
+
+# =========================
+# PRO-планы на 30 дней (кэш)
+# =========================
+class PlanCache:
+    """
+    PRO-разбор зависит только от результата теста (it/bus/cre/an), поэтому
+    держим пул из variants готовых планов на каждый результат в SQLite
+    (plan_cache) и в памяти. Пользователь получает случайный вариант сразу.
+
+    - устаревшие (старше ttl) варианты отдаём, но в фоне перегенерируем;
+    - генерация одного и того же (result, variant) — single-flight;
+    - warm() на старте догенерирует недостающие варианты.
+
+    generate(result) -> str — сам вызов модели (снаружи).
+    """
+
+    def __init__(self, db, keys, generate, variants: int = 3, ttl: float = 7 * 86400):
+        self.db = db
+        self.keys = tuple(keys)
+        self.generate = generate
+        self.variants = max(1, variants)
+        self.ttl = ttl
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._plans = {}  # result -> {variant: (text, created_ts)}
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+
+    def init_table(self):
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS plan_cache(
+                result TEXT,
+                variant INTEGER,
+                text TEXT,
+                created_ts INTEGER,
+                PRIMARY KEY(result, variant)
+            )
+        """)
+        rows = self.db.all("SELECT result, variant, text, created_ts FROM plan_cache")
+        with self._lock:
+            self._plans = {}
+            for result, variant, text, created_ts in rows:
+                if variant < self.variants:
+                    self._plans.setdefault(result, {})[variant] = (text, int(created_ts or 0))
+
+    def _missing_or_stale(self, result: str):
+        now = time.time()
+        slots = self._plans.get(result, {})
+        return [v for v in range(self.variants)
+                if v not in slots or now - slots[v][1] > self.ttl]
+
+    def _fill(self, result: str, variant: int) -> str:
+        def work():
+            if variant not in self._missing_or_stale(result):
+                # пока ждали очередь, вариант уже сгенерировали
+                return self._plans[result][variant][0]
+            # его мог сгенерировать другой процесс (WORKER_PROCESSES)
+            row = self.db.one(
+                "SELECT text, created_ts FROM plan_cache WHERE result=? AND variant=?", (result, variant))
+            if row and time.time() - int(row[1] or 0) <= self.ttl:
+                with self._lock:
+                    self._plans.setdefault(result, {})[variant] = (row[0], int(row[1] or 0))
+                return row[0]
+            text = (self.generate(result) or "").strip()
+            if not text:
+                raise RuntimeError("empty plan")
+            now = int(time.time())
+            self.db.execute(
+                "INSERT OR REPLACE INTO plan_cache(result, variant, text, created_ts) VALUES(?,?,?,?)",
+                (result, variant, text, now),
+            )
+            with self._lock:
+                self._plans.setdefault(result, {})[variant] = (text, now)
+            self.generated += 1
+            return text
+        return self._flight.do((result, variant), work)
+
+    def _refresh_async(self, result: str, slots):
+        slots = [v for v in slots if not self._flight.in_flight((result, v))]
+        if not slots:
+            return
+
+        def run():
+            for v in slots:
+                try:
+                    self._fill(result, v)
+                except Exception as e:
+                    print(f"⚠️ plan-cache refresh {result}/{v}: {e}")
+
+        threading.Thread(target=run, name=f"plan-refresh-{result}", daemon=True).start()
+
+    def pick(self, result: str):
+        """Готовый план без ожидания или None. Заодно планирует фоновое обновление."""
+        with self._lock:
+            slots = list(self._plans.get(result, {}).values())
+        todo = self._missing_or_stale(result)
+        if todo:
+            self._refresh_async(result, todo)
+        if not slots:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return random.choice(slots)[0]
+
+    def get(self, result: str) -> str:
+        """Как pick(), но при пустом пуле ждёт генерацию (одну на всех)."""
+        text = self.pick(result)
+        if text is not None:
+            return text
+        return self._fill(result, 0)
+
+    def warm(self):
+        """Фоном догенерировать всё недостающее (по одному, без всплеска запросов)."""
+        def run():
+            for result in self.keys:
+                for v in self._missing_or_stale(result):
+                    try:
+                        self._fill(result, v)
+                    except Exception as e:
+                        print(f"⚠️ plan-cache warm {result}/{v}: {e}")
+        threading.Thread(target=run, name="plan-warm", daemon=True).start()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "generated": self.generated,
+            "shared": self._flight.shared,
+            "ready": {k: len(self._plans.get(k, {})) for k in self.keys},
+        }
@@ -0,0 +1,228 @@
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+
+_WORD = re.compile(r"\w+")
+_CYR = "абвгдежзийклмнопрстуфхцчшщэюя"
+_LAT = "abcdefghijklmnopqrstuvwxyz"
+ANON_BASE = 10 ** 12  # анонимные id не пересекаются с настоящими
+
+
+# =========================
+# Запись входящего трафика
+# =========================
+class TrafficRecorder:
+    """
+    Пишет принятые апдейты в файл для replay.py: строка на апдейт,
+    [ts_ms, update] компактным JSON, только дописывание.
+
+    Апдейт урезается до полей, которые читает бот (message / callback_query),
+    и обезличивается:
+
+    - user_id и chat_id -> HMAC(salt, id), стабильно в пределах salt
+      (один пользователь в записи — один и тот же анонимный id);
+    - имя и username -> производные от анонимного id;
+    - свободный текст (вопросы) -> каждое слово заменено псевдословом той
+      же длины (HMAC слова): длина и повторы вопросов сохраняются, смысл —
+      нет. Команды (без аргументов), кнопки (keep_text) и callback_data
+      остаются как есть. mask_text=False — текст целиком как есть.
+
+    record() не ждёт диска: строка в буфер, фоновый поток дописывает пачки
+    раз в flush_interval. После max_bytes запись прекращается.
+    """
+
+    def __init__(self, path: str, salt: str = "", keep_text=None, mask_text: bool = True,
+                 max_bytes: int = 512 * 1024 * 1024, flush_interval: float = 1.0,
+                 capacity: int = 100000):
+        self.path = path
+        self.salt = (salt or os.urandom(16).hex()).encode("utf-8")
+        self.keep_text = keep_text or (lambda text: False)
+        self.mask_text = mask_text
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._buf = deque(maxlen=capacity)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.recorded = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.written = 0
+
+    # ---- обезличивание ----
+    def _digest(self, kind: str, value: str) -> bytes:
+        return hmac.new(self.salt, f"{kind}:{value}".encode("utf-8"), hashlib.sha256).digest()
+
+    def anon_id(self, value: int) -> int:
+        n = ANON_BASE + int.from_bytes(self._digest("id", str(abs(value)))[:6], "big") % ANON_BASE
+        return -n if value < 0 else n
+
+    def _mask_word(self, word: str) -> str:
+        h = self._digest("w", word.lower())
+        if word.isdigit():
+            alphabet = "0123456789"
+        elif any("а" <= ch <= "я" or ch == "ё" for ch in word.lower()):
+            alphabet = _CYR
+        else:
+            alphabet = _LAT
+        # длиннее 32 байт дайджеста — повторяем его
+        return "".join(alphabet[h[i % len(h)] % len(alphabet)] for i in range(len(word)))
+
+    def mask(self, text: str) -> str:
+        return _WORD.sub(lambda m: self._mask_word(m.group()), text)
+
+    def _text(self, text: str) -> str:
+        if not self.mask_text or not text:
+            return text
+        if text.startswith("/"):
+            # /cmd остаётся, аргументы (id, даты) — нет
+            head, sep, rest = text.partition(" ")
+            return head + sep + self.mask(rest)
+        return text if self.keep_text(text) else self.mask(text)
+
+    def _user(self, u: dict) -> dict:
+        uid = self.anon_id(int(u.get("id", 0)))
+        return {"id": uid, "is_bot": bool(u.get("is_bot")), "first_name": "User", "username": f"u{uid}"}
+
+    def _chat(self, c: dict) -> dict:
+        return {"id": self.anon_id(int(c.get("id", 0))), "type": c.get("type", "private")}
+
+    def _message(self, m: dict, with_text: bool = True) -> dict:
+        res = {"message_id": m.get("message_id", 0), "date": m.get("date", 0), "chat": self._chat(m.get("chat") or {})}
+        if m.get("from"):
+            res["from"] = self._user(m["from"])
+        if with_text and "text" in m:
+            res["text"] = self._text(m["text"])
+            # длины при маскировке не меняются — смещения entities верны
+            ents = [e for e in m.get("entities") or () if e.get("type") == "bot_command"]
+            if ents:
+                res["entities"] = [{"type": e["type"], "offset": e["offset"], "length": e["length"]} for e in ents]
+        return res
+
+    def anonymize(self, data: dict):
+        """Урезанный обезличенный апдейт или None (тип апдейта бот не обрабатывает)."""
+        if data.get("message"):
+            return {"update_id": data.get("update_id", 0), "message": self._message(data["message"])}
+        call = data.get("callback_query")
+        if call:
+            res = {"id": str(call.get("id", "")), "chat_instance": "r", "data": call.get("data", ""),
+                   "from": self._user(call.get("from") or {})}
+            if call.get("message"):
+                res["message"] = self._message(call["message"], with_text=False)
+            return {"update_id": data.get("update_id", 0), "callback_query": res}
+        return None
+
+    # ---- запись ----
+    def record(self, data: dict):
+        if self._size >= self.max_bytes:
+            self.skipped += 1
+            return
+        try:
+            update = self.anonymize(data)
+        except (TypeError, ValueError, AttributeError):
+            update = None
+        if update is None:
+            self.skipped += 1
+            return
+        buf = self._buf
+        if len(buf) == buf.maxlen:
+            self.dropped += 1
+        buf.append((int(time.time() * 1000), update))
+        self.recorded += 1
+        if self._thread is None:
+            self.start()
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            lines = []
+            buf = self._buf
+            while buf:
+                try:
+                    lines.append(json.dumps(buf.popleft(), ensure_ascii=False, separators=(",", ":")))
+                except IndexError:
+                    break
+            if not lines:
+                return 0
+            chunk = ("\n".join(lines) + "\n").encode("utf-8")
+            with open(self.path, "ab") as f:
+                f.write(chunk)
+            self._size += len(chunk)
+            self.written += len(lines)
+            return len(lines)
+
+    def wrap(self, target):
+        """Тот же приёмник (UpdateDispatcher / ProcessRouter), но принятые апдейты пишутся."""
+        return _RecordingIngress(target, self)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"⚠️ recorder: {e}")
+
+    def start(self):
+        with self._flush_lock:
+            if self._thread is None and not self._stop.is_set():
+                self._thread = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "recorded": self.recorded,
+            "written": self.written,
+            "pending": len(self._buf),
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+            "bytes": self._size,
+        }
+
+
+class _RecordingIngress:
+    """submit_json -> приёмник; принятое (True) -> recorder. Остальное — как у приёмника."""
+
+    def __init__(self, target, recorder: TrafficRecorder):
+        self._target = target
+        self._recorder = recorder
+
+    def submit_json(self, data: dict, *args, **kwargs) -> bool:
+        accepted = self._target.submit_json(data, *args, **kwargs)
+        # непринятый апдейт Telegram пришлёт ещё раз — тогда и запишем
+        if accepted:
+            self._recorder.record(data)
+        return accepted
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+def read_recording(path: str):
+    """(ts_ms, update) по порядку записи; битые строки (обрыв при падении) пропускаются."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                ts, update = json.loads(line)
+            except ValueError:
+                continue
+            yield int(ts), update
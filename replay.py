@@ -0,0 +1,267 @@
+"""
+Повтор записанного трафика (RECORD_PATH) против локальных заглушек.
+
+    python replay.py traffic.jsonl --speed 10
+    python replay.py traffic.jsonl --speed 50 --clone 4 --ai-latency 1.5   # «рекламный всплеск»
+
+- апдейты подаются в тот же диспетчер, что и в проде (классы допуска,
+  дедлайны, сброс опоздавших), с исходными интервалами / speed;
+- паузы длиннее --max-gap (ночь, рестарт между записями) сжимаются;
+- --clone K — каждого пользователя повторить K раз под другими id
+  (трафик в K раз больше, с той же формой);
+- Telegram и OpenAI — заглушки из bench.py, база — во временном каталоге.
+
+В отчёте: пропускная способность, задержка от поступления апдейта до
+конца хендлера (p50/p90/p99 по видам), ожидание и ответы AI, ошибки,
+сброшенные и непринятые апдейты, отставание самого повтора от графика.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import threading
+import time
+
+from bench import FakeTelegram, StubOpenAI, percentile, prepare_env, wait_idle
+from recorder import ANON_BASE, read_recording
+
+
+def load(path: str, max_gap: float, limit: int = 0):
+    """[(сдвиг от начала в секундах, update)] с паузами не длиннее max_gap."""
+    res = []
+    prev = None
+    offset = 0.0
+    for ts, update in read_recording(path):
+        if prev is not None:
+            offset += min(max(0.0, (ts - prev) / 1000.0), max_gap)
+        prev = ts
+        res.append((offset, update))
+        if limit and len(res) >= limit:
+            break
+    return res
+
+
+def _shift(obj: dict, key: str, k: int):
+    if obj and key in obj:
+        v = obj[key]
+        obj[key] = v + k * ANON_BASE if v >= 0 else v - k * ANON_BASE
+
+
+def clone(update: dict, k: int, update_id: int) -> dict:
+    """Копия апдейта для k-го клона пользователя (k=0 — как есть, но с новым update_id)."""
+    u = json.loads(json.dumps(update))
+    u["update_id"] = update_id
+    for part in ("message", "callback_query"):
+        obj = u.get(part)
+        if not obj:
+            continue
+        _shift(obj.get("from"), "id", k)
+        msg = obj if part == "message" else obj.get("message")
+        if msg:
+            _shift(msg.get("chat"), "id", k)
+        if part == "callback_query":
+            obj["id"] = f"{obj.get('id', '')}:{k}"
+    return u
+
+
+def kind_of(update: dict, buttons) -> str:
+    call = update.get("callback_query")
+    if call is not None:
+        return "test" if (call.get("data") or "").startswith("test") else "callback"
+    text = (update.get("message") or {}).get("text") or ""
+    if text.startswith("/"):
+        return "command"
+    return "button" if text in buttons else "question"
+
+
+def _hist_quantiles(B, name: str):
+    """{label: (n, p50, p99)} из гистограмм bot.metrics."""
+    from metrics import quantile
+    _, hists = B.metrics.snapshot()
+    res = {}
+    for (hname, labels), h in sorted(hists.items()):
+        n = sum(h[:-1])
+        if hname != name or not n:
+            continue
+        bounds = B.metrics.buckets(hname)
+        label = ",".join(str(v) for _, v in labels)
+        res[label] = (n, quantile(bounds, h, 0.5), quantile(bounds, h, 0.99))
+    return res
+
+
+# =========================
+# Прогон
+# =========================
+def run(args) -> dict:
+    stub = StubOpenAI(args.ai_latency, args.ai_tokens, args.ai_token_delay).start()
+    tmp = tempfile.mkdtemp(prefix="capitalmind-replay-")
+    prepare_env(stub.base_url, tmp, real_limits=args.real_limits, extra={
+        "UPDATE_WORKERS": str(args.workers),
+        "STORAGE": args.storage,
+        "RECORD_PATH": "",
+    })
+    tg = FakeTelegram(args.tg_latency).install()
+
+    import telebot
+    import bot as B
+
+    B.startup(warm=False)
+    B.bot.threaded = False
+
+    recording = load(args.recording, args.max_gap, args.limit)
+    schedule = []
+    ids = iter(range(1, 1 << 62))
+    for offset, update in recording:
+        for k in range(args.clone):
+            schedule.append((offset / args.speed, clone(update, k, next(ids))))
+    schedule.sort(key=lambda x: x[0])
+
+    lock = threading.Lock()
+    arrived = {}    # update_id -> (kind, время подачи)
+    lat = {}        # kind -> [секунды от подачи до конца хендлера]
+    errors = {}     # тип исключения -> число
+    done = [0]
+
+    def handle(update):
+        t_err = None
+        try:
+            B.bot.process_new_updates([update])
+        except Exception as e:
+            t_err = type(e).__name__
+        finally:
+            now = time.perf_counter()
+            kind, t0 = arrived[update.update_id]
+            with lock:
+                lat.setdefault(kind, []).append(now - t0)
+                if t_err:
+                    errors[t_err] = errors.get(t_err, 0) + 1
+                done[0] += 1
+
+    def on_shed(update, cls):
+        B.shed_update(update, cls)
+        with lock:
+            done[0] += 1
+
+    dispatcher = B.make_dispatcher(handle)
+    dispatcher.on_shed = on_shed
+    dispatcher.start()
+
+    lag = []
+    rejected = 0
+    start = time.perf_counter()
+    for at, raw in schedule:
+        delay = start + at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        now = time.perf_counter()
+        lag.append(max(0.0, now - start - at))
+        update = telebot.types.Update.de_json(raw)
+        arrived[update.update_id] = (kind_of(raw, B.REPLY_BUTTONS), now)
+        # в проде непринятый апдейт Telegram повторит позже; здесь — просто считаем
+        if not dispatcher.submit(update):
+            rejected += 1
+            with lock:
+                done[0] += 1
+    fed = time.perf_counter() - start
+    drained = wait_idle(B, lambda: done[0], len(schedule), args.timeout)
+    elapsed = time.perf_counter() - start
+    dispatcher.stop()
+    B.shutdown()
+    stub.shutdown()
+
+    all_lat = [x for v in lat.values() for x in v]
+    ai = B.ai_pool.stats()
+
+    def pcts(v):
+        return {q: round(percentile(v, p) * 1000, 1) for q, p in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99))}
+
+    return {
+        "recording": args.recording,
+        "updates": len(schedule),
+        "users": len({(u.get("message") or u.get("callback_query") or {}).get("from", {}).get("id")
+                      for _, u in schedule}),
+        "speed": args.speed,
+        "recorded_span_s": round(recording[-1][0], 1) if recording else 0.0,
+        "fed_s": round(fed, 2),
+        "elapsed_s": round(elapsed, 2),
+        "drained": drained,
+        "updates_per_s": round(len(schedule) / fed, 1) if fed else 0.0,
+        "feed_lag_p99_ms": round(percentile(lag, 0.99) * 1000, 1),
+        "latency": pcts(all_lat),
+        "by_kind": {kind: {"n": len(v), **pcts(v)} for kind, v in sorted(lat.items())},
+        "errors": {
+            "handler": dict(sorted(errors.items())),
+            "rejected": rejected,
+            "shed": dispatcher.shed,
+            "ai_late": ai["late"],
+            "ai_busy": ai["rejected"],
+            "ai_failed": ai["failed"],
+            "outbox_failed": B.out.failed,
+            "outbox_dropped": B.out.dropped,
+        },
+        "ai": {
+            "requests": stub.requests,
+            "completed": ai["completed"],
+            "wait": {k: {"n": n, "p50_s": p50, "p99_s": p99}
+                     for k, (n, p50, p99) in _hist_quantiles(B, "admission_wait_seconds").items()},
+            "openai": {k: {"n": n, "p50_s": p50, "p99_s": p99}
+                       for k, (n, p50, p99) in _hist_quantiles(B, "openai_seconds").items()},
+        },
+        "telegram_calls": dict(sorted(tg.calls.items())),
+    }
+
+
+def print_report(r: dict):
+    print(f"{r['recording']}: {r['updates']} апдейтов, {r['users']} пользователей, "
+          f"запись {r['recorded_span_s']}s x{r['speed']:g} -> подано за {r['fed_s']}s")
+    print(f"throughput: {r['updates_per_s']} updates/s, всё обработано за {r['elapsed_s']}s"
+          + ("" if r["drained"] else "  (НЕ дождались очередей, см. --timeout)"))
+    print(f"отставание подачи от графика: p99 {r['feed_lag_p99_ms']} ms")
+    lat = r["latency"]
+    print(f"latency (поступление -> конец хендлера): p50 {lat['p50_ms']} ms, p90 {lat['p90_ms']} ms, p99 {lat['p99_ms']} ms")
+    print(f"{'kind':<10}{'n':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+    for kind, k in r["by_kind"].items():
+        print(f"{kind:<10}{k['n']:>7}{k['p50_ms']:>10}{k['p90_ms']:>10}{k['p99_ms']:>10}")
+    e = r["errors"]
+    print("ошибки: " + ", ".join(f"{k}={v}" for k, v in e.items() if k != "handler")
+          + (f", handler={e['handler']}" if e["handler"] else ""))
+    ai = r["ai"]
+    print(f"AI: {ai['requests']} запросов к OpenAI, ответов {ai['completed']}")
+    for stage, rows in (("ожидание", ai["wait"]), ("openai", ai["openai"])):
+        for label, v in rows.items():
+            print(f"  {stage} {label}: n={v['n']} p50≤{v['p50_s']:g}s p99≤{v['p99_s']:g}s")
+    print("telegram:", ", ".join(f"{m}={n}" for m, n in r["telegram_calls"].items()))
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Повтор записанного трафика CapitalMindBot")
+    p.add_argument("recording", help="файл RECORD_PATH")
+    p.add_argument("--speed", type=float, default=1.0, help="ускорение: 1 — как было, 100 — в 100 раз быстрее")
+    p.add_argument("--max-gap", type=float, default=5.0, help="паузы длиннее (в секундах записи) сжимаются до неё")
+    p.add_argument("--clone", type=int, default=1, help="повторить каждого пользователя K раз")
+    p.add_argument("--limit", type=int, default=0, help="только первые N апдейтов записи")
+    p.add_argument("--workers", type=int, default=8, help="потоков обработки апдейтов")
+    p.add_argument("--ai-latency", type=float, default=0.3, help="секунд до первого токена")
+    p.add_argument("--ai-tokens", type=int, default=120)
+    p.add_argument("--ai-token-delay", type=float, default=0.002)
+    p.add_argument("--tg-latency", type=float, default=0.0, help="задержка каждого вызова Telegram")
+    p.add_argument("--storage", default="sqlite", choices=("sqlite", "sharded", "memory"))
+    p.add_argument("--real-limits", action="store_true", help="лимиты outbox/AI как в проде")
+    p.add_argument("--timeout", type=float, default=300)
+    p.add_argument("--json", action="store_true")
+    args = p.parse_args(argv)
+    if not 1 <= args.speed <= 100:
+        p.error("--speed: от 1 до 100")
+    if args.clone < 1:
+        p.error("--clone: от 1")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    sys.exit(0 if report["drained"] else 1)
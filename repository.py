@@ -0,0 +1,624 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from storage import Database, UserRecord
+
+
+# =========================
+# Хранилище users / test_state
+# =========================
+USER_COLUMNS = "user_id, username, first_name, created_ts, pro_until_ts, mode"
+TEST_COLUMNS = "user_id, step, score_it, score_bus, score_cre, score_an, in_test"
+
+
+class UserRepository:
+    """
+    Всё, что бот делает с users, test_state и counters, — через эти методы.
+    Реализации: SqliteUserRepo (один файл, как раньше), ShardedUserRepo
+    (N файлов по user_id % N — писатели разных шардов не ждут друг друга)
+    и MemoryUserRepo (словари в памяти — для тестов и бенчмарков).
+
+    Фильтры выборок (user_ids/count_users), все необязательные:
+      created_since — created_ts >= ...
+      pro_after     — pro_until_ts > ...
+      pro_upto      — pro_until_ts <= ...
+    """
+
+    name = ""
+
+    def init(self, questions: int):
+        """Таблицы/индексы; счётчики при первом запуске досчитываются по данным."""
+        raise NotImplementedError
+
+    def tx(self, user_id: int = 0):
+        """Транзакция, в которой живут строки user_id (вложенные переиспользуются)."""
+        raise NotImplementedError
+
+    def on_rollback(self, hook):
+        raise NotImplementedError
+
+    def on_connect(self, hook):
+        """hook(con) для новых sqlite-соединений (в памяти соединений нет)."""
+
+    def get(self, user_id: int):
+        raise NotImplementedError
+
+    def insert(self, rec: UserRecord):
+        """Новый пользователь + пустая строка test_state."""
+        raise NotImplementedError
+
+    def update_profiles(self, rows):
+        """[(username, first_name, user_id)] — пачкой (write-behind)."""
+        raise NotImplementedError
+
+    def set_mode(self, user_id: int, mode: str):
+        raise NotImplementedError
+
+    def extend_pro(self, user_ids, now: int, delta: int) -> int:
+        """pro_until_ts = max(pro_until_ts, now) + delta; число обновлённых строк."""
+        raise NotImplementedError
+
+    def user_ids(self, created_since=None, pro_after=None, pro_upto=None):
+        raise NotImplementedError
+
+    def count_users(self, created_since=None, pro_after=None, pro_upto=None) -> int:
+        raise NotImplementedError
+
+    def pro_expiring(self, after: int, upto: int):
+        """[(user_id, pro_until_ts)] с after < pro_until_ts <= upto (по индексу)."""
+        raise NotImplementedError
+
+    def bump(self, name: str, delta: int = 1, user_id: int = 0):
+        raise NotImplementedError
+
+    def counter(self, name: str) -> int:
+        raise NotImplementedError
+
+    def load_test(self, user_id: int):
+        """(step, score_it, score_bus, score_cre, score_an, in_test) или None."""
+        raise NotImplementedError
+
+    def save_test(self, row):
+        """row = (step, score_it, score_bus, score_cre, score_an, in_test, user_id)."""
+        raise NotImplementedError
+
+    # ---- миграция ----
+    def export_rows(self):
+        """(users, test_state, counters) — итераторы строк в порядке *_COLUMNS и dict."""
+        raise NotImplementedError
+
+    def import_rows(self, users, tests, counters: dict, batch: int = 1000) -> int:
+        raise NotImplementedError
+
+    def is_empty(self) -> bool:
+        return self.count_users() == 0
+
+    def clear(self):
+        """Удалить всех пользователей, test_state и счётчики (перед перезаписью устаревшей копии)."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _where(created_since, pro_after, pro_upto):
+    # только фиксированные куски SQL, значения — параметрами
+    conds, params = [], []
+    if created_since is not None:
+        conds.append("created_ts >= ?")
+        params.append(created_since)
+    if pro_after is not None:
+        conds.append("pro_until_ts > ?")
+        params.append(pro_after)
+    if pro_upto is not None:
+        conds.append("pro_until_ts <= ?")
+        params.append(pro_upto)
+    return (" WHERE " + " AND ".join(conds) if conds else ""), tuple(params)
+
+
+def _batches(rows, n: int):
+    batch = []
+    for row in rows:
+        batch.append(tuple(row))
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# =========================
+# SQLite: один файл
+# =========================
+class SqliteUserRepo(UserRepository):
+    """
+    Таблицы в переданной Database. Для одного файла это та же база, где
+    plan_cache/ai_usage, поэтому tx() хендлера по-прежнему одна транзакция.
+    """
+
+    name = "sqlite"
+
+    SAVE_TEST_SQL = """
+        UPDATE test_state
+        SET step=?, score_it=?, score_bus=?, score_cre=?, score_an=?, in_test=?
+        WHERE user_id=?
+    """
+    BUMP_SQL = """
+        INSERT INTO counters(name, value) VALUES(?, ?)
+        ON CONFLICT(name) DO UPDATE SET value=value+excluded.value
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def init(self, questions: int):
+        db = self.db
+        with db.tx():
+            db.execute("""
+            CREATE TABLE IF NOT EXISTS users(
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                created_ts INTEGER,
+                pro_until_ts INTEGER DEFAULT 0,
+                mode TEXT DEFAULT 'career'  -- career | none
+            )
+            """)
+
+            db.execute("""
+            CREATE TABLE IF NOT EXISTS test_state(
+                user_id INTEGER PRIMARY KEY,
+                step INTEGER DEFAULT 0,
+                score_it INTEGER DEFAULT 0,
+                score_bus INTEGER DEFAULT 0,
+                score_cre INTEGER DEFAULT 0,
+                score_an INTEGER DEFAULT 0,
+                in_test INTEGER DEFAULT 0
+            )
+            """)
+
+            # Для админ-аналитики и массовых выдач PRO: диапазонные запросы по индексам
+            db.execute("CREATE INDEX IF NOT EXISTS idx_users_pro_until ON users(pro_until_ts)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_ts)")
+
+            # Счётчики, которые иначе пришлось бы считать полным сканом
+            db.execute("""
+            CREATE TABLE IF NOT EXISTS counters(
+                name TEXT PRIMARY KEY,
+                value INTEGER DEFAULT 0
+            )
+            """)
+            # первый запуск на старой базе — один раз досчитываем по таблицам
+            db.execute("""
+                INSERT OR IGNORE INTO counters(name, value)
+                SELECT 'users_total', COUNT(*) FROM users
+            """)
+            db.execute("""
+                INSERT OR IGNORE INTO counters(name, value)
+                SELECT 'tests_completed', COUNT(*) FROM test_state WHERE in_test=0 AND step>=?
+            """, (questions,))
+            db.execute("INSERT OR IGNORE INTO counters(name, value) VALUES('tests_started', 0)")
+
+    def tx(self, user_id: int = 0):
+        return self.db.tx()
+
+    def on_rollback(self, hook):
+        self.db.on_rollback(hook)
+
+    def on_connect(self, hook):
+        self.db.on_connect(hook)
+
+    def get(self, user_id: int):
+        row = self.db.one(f"SELECT {USER_COLUMNS} FROM users WHERE user_id=?", (user_id,))
+        return UserRecord(*row) if row else None
+
+    def insert(self, rec: UserRecord):
+        self.db.execute(f"""
+            INSERT INTO users({USER_COLUMNS})
+            VALUES(?,?,?,?,?,?)
+        """, (rec.user_id, rec.username, rec.first_name, rec.created_ts, rec.pro_until_ts, rec.mode))
+        self.db.execute(f"""
+            INSERT OR IGNORE INTO test_state({TEST_COLUMNS})
+            VALUES(?,?,?,?,?,?,?)
+        """, (rec.user_id, 0, 0, 0, 0, 0, 0))
+
+    def update_profiles(self, rows):
+        with self.db.tx():
+            self.db.executemany("UPDATE users SET username=?, first_name=? WHERE user_id=?", rows)
+
+    def set_mode(self, user_id: int, mode: str):
+        self.db.execute("UPDATE users SET mode=? WHERE user_id=?", (mode, user_id))
+
+    def extend_pro(self, user_ids, now: int, delta: int) -> int:
+        if not user_ids:
+            return 0
+        with self.db.tx():
+            cur = self.db.executemany(
+                "UPDATE users SET pro_until_ts=MAX(pro_until_ts, ?)+? WHERE user_id=?",
+                [(now, delta, uid) for uid in user_ids],
+            )
+        return cur.rowcount
+
+    def user_ids(self, created_since=None, pro_after=None, pro_upto=None):
+        where, params = _where(created_since, pro_after, pro_upto)
+        return [r[0] for r in self.db.all("SELECT user_id FROM users" + where, params)]
+
+    def count_users(self, created_since=None, pro_after=None, pro_upto=None) -> int:
+        where, params = _where(created_since, pro_after, pro_upto)
+        return int(self.db.one("SELECT COUNT(*) FROM users" + where, params)[0])
+
+    def pro_expiring(self, after: int, upto: int):
+        return self.db.all(
+            "SELECT user_id, pro_until_ts FROM users WHERE pro_until_ts > ? AND pro_until_ts <= ?",
+            (after, upto),
+        )
+
+    def bump(self, name: str, delta: int = 1, user_id: int = 0):
+        self.db.execute(self.BUMP_SQL, (name, delta))
+
+    def counter(self, name: str) -> int:
+        row = self.db.one("SELECT value FROM counters WHERE name=?", (name,))
+        return int(row[0]) if row else 0
+
+    def load_test(self, user_id: int):
+        return self.db.one("""
+            SELECT step, score_it, score_bus, score_cre, score_an, in_test
+            FROM test_state WHERE user_id=?
+        """, (user_id,))
+
+    def save_test(self, row):
+        self.db.execute(self.SAVE_TEST_SQL, row)
+
+    def export_rows(self):
+        con = self.db.con
+        counters = dict(con.execute("SELECT name, value FROM counters").fetchall())
+        return (con.execute(f"SELECT {USER_COLUMNS} FROM users ORDER BY user_id"),
+                con.execute(f"SELECT {TEST_COLUMNS} FROM test_state ORDER BY user_id"),
+                counters)
+
+    def import_rows(self, users, tests, counters: dict, batch: int = 1000) -> int:
+        n = 0
+        for rows in _batches(users, batch):
+            with self.db.tx():
+                self.db.executemany(
+                    f"INSERT OR REPLACE INTO users({USER_COLUMNS}) VALUES(?,?,?,?,?,?)", rows)
+            n += len(rows)
+        for rows in _batches(tests, batch):
+            with self.db.tx():
+                self.db.executemany(
+                    f"INSERT OR REPLACE INTO test_state({TEST_COLUMNS}) VALUES(?,?,?,?,?,?,?)", rows)
+        with self.db.tx():
+            self.db.executemany(
+                "INSERT OR REPLACE INTO counters(name, value) VALUES(?, ?)", list(counters.items()))
+        return n
+
+    def clear(self):
+        with self.db.tx():
+            for table in ("users", "test_state", "counters"):
+                self.db.execute(f"DELETE FROM {table}")
+
+    def close(self):
+        self.db.close_all()
+
+
+# =========================
+# SQLite: N файлов по user_id
+# =========================
+class ShardedUserRepo(UserRepository):
+    """
+    Строки пользователя живут в шарде user_id % N — у каждого шарда свой
+    файл и свой write-lock, поэтому писатели разных пользователей идут
+    параллельно. С WORKER_PROCESSES=N каждый воркер пишет в «свой» шард.
+
+    Счётчики тоже по шардам (bump — в шард пользователя, counter — сумма),
+    так горячая строка counters не становится общим узким местом.
+    Выборки и массовые PRO расходятся по всем шардам.
+
+    Число шардов записано в каждом файле: с другим N пользователи
+    «переехали» бы в чужие файлы, поэтому такой запуск падает сразу.
+    """
+
+    name = "sharded"
+
+    def __init__(self, paths, **db_kwargs):
+        if not paths:
+            raise ValueError("no shards")
+        self.shards = [SqliteUserRepo(Database(p, **db_kwargs)) for p in paths]
+        self.n = len(self.shards)
+
+    def shard(self, user_id: int) -> SqliteUserRepo:
+        return self.shards[user_id % self.n]
+
+    def init(self, questions: int):
+        for i, s in enumerate(self.shards):
+            s.init(questions)
+            db = s.db
+            with db.tx():
+                db.execute("CREATE TABLE IF NOT EXISTS shard_meta(key TEXT PRIMARY KEY, value INTEGER)")
+                db.execute("INSERT OR IGNORE INTO shard_meta(key, value) VALUES('shards', ?)", (self.n,))
+                db.execute("INSERT OR IGNORE INTO shard_meta(key, value) VALUES('index', ?)", (i,))
+                meta = dict(db.all("SELECT key, value FROM shard_meta"))
+            self._check_meta(db, i, meta)
+
+    def check_layout(self):
+        """Та же проверка числа шардов, что в init, но без записи (источник migrate_storage)."""
+        for i, s in enumerate(self.shards):
+            self._check_meta(s.db, i, dict(s.db.all("SELECT key, value FROM shard_meta")))
+
+    def _check_meta(self, db: Database, i: int, meta: dict):
+        if meta != {"shards": self.n, "index": i}:
+            raise RuntimeError(
+                f"{db.path}: shard {meta.get('index')} of {meta.get('shards')}, "
+                f"expected {i} of {self.n} (STORAGE_SHARDS changed? use migrate_storage.py)"
+            )
+
+    def tx(self, user_id: int = 0):
+        return self.shard(user_id).tx()
+
+    def on_rollback(self, hook):
+        for s in self.shards:
+            s.on_rollback(hook)
+
+    def on_connect(self, hook):
+        for s in self.shards:
+            s.on_connect(hook)
+
+    def get(self, user_id: int):
+        return self.shard(user_id).get(user_id)
+
+    def insert(self, rec: UserRecord):
+        self.shard(rec.user_id).insert(rec)
+
+    def _group(self, items, key):
+        groups = {}
+        for item in items:
+            groups.setdefault(key(item) % self.n, []).append(item)
+        return groups
+
+    def update_profiles(self, rows):
+        for i, part in self._group(rows, lambda r: r[2]).items():
+            self.shards[i].update_profiles(part)
+
+    def set_mode(self, user_id: int, mode: str):
+        self.shard(user_id).set_mode(user_id, mode)
+
+    def extend_pro(self, user_ids, now: int, delta: int) -> int:
+        # по транзакции на шард: атомарно внутри шарда, не между ними
+        return sum(
+            self.shards[i].extend_pro(part, now, delta)
+            for i, part in self._group(user_ids, int).items()
+        )
+
+    def user_ids(self, created_since=None, pro_after=None, pro_upto=None):
+        res = []
+        for s in self.shards:
+            res.extend(s.user_ids(created_since, pro_after, pro_upto))
+        return res
+
+    def count_users(self, created_since=None, pro_after=None, pro_upto=None) -> int:
+        return sum(s.count_users(created_since, pro_after, pro_upto) for s in self.shards)
+
+    def pro_expiring(self, after: int, upto: int):
+        res = []
+        for s in self.shards:
+            res.extend(s.pro_expiring(after, upto))
+        return res
+
+    def bump(self, name: str, delta: int = 1, user_id: int = 0):
+        self.shard(user_id).bump(name, delta)
+
+    def counter(self, name: str) -> int:
+        return sum(s.counter(name) for s in self.shards)
+
+    def load_test(self, user_id: int):
+        return self.shard(user_id).load_test(user_id)
+
+    def save_test(self, row):
+        self.shard(row[-1]).save_test(row)
+
+    def export_rows(self):
+        counters = {}
+        for s in self.shards:
+            for k, v in s.export_rows()[2].items():
+                counters[k] = counters.get(k, 0) + v
+
+        def rows(which):
+            for s in self.shards:
+                yield from s.export_rows()[which]
+
+        return rows(0), rows(1), counters
+
+    def import_rows(self, users, tests, counters: dict, batch: int = 1000) -> int:
+        n = 0
+        for rows in _batches(users, batch):
+            for i, part in self._group(rows, lambda r: r[0]).items():
+                n += self.shards[i].import_rows(part, (), {}, batch)
+        for rows in _batches(tests, batch):
+            for i, part in self._group(rows, lambda r: r[0]).items():
+                self.shards[i].import_rows((), part, {}, batch)
+        # счётчик — сумма по шардам: итог кладём в нулевой, остальные обнуляем
+        for i, s in enumerate(self.shards):
+            s.import_rows((), (), counters if i == 0 else dict.fromkeys(counters, 0), batch)
+        return n
+
+    def clear(self):
+        for s in self.shards:
+            s.clear()
+
+    def close(self):
+        for s in self.shards:
+            s.close()
+
+
+# =========================
+# В памяти
+# =========================
+class MemoryUserRepo(UserRepository):
+    """
+    Словари под одним lock'ом: без файлов и fsync — для тестов и бенчмарков.
+    Отката нет: tx() только зовёт rollback-хуки (сбросить кэши), записи,
+    сделанные до исключения, остаются. Данные живут до конца процесса
+    (с WORKER_PROCESSES у каждого воркера были бы свои — не используем).
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}     # user_id -> tuple в порядке USER_COLUMNS
+        self._tests = {}     # user_id -> (step, 4 x score, in_test)
+        self._counters = {}
+        self._rollback_hooks = []
+        self._local = threading.local()
+
+    def init(self, questions: int):
+        with self._lock:
+            self._counters.setdefault("users_total", len(self._users))
+            self._counters.setdefault(
+                "tests_completed",
+                sum(1 for t in self._tests.values() if not t[5] and t[0] >= questions),
+            )
+            self._counters.setdefault("tests_started", 0)
+
+    @contextmanager
+    def tx(self, user_id: int = 0):
+        local = self._local
+        local.depth = getattr(local, "depth", 0) + 1
+        try:
+            yield self
+        except BaseException:
+            local.depth -= 1
+            if local.depth == 0:
+                for hook in self._rollback_hooks:
+                    hook()
+            raise
+        local.depth -= 1
+
+    def on_rollback(self, hook):
+        self._rollback_hooks.append(hook)
+
+    def get(self, user_id: int):
+        row = self._users.get(user_id)
+        # копия: кэш бота правит свои записи сам (write-through)
+        return UserRecord(*row) if row else None
+
+    def insert(self, rec: UserRecord):
+        with self._lock:
+            if rec.user_id in self._users:
+                raise KeyError(rec.user_id)
+            self._users[rec.user_id] = (rec.user_id, rec.username, rec.first_name,
+                                        rec.created_ts, rec.pro_until_ts, rec.mode)
+            self._tests.setdefault(rec.user_id, (0, 0, 0, 0, 0, 0))
+
+    def _update(self, user_id: int, **changes) -> bool:
+        # под self._lock
+        row = self._users.get(user_id)
+        if row is None:
+            return False
+        rec = UserRecord(*row)
+        for k, v in changes.items():
+            setattr(rec, k, v(rec) if callable(v) else v)
+        self._users[user_id] = (rec.user_id, rec.username, rec.first_name,
+                                rec.created_ts, rec.pro_until_ts, rec.mode)
+        return True
+
+    def update_profiles(self, rows):
+        with self._lock:
+            for username, first_name, uid in rows:
+                self._update(uid, username=username, first_name=first_name)
+
+    def set_mode(self, user_id: int, mode: str):
+        with self._lock:
+            self._update(user_id, mode=mode)
+
+    def extend_pro(self, user_ids, now: int, delta: int) -> int:
+        with self._lock:
+            return sum(
+                self._update(uid, pro_until_ts=lambda r: max(r.pro_until_ts, now) + delta)
+                for uid in user_ids
+            )
+
+    def _select(self, created_since, pro_after, pro_upto):
+        with self._lock:
+            rows = list(self._users.values())
+        for r in rows:
+            if created_since is not None and r[3] < created_since:
+                continue
+            if pro_after is not None and r[4] <= pro_after:
+                continue
+            if pro_upto is not None and r[4] > pro_upto:
+                continue
+            yield r[0]
+
+    def user_ids(self, created_since=None, pro_after=None, pro_upto=None):
+        return list(self._select(created_since, pro_after, pro_upto))
+
+    def count_users(self, created_since=None, pro_after=None, pro_upto=None) -> int:
+        return sum(1 for _ in self._select(created_since, pro_after, pro_upto))
+
+    def pro_expiring(self, after: int, upto: int):
+        with self._lock:
+            return [(r[0], r[4]) for r in self._users.values() if after < r[4] <= upto]
+
+    def bump(self, name: str, delta: int = 1, user_id: int = 0):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + delta
+
+    def counter(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def load_test(self, user_id: int):
+        return self._tests.get(user_id)
+
+    def save_test(self, row):
+        with self._lock:
+            if row[-1] in self._tests:
+                self._tests[row[-1]] = tuple(row[:-1])
+
+    def export_rows(self):
+        with self._lock:
+            users = sorted(self._users.values())
+            tests = [(uid, *t) for uid, t in sorted(self._tests.items())]
+            return iter(users), iter(tests), dict(self._counters)
+
+    def import_rows(self, users, tests, counters: dict, batch: int = 1000) -> int:
+        n = 0
+        with self._lock:
+            for row in users:
+                self._users[row[0]] = tuple(row)
+                n += 1
+            for row in tests:
+                self._tests[row[0]] = tuple(row[1:])
+            self._counters.update(counters)
+        return n
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._tests.clear()
+            self._counters.clear()
+
+
+# =========================
+# Выбор при старте
+# =========================
+def shard_paths(db_path: str, shards: int):
+    """data.db -> data.users0.db, data.users1.db, ..."""
+    root, ext = os.path.splitext(db_path)
+    return [f"{root}.users{i}{ext or '.db'}" for i in range(shards)]
+
+
+def open_repository(kind: str, db: Database, shards: int = 4, **db_kwargs) -> UserRepository:
+    """
+    kind: sqlite  — таблицы в основной базе db (как было);
+          sharded — shards файлов рядом с db.path;
+          memory  — в памяти процесса.
+    """
+    if kind == "sqlite":
+        return SqliteUserRepo(db)
+    if kind == "sharded":
+        return ShardedUserRepo(shard_paths(db.path, shards), **db_kwargs)
+    if kind == "memory":
+        return MemoryUserRepo()
+    raise ValueError(f"unknown STORAGE={kind!r} (sqlite | sharded | memory)")
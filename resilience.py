@@ -0,0 +1,279 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+# =========================
+# Ошибки
+# =========================
+class CircuitOpen(Exception):
+    """OpenAI признан недоступным — даже не пытаемся, сразу отдаём запасной ответ."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Не уложились в дедлайн tier'а (с учётом повторов)."""
+
+
+class StreamCut(DeadlineExceeded):
+    """Стрим не дочитан до дедлайна; text — то, что успело прийти (пользователь его уже видел)."""
+
+    def __init__(self, text: str):
+        super().__init__("stream cut at deadline")
+        self.text = text
+
+
+def is_retryable(e: Exception) -> bool:
+    """429, 408 и 5xx, таймауты и обрывы соединения — повторяем; 400/401/404 — нет."""
+    status = getattr(e, "status_code", None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    name = type(e).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+def _retry_after(e: Exception):
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# =========================
+# Circuit breaker
+# =========================
+class CircuitBreaker:
+    """
+    closed -> (failures подряд) -> open -> (cooldown) -> half-open:
+    пропускаем один пробный запрос; успех закрывает, ошибка открывает снова.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures: int = 5, cooldown: float = 30.0):
+        self.failures = max(1, failures)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._errors = 0
+        self._opened_at = 0.0
+        self._probe = False
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                return self.HALF_OPEN
+            return self._state
+
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe = False
+            # half-open: ровно один пробный запрос
+            if self._probe:
+                return False
+            self._probe = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._errors = 0
+            self._probe = False
+
+    def failure(self):
+        with self._lock:
+            self._errors += 1
+            if self._state == self.HALF_OPEN or self._errors >= self.failures:
+                if self._state != self.OPEN:
+                    self.opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe = False
+
+
+# =========================
+# Хвостовые задержки
+# =========================
+class LatencyTracker:
+    """Скользящее окно задержек по ключу ("complete:free", "stream:pro" ...)."""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def add(self, key, seconds: float):
+        with self._lock:
+            d = self._samples.get(key)
+            if d is None:
+                d = self._samples[key] = deque(maxlen=self.window)
+            d.append(seconds)
+
+    def quantile(self, key, q: float, min_samples: int = 20):
+        with self._lock:
+            d = self._samples.get(key)
+            if not d or len(d) < min_samples:
+                return None
+            values = sorted(d)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Resilient:
+    """
+    Обёртка вокруг вызова модели:
+
+    - общий дедлайн на вызов (с повторами): каждая попытка получает
+      оставшееся время как timeout;
+    - hedging: если ответа нет дольше квантиля hedge_quantile (по окну
+      последних вызовов этого ключа), параллельно уходит второй такой же
+      запрос, берём первый успешный, второй выбрасываем (on_discard);
+    - повторы на 429/5xx/таймаутах с экспоненциальной задержкой и full jitter
+      (Retry-After, если OpenAI его прислал), последняя попытка — на
+      fallback_model, если он задан;
+    - circuit breaker: после серии ошибок сразу CircuitOpen.
+
+    fn(model, timeout) -> результат — сам запрос (снаружи).
+    """
+
+    def __init__(self, model: str, fallback_model: str = "", max_retries: int = 2,
+                 backoff_base: float = 0.5, backoff_cap: float = 8.0,
+                 hedge: bool = True, hedge_quantile: float = 0.95, hedge_min: float = 2.0,
+                 breaker: CircuitBreaker = None, hedge_workers: int = 16):
+        self.model = model
+        self.fallback_model = fallback_model
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min = hedge_min
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix="ai-hedge")
+        self.calls = 0
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+        self.rejected = 0
+
+    def hedge_delay(self, key):
+        if not self.hedge:
+            return None
+        q = self.latency.quantile(key, self.hedge_quantile)
+        return None if q is None else max(self.hedge_min, q)
+
+    def call(self, key, fn, deadline: float, on_discard=None):
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpen()
+        self.calls += 1
+        end = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            last = attempt >= self.max_retries
+            model = self.fallback_model if (last and attempt and self.fallback_model) else self.model
+            if model != self.model:
+                self.fallbacks += 1
+            try:
+                result = self._attempt(key, fn, model, end, on_discard)
+            except Exception as e:
+                if not is_retryable(e):
+                    # OpenAI ответил (400/401/...) — он жив, дело в запросе
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                pause = min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+                pause = _retry_after(e) or random.uniform(0, pause)
+                if last or time.monotonic() + pause >= end or not self.breaker.allow():
+                    raise
+                self.retries += 1
+                attempt += 1
+                time.sleep(pause)
+                continue
+            self.breaker.success()
+            return result
+
+    def _attempt(self, key, fn, model, end, on_discard):
+        started = time.monotonic()
+        timeout = end - started
+        if timeout <= 0:
+            raise DeadlineExceeded()
+        delay = self.hedge_delay(key)
+        if delay is None or delay >= timeout:
+            result = fn(model, timeout)
+            self.latency.add(key, time.monotonic() - started)
+            return result
+
+        first = self._executor.submit(fn, model, timeout)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            result = first.result()
+            self.latency.add(key, time.monotonic() - started)
+            return result
+
+        # первый запрос застрял в хвосте — дублируем
+        self.hedged += 1
+        second = self._executor.submit(fn, model, end - time.monotonic())
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()) + 1.0,
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for f in done:
+                if f.exception() is not None:
+                    error = f.exception()
+                    continue
+                if f is second:
+                    self.hedge_wins += 1
+                self.latency.add(key, time.monotonic() - started)
+                for other in pending:
+                    other.add_done_callback(lambda o: self._discard(o, on_discard))
+                return f.result()
+        for f in pending:
+            f.add_done_callback(lambda o: self._discard(o, on_discard))
+        raise error or DeadlineExceeded()
+
+    @staticmethod
+    def _discard(f, on_discard):
+        if on_discard is None or f.exception() is not None:
+            return
+        try:
+            on_discard(f.result())
+        except Exception as e:
+            print(f"⚠️ hedge discard: {e}")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "opened": self.breaker.opened,
+            "calls": self.calls,
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "fallbacks": self.fallbacks,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,235 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+
+# =========================
+# SQLite: долгоживущие соединения
+# =========================
+class Database:
+    """
+    Одно соединение на поток (telebot крутит хендлеры в пуле потоков),
+    WAL + synchronous=NORMAL, чтобы commit не делал fsync каждый раз.
+    Скомпилированные запросы кэшируются самим sqlite3 (cached_statements),
+    поэтому SQL держим строками-константами.
+
+    readonly=True — файл открывается только на чтение (mode=ro), режим
+    журнала не трогаем; файла нет — ошибка, а не новая пустая база.
+    """
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000,
+                 synchronous: str = "NORMAL", cached_statements: int = 256,
+                 readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._rollback_hooks = []
+        self._connect_hooks = []
+
+    def _connect(self):
+        con = sqlite3.connect(
+            f"file:{pathname2url(self.path)}?mode=ro" if self.readonly else self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,  # транзакции открываем сами (tx)
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            uri=self.readonly,
+        )
+        if not self.readonly:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(f"PRAGMA synchronous={self.synchronous}")
+        con.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        con.execute("PRAGMA temp_store=MEMORY")
+        for hook in self._connect_hooks:
+            hook(con)
+        with self._lock:
+            self._connections.append(con)
+        return con
+
+    @property
+    def con(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._connect()
+            self._local.con = con
+            self._local.depth = 0
+            self._local.begun = False
+        return con
+
+    @contextmanager
+    def tx(self):
+        """
+        Транзакция на весь блок: все чтения/записи хендлера — один commit.
+        Вложенные tx() переиспользуют внешнюю (commit делает самая внешняя).
+        BEGIN IMMEDIATE — сразу берём write-lock, чтобы не ловить
+        SQLITE_BUSY при апгрейде read -> write в WAL. BEGIN откладывается
+        до первого запроса: если всё нашлось в кэшах, tx() ничего не стоит.
+        """
+        con = self.con
+        local = self._local
+        local.depth += 1
+        try:
+            yield self
+        except BaseException:
+            local.depth -= 1
+            if local.depth == 0 and local.begun:
+                local.begun = False
+                con.execute("ROLLBACK")
+                for hook in self._rollback_hooks:
+                    hook()
+            raise
+        local.depth -= 1
+        if local.depth == 0 and local.begun:
+            local.begun = False
+            con.execute("COMMIT")
+
+    def on_rollback(self, hook):
+        """hook() вызывается после ROLLBACK (например, сбросить кэши write-through)."""
+        self._rollback_hooks.append(hook)
+
+    def on_connect(self, hook):
+        """hook(con) для каждого нового соединения (например, set_trace_callback в бенчмарке)."""
+        self._connect_hooks.append(hook)
+
+    def in_tx(self) -> bool:
+        return getattr(self._local, "depth", 0) > 0
+
+    def _con_for_query(self):
+        con = self.con
+        local = self._local
+        if local.depth and not local.begun:
+            con.execute("BEGIN IMMEDIATE")
+            local.begun = True
+        return con
+
+    # Вне tx() каждый запрос — autocommit (isolation_level=None)
+    def execute(self, sql: str, params=()):
+        return self._con_for_query().execute(sql, params)
+
+    def executemany(self, sql: str, seq):
+        return self._con_for_query().executemany(sql, seq)
+
+    def one(self, sql: str, params=()):
+        return self._con_for_query().execute(sql, params).fetchone()
+
+    def all(self, sql: str, params=()):
+        return self._con_for_query().execute(sql, params).fetchall()
+
+    def close_all(self):
+        with self._lock:
+            cons, self._connections = self._connections, []
+        for con in cons:
+            try:
+                con.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+
+
+# =========================
+# Write-behind
+# =========================
+class WriteBehind:
+    """
+    Отложенные UPDATE: put(key, params) кладёт в буфер (последняя запись
+    по ключу побеждает), фоновый поток сбрасывает буфер одним executemany
+    в одной транзакции — по таймеру или когда набралось max_pending.
+
+    Вместо db + sql можно передать функцию write(rows), которая сама
+    пишет пачку (например, раскладывает её по шардам).
+    """
+
+    def __init__(self, db, sql: str = None, flush_interval: float = 2.0,
+                 max_pending: int = 500, name: str = "write-behind"):
+        self.db = db
+        self.sql = sql
+        self.write = db if sql is None else self._executemany
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.name = name
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.flushed = 0
+        self.batches = 0
+
+    def put(self, key, params):
+        with self._lock:
+            self._pending[key] = params
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            self.write(list(batch.values()))
+        except Exception:
+            # не теряем: вернём в буфер (новые значения, если успели, важнее)
+            with self._lock:
+                for k, v in batch.items():
+                    self._pending.setdefault(k, v)
+            raise
+        self.flushed += len(batch)
+        self.batches += 1
+        return len(batch)
+
+    def _executemany(self, rows):
+        with self.db.tx():
+            self.db.executemany(self.sql, rows)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ {self.name}: flush failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+
+# =========================
+# Records
+# =========================
+class UserRecord:
+    """Строка users. __slots__ — чтобы десятки тысяч записей в кэше были компактными."""
+
+    __slots__ = ("user_id", "username", "first_name", "created_ts", "pro_until_ts", "mode")
+
+    def __init__(self, user_id, username, first_name, created_ts, pro_until_ts, mode):
+        self.user_id = int(user_id)
+        self.username = username or ""
+        self.first_name = first_name or ""
+        self.created_ts = int(created_ts or 0)
+        self.pro_until_ts = int(pro_until_ts or 0)
+        self.mode = mode or "career"
+
+    def __repr__(self):
+        return f"UserRecord(user_id={self.user_id}, pro_until_ts={self.pro_until_ts}, mode={self.mode!r})"
@@ -0,0 +1,71 @@
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+from formatting import html_safe_prefix, sanitize_html, split_html
+
+
+TG_TEXT_LIMIT = 4096
+CURSOR = " ▌"
+
+
+# =========================
+# Streaming -> edit_message_text
+# =========================
+class StreamingReply:
+    """
+    Показывает ответ модели по мере генерации, редактируя сообщение-заглушку.
+    Первый кусок уходит сразу, дальше — не чаще min_interval секунд
+    (лимит Telegram на edit одного сообщения/чата ~1 в секунду).
+    Полный ответ доставляет delivery (delivery.Delivery) — см. finish().
+    """
+
+    def __init__(self, bot, delivery, chat_id: int, message_id: int,
+                 min_interval: float = 1.0, min_chars: int = 12):
+        self.bot = bot
+        self.delivery = delivery
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.text = ""
+        self._shown = ""
+        self._shown_len = 0
+        self._last_edit = 0.0
+        self.edits = 0
+
+    def feed(self, delta: str):
+        if not delta:
+            return
+        self.text += delta
+        now = time.monotonic()
+        if now - self._last_edit < self.min_interval:
+            return
+        if len(self.text) - self._shown_len < self.min_chars and self._shown_len:
+            return
+        # пока генерируется — показываем начало, целиком отправит finish()
+        head = split_html(sanitize_html(html_safe_prefix(self.text)), TG_TEXT_LIMIT - len(CURSOR))
+        if not head or head[0] == self._shown:
+            # начало уже показано целиком (ответ длиннее одного сообщения)
+            return
+        self._edit(head[0] + CURSOR)
+        self._shown = head[0]
+        self._shown_len = len(self.text)
+        self._last_edit = now
+
+    def _edit(self, text: str):
+        try:
+            self.bot.edit_message_text(text, self.chat_id, self.message_id)
+            self.edits += 1
+        except ApiTelegramException:
+            # промежуточный кадр не критичен (и «not modified» тоже) — следующий перезапишет
+            pass
+
+    def finish(self, text: str = "", tail_markup=None):
+        """
+        Полный ответ: первая часть — в это же сообщение, остаток (если длиннее
+        лимита) — новыми сообщениями, последнее с tail_markup. Не бросает:
+        Future -> True/False (см. Delivery.deliver).
+        """
+        return self.delivery.deliver(self.chat_id, text or self.text, message_id=self.message_id,
+                                     reply_markup=tail_markup)
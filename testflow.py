@@ -0,0 +1,120 @@
+import threading
+from array import array
+
+from cache import LRUCache
+
+
+# =========================
+# Career test: состояние в памяти
+# =========================
+# Порядок важен: он же порядок колонок score_* и приоритет при равенстве
+BUCKETS = ("it", "bus", "cre", "an")
+BUCKET_INDEX = {b: i for i, b in enumerate(BUCKETS)}
+
+# Результаты answer()
+OK = "ok"          # ответ принят, есть следующий вопрос
+DONE = "done"      # ответ принят, тест завершён
+STALE = "stale"    # повторный/устаревший callback — игнорируем
+NO_TEST = "none"   # теста нет (не начат / отменён / нет строки)
+BAD = "bad"        # мусор в callback_data
+
+
+class TestSession:
+    """Строка test_state в памяти: шаг + вектор баллов (array, 4 x uint16)."""
+
+    __slots__ = ("user_id", "step", "scores", "in_test")
+
+    def __init__(self, user_id: int, step: int = 0, scores=None, in_test: bool = False):
+        self.user_id = user_id
+        self.step = step
+        self.scores = array("H", scores or (0, 0, 0, 0))
+        self.in_test = in_test
+
+    def row(self):
+        # step, score_it, score_bus, score_cre, score_an, in_test, user_id
+        return (self.step, *self.scores, int(self.in_test), self.user_id)
+
+
+class TestEngine:
+    """
+    Каждый ответ — одна проверенная транзакция состояния:
+    шаг из callback должен совпасть с текущим, иначе это двойной тап
+    или старая клавиатура, и ответ отбрасывается без записи.
+
+    persist="answer" — одна запись в test_state на ответ (после падения
+    тест продолжается с того же вопроса); persist="finish" — пишем только
+    старт/финиш/отмену, а после рестарта посреди теста его нужно пройти заново.
+
+    Строки test_state читает и пишет repo (см. repository.UserRepository).
+    """
+
+    def __init__(self, repo, questions: int, persist: str = "answer",
+                 cache_size: int = 50000, cache_ttl: float = 86400.0):
+        self.repo = repo
+        self.questions = questions
+        self.persist = persist
+        self._sessions = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        # striped locks: переходы одного пользователя строго по очереди
+        self._locks = [threading.Lock() for _ in range(64)]
+        self.stale = 0
+
+    def _lock(self, user_id: int):
+        return self._locks[user_id % len(self._locks)]
+
+    def _save(self, s: TestSession):
+        self.repo.save_test(s.row())
+
+    def get(self, user_id: int):
+        s = self._sessions.get(user_id)
+        if s is not None:
+            return s
+        row = self.repo.load_test(user_id)
+        if not row:
+            return None
+        s = TestSession(user_id, int(row[0] or 0), [int(x or 0) for x in row[1:5]], bool(row[5]))
+        self._sessions.put(user_id, s)
+        return s
+
+    def in_test(self, user_id: int) -> bool:
+        s = self.get(user_id)
+        return bool(s and s.in_test)
+
+    def start(self, user_id: int):
+        with self._lock(user_id):
+            s = TestSession(user_id, 0, None, True)
+            self._save(s)
+            self._sessions.put(user_id, s)
+            return s
+
+    def cancel(self, user_id: int):
+        with self._lock(user_id):
+            s = self.get(user_id)
+            if s is None or not s.in_test:
+                return
+            s.in_test = False
+            self._save(s)
+
+    def answer(self, user_id: int, step: int, bucket: str):
+        idx = BUCKET_INDEX.get(bucket)
+        if idx is None or not 0 <= step < self.questions:
+            return BAD, None
+        with self._lock(user_id):
+            s = self.get(user_id)
+            if s is None or not s.in_test:
+                return NO_TEST, s
+            if step != s.step:
+                self.stale += 1
+                return STALE, s
+
+            s.scores[idx] += 1
+            s.step += 1
+            done = s.step >= self.questions
+            if done:
+                s.in_test = False
+            if done or self.persist == "answer":
+                self._save(s)
+            return (DONE if done else OK), s
+
+    def clear(self):
+        """Сброс памяти (после ROLLBACK): дальше всё перечитается из test_state."""
+        self._sessions.clear()
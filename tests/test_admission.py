@@ -0,0 +1,131 @@
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from admission import AdmissionClass, AdmissionQueue
+from webhook import UpdateDispatcher
+
+
+def _drain(q):
+    items = []
+    while True:
+        t = q.get(timeout=0)
+        if t is None:
+            return items
+        items.append(t)
+
+
+def test_fifo_per_key_across_classes():
+    q = AdmissionQueue([AdmissionClass("fast", 0), AdmissionClass("ai", 1)])
+    q.put("u1-ai", "ai", key=1)
+    q.put("u1-button", "fast", key=1)
+    q.put("u2-ai", "ai", key=2)
+    q.put("u3-button", "fast", key=3)
+    order = [t.item for t in _drain(q)]
+    # кнопка u1 не обгоняет его же вопрос, но идёт раньше чужого вопроса
+    assert order == ["u3-button", "u1-ai", "u1-button", "u2-ai"]
+
+
+def test_fifo_within_class():
+    q = AdmissionQueue([AdmissionClass("a")])
+    for i in range(5):
+        q.put(i, "a")
+    assert [t.item for t in _drain(q)] == [0, 1, 2, 3, 4]
+
+
+def test_priority_first():
+    q = AdmissionQueue([AdmissionClass("bg", 2), AdmissionClass("fast", 0)], default="bg")
+    q.put("bg", "bg")
+    q.put("fast", "fast")
+    assert [t.item for t in _drain(q)] == ["fast", "bg"]
+
+
+def test_weighted_fair_sharing():
+    q = AdmissionQueue([AdmissionClass("pro", 1, weight=3), AdmissionClass("free", 1, weight=1)])
+    for i in range(40):
+        q.put(("pro", i), "pro")
+        q.put(("free", i), "free")
+    first = [t.cls for t in (q.get(timeout=0) for _ in range(20))]
+    assert first.count("pro") == 15 and first.count("free") == 5
+    # free не ждёт дольше трёх pro подряд
+    runs = "".join(c[0] for c in first).split("f")
+    assert max(len(r) for r in runs) <= 3
+
+
+def test_idle_class_gets_no_credit():
+    q = AdmissionQueue([AdmissionClass("a", 0), AdmissionClass("b", 0)])
+    for i in range(10):
+        q.put(("a", i), "a")
+    for _ in range(10):
+        q.get(timeout=0)
+    # b простаивал, пока a работал, — это не даёт ему 10 задач подряд
+    for i in range(4):
+        q.put(("a", i), "a")
+        q.put(("b", i), "b")
+    assert [t.cls for t in _drain(q)] == ["a", "b"] * 4
+
+
+def test_expired_is_marked_late():
+    q = AdmissionQueue([AdmissionClass("fast", 0, deadline=0.05), AdmissionClass("bg", 1)])
+    q.put("old", "fast")
+    q.put("bg", "bg")
+    time.sleep(0.08)
+    q.put("new", "fast")
+    res = {t.item: t.late for t in _drain(q)}
+    # без дедлайна класс не опаздывает
+    assert res == {"old": True, "new": False, "bg": False}
+
+
+def test_full_and_close():
+    q = AdmissionQueue([AdmissionClass("a")], maxsize=2)
+    q.put(1, "a", key=1)
+    q.put(2, "a", key=1)
+    with pytest.raises(queue.Full):
+        q.put(3, "a", key=2)
+    assert q.depth_by_class() == {"a": 2}
+    assert q.close(drop=True) == [1, 2]
+    assert q.get() is None
+
+
+def _update(update_id: int, user_id: int):
+    return SimpleNamespace(update_id=update_id, message=SimpleNamespace(from_user=SimpleNamespace(id=user_id)),
+                           edited_message=None, callback_query=None)
+
+
+def test_dispatcher_sheds_expired_updates():
+    handled, shed = [], []
+    gate = threading.Event()
+
+    def handle(update):
+        gate.wait(5)
+        handled.append(update.update_id)
+
+    d = UpdateDispatcher(handle, workers=1, classify=lambda u: "fast",
+                         classes=[AdmissionClass("fast", 0, deadline=0.05)],
+                         on_shed=lambda u, cls: shed.append(u.update_id))
+    d.start()
+    d.submit(_update(1, 7))
+    time.sleep(0.02)
+    d.submit(_update(2, 7))
+    d.submit(_update(3, 8))
+    time.sleep(0.1)
+    gate.set()
+    d.stop()
+    # первый уже обрабатывался; остальные прождали дольше дедлайна
+    assert handled == [1]
+    assert sorted(shed) == [2, 3] and d.shed == 2
+
+
+def test_dispatcher_keeps_user_order():
+    seen = []
+    classes = [AdmissionClass("interactive", 0), AdmissionClass("ai", 1)]
+    d = UpdateDispatcher(lambda u: seen.append(u.update_id), workers=1,
+                         classify=lambda u: "ai" if u.update_id % 2 else "interactive", classes=classes)
+    for i in range(1, 21):
+        d.submit(_update(i, 7))
+    d.start()
+    d.stop()
+    assert seen == list(range(1, 21))
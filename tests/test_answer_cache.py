@@ -0,0 +1,67 @@
+import pytest
+
+from answer_cache import AnswerCache, MinHasher, normalize, similarity, word_set
+from storage import Database
+
+
+@pytest.fixture
+def cache(tmp_path):
+    db = Database(str(tmp_path / "cache.db"))
+    c = AnswerCache(db)
+    c.init_table()
+    yield c
+    c.stop()
+    db.close_all()
+
+
+def _score(a: str, b: str) -> float:
+    h = MinHasher()
+    return similarity(h.signature(normalize(a)), h.signature(normalize(b)))
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("сделай резюме для junior python", "сделай резюме для senior python"),
+    ("я не хочу работать аналитиком", "я хочу работать аналитиком"),
+    ("я хочу работать аналитиком", "я не хочу работать аналитиком"),
+])
+def test_different_meaning_is_not_served(cache, cached, asked):
+    cache.put("free", cached, "ответ")
+    assert cache.lookup("free", asked) is None
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("сделай резюме для junior python", "сделай резюме для senior python"),
+    ("я не хочу работать аналитиком", "я хочу работать аналитиком"),
+])
+def test_word_check_rejects_even_with_low_threshold(tmp_path, cached, asked):
+    # эти пары похожи по символам сильнее старого порога 0.8
+    assert _score(cached, asked) >= 0.8
+    db = Database(str(tmp_path / "cache.db"))
+    c = AnswerCache(db, threshold=0.8)
+    c.init_table()
+    c.put("free", cached, "ответ")
+    assert c.lookup("free", asked) is None
+    assert c.stats()["near_rejected"] == 1
+    c.stop()
+
+
+def test_default_threshold():
+    assert AnswerCache(None).threshold == 0.95
+
+
+def test_same_question_is_served(cache):
+    cache.put("free", "Сделай резюме для Junior Python!", "ответ")
+    assert cache.lookup("free", "сделай резюме для junior python") == "ответ"
+    # повтор слова: не та же строка, но те же слова
+    assert cache.lookup("free", "сделай резюме для junior python python") == "ответ"
+    assert cache.stats()["near_hits"] == 1
+
+
+def test_tiers_are_separate(cache):
+    cache.put("pro", "сделай резюме для junior python", "ответ")
+    assert cache.lookup("free", "сделай резюме для junior python") is None
+
+
+def test_word_set():
+    assert word_set(normalize("Ну, сделай резюме, пожалуйста")) == {"сделай", "резюме"}
+    assert "не" in word_set(normalize("я не хочу"))
@@ -0,0 +1,69 @@
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+from telebot.apihelper import ApiTelegramException
+
+from delivery import Delivery
+from formatting import tg_len
+
+
+def _error(description: str) -> ApiTelegramException:
+    return ApiTelegramException("sendMessage", None, {"error_code": 400, "description": description})
+
+
+class FakeOut:
+    """Outbox, который отвечает сразу: fail(method, text) -> исключение или None."""
+
+    def __init__(self, fail=None):
+        self.calls = []
+        self.fail = fail or (lambda method, text, kwargs: None)
+
+    def _done(self, method, text, kwargs):
+        self.calls.append((method, text, kwargs))
+        f = Future()
+        e = self.fail(method, text, kwargs)
+        if e is None:
+            f.set_result(SimpleNamespace(message_id=len(self.calls)))
+        else:
+            f.set_exception(e)
+        return f
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._done("send", text, kwargs)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return self._done("edit", text, kwargs)
+
+
+def test_long_answer_edits_placeholder_then_sends_rest():
+    out = FakeOut()
+    d = Delivery(out)
+    text = "\n\n".join("<b>абзац</b> " + "слово " * 150 for _ in range(20))
+    assert d.deliver(1, text, message_id=10, reply_markup="kb").result(1) is True
+    methods = [m for m, _, _ in out.calls]
+    assert methods[0] == "edit" and set(methods[1:]) == {"send"}
+    assert all(tg_len(t) <= 4096 for _, t, _ in out.calls)
+    # клавиатура — только у последней части
+    assert [kw.get("reply_markup") for _, _, kw in out.calls[1:]] == [None] * (len(out.calls) - 2) + ["kb"]
+
+
+def test_parse_error_falls_back_to_plain_text():
+    out = FakeOut(lambda m, t, kw: _error("Bad Request: can't parse entities") if kw.get("parse_mode") is None else None)
+    d = Delivery(out)
+    assert d.deliver(1, "<b>жирный</b> & текст").result(1) is True
+    assert out.calls[-1] == ("send", "жирный & текст", {"merge": False, "reply_markup": None, "parse_mode": ""})
+    assert d.stats()["plain"] == 1
+
+
+def test_failed_edit_sends_new_message():
+    out = FakeOut(lambda m, t, kw: _error("Bad Request: message to edit not found") if m == "edit" else None)
+    d = Delivery(out)
+    assert d.deliver(1, "ответ", message_id=5).result(1) is True
+    assert [m for m, _, _ in out.calls] == ["edit", "send"]
+
+
+def test_blocked_user_is_counted_as_failed():
+    out = FakeOut(lambda m, t, kw: _error("Forbidden: bot was blocked by the user"))
+    d = Delivery(out)
+    assert d.deliver(1, "ответ").result(1) is False
+    assert d.stats()["failed"] == 1
@@ -0,0 +1,94 @@
+import random
+import re
+
+import pytest
+
+from formatting import sanitize_html, split_html, strip_html, tg_len
+
+_TAG = re.compile(r"<(/?)([a-z]+)[^<>]*>")
+_WORDS = ["карьера", "резюме", "junior", "python", "😀", "🚀👍", "a<b", "x & y", "&amp;", "1.", "итог."]
+_TAGS = ["b", "i", "u", "s", "code", "pre", "tg-spoiler"]
+
+
+def _balanced(part: str) -> bool:
+    stack = []
+    for m in _TAG.finditer(part):
+        closing, name = m.group(1), m.group(2)
+        if not closing:
+            stack.append(name)
+        elif not stack or stack.pop() != name:
+            return False
+    return not stack
+
+
+def _text(html: str) -> str:
+    """Видимый текст без пробелов: на разрезах пробелы и переводы строк срезаются."""
+    return "".join(strip_html(html).split())
+
+
+def _random_html(rnd: random.Random, n: int) -> str:
+    out = []
+    for _ in range(n):
+        r = rnd.random()
+        if r < 0.12:
+            tag = rnd.choice(_TAGS)
+            inner = " ".join(rnd.choice(_WORDS) for _ in range(rnd.randint(1, 40)))
+            if rnd.random() < 0.3:
+                inner = f"<b>{inner}</b> <i>{rnd.choice(_WORDS)}</i>"
+            out.append(f"<{tag}>{inner}</{tag}>")
+        elif r < 0.16:
+            out.append('<a href="https://example.com/?a=1&amp;b=2">ссылка</a>')
+        elif r < 0.24:
+            out.append(rnd.choice(["\n", "\n\n"]))
+        else:
+            out.append(rnd.choice(_WORDS))
+    return " ".join(out)
+
+
+def _check(text: str, limit: int):
+    parts = split_html(text, limit)
+    for part in parts:
+        assert tg_len(part) <= limit, part
+        assert _balanced(part), part
+        # часть только из тегов — пустое сообщение в Telegram
+        assert strip_html(part).strip(), part
+    assert "".join(_text(p) for p in parts) == _text(text)
+    return parts
+
+
+@pytest.mark.parametrize("seed", range(40))
+@pytest.mark.parametrize("limit", [60, 200, 4096])
+def test_split_html_random(seed, limit):
+    rnd = random.Random(seed)
+    n = rnd.randint(10, 3000 if limit == 4096 else 300)
+    _check(sanitize_html(_random_html(rnd, n)), limit)
+
+
+def test_split_html_short_is_one_part():
+    assert split_html("<b>коротко</b>", 4096) == ["<b>коротко</b>"]
+
+
+def test_split_html_reopens_tags():
+    text = "<b>" + "слово " * 2000 + "</b>"
+    parts = _check(text, 4096)
+    assert len(parts) > 1
+    assert all(p.startswith("<b>") and p.endswith("</b>") for p in parts)
+
+
+def test_split_html_counts_utf16():
+    # 3000 эмодзи = 6000 единиц UTF-16
+    parts = _check("😀" * 3000, 4096)
+    assert len(parts) == 2
+
+
+def test_split_html_paragraphs():
+    text = "\n\n".join(("абзац " * 100).strip() for _ in range(20))
+    parts = _check(text, 1000)
+    # режем между абзацами, не посреди
+    assert all(p.count("абзац") % 100 == 0 for p in parts)
+
+
+def test_sanitize_html():
+    assert sanitize_html("a < b & <unknown> <b>x") == "a &lt; b &amp; &lt;unknown&gt; <b>x</b>"
+    assert sanitize_html("</i>x") == "x"
+    assert sanitize_html('<a href="javascript:x">y</a>') == "y"
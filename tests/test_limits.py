@@ -0,0 +1,28 @@
+import sqlite3
+
+import pytest
+
+from limits import UsageLedger, utc_day
+from storage import Database
+
+
+def test_usage_survives_failed_flush(tmp_path, monkeypatch):
+    db = Database(str(tmp_path / "usage.db"))
+    ledger = UsageLedger(db)
+    ledger.init_table()
+    ledger.record(7, 100, 50)
+
+    def broken(sql, seq):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(db, "executemany", broken)
+    with pytest.raises(sqlite3.OperationalError):
+        ledger.flush()
+    # запись, пришедшая после сбоя, складывается с вернувшейся в буфер
+    ledger.record(7, 10, 5)
+    monkeypatch.undo()
+
+    assert ledger.flush() == 1
+    assert db.all("SELECT user_id, day, prompt_tokens, completion_tokens, requests FROM ai_usage") == [
+        (7, utc_day(), 110, 55, 2)]
+    assert ledger.pending() == 0
+    db.close_all()
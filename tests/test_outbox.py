@@ -0,0 +1,129 @@
+import threading
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from formatting import tg_len
+from outbox import PRIO_BULK, Outbox, OutboxClosed, QueueFull
+
+
+class FakeBot:
+    """send_message записывает вызовы; первый вызов ждёт gate, чтобы очередь чата успела накопиться."""
+
+    def __init__(self):
+        self.calls = []
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        self.lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.entered.set()
+        self.gate.wait(5)
+        with self.lock:
+            self.calls.append((chat_id, text))
+            return len(self.calls)
+
+
+class FloodBot(FakeBot):
+    """Первые flood вызовов — 429 с retry_after."""
+
+    def __init__(self, flood: int, retry_after: float = 0.05):
+        super().__init__()
+        self.gate.set()
+        self.flood = flood
+        self.retry_after = retry_after
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self.lock:
+            if self.flood:
+                self.flood -= 1
+                self.calls.append((chat_id, "429"))
+                raise ApiTelegramException("sendMessage", None, {
+                    "error_code": 429, "description": "Too Many Requests",
+                    "parameters": {"retry_after": self.retry_after}})
+        return super().send_message(chat_id, text, **kwargs)
+
+
+def _outbox(bot, **kwargs):
+    return Outbox(bot, global_rate=1000, chat_rate=1000, chat_burst=1000, workers=1, **kwargs)
+
+
+def test_merge_respects_utf16_limit():
+    bot = FakeBot()
+    out = _outbox(bot)
+    first = out.send_message(1, "start")
+    assert bot.entered.wait(5)
+    # 1500 эмодзи: 1500 символов Python, но 3000 единиц UTF-16
+    rest = [out.send_message(1, "😀" * 1500) for _ in range(3)]
+    bot.gate.set()
+    for f in [first, *rest]:
+        f.result(5)
+    out.stop()
+    assert all(tg_len(text) <= 4096 for _, text in bot.calls)
+    assert len(bot.calls) == 4
+
+
+def test_merge_short_messages():
+    bot = FakeBot()
+    out = _outbox(bot)
+    first = out.send_message(1, "start")
+    assert bot.entered.wait(5)
+    rest = [out.send_message(1, f"m{i}") for i in range(3)]
+    bot.gate.set()
+    for f in [first, *rest]:
+        f.result(5)
+    out.stop()
+    assert bot.calls == [(1, "start"), (1, "m0\n\nm1\n\nm2")]
+    assert out.merged == 2
+
+
+def test_retry_after_429_keeps_chat_order():
+    bot = FloodBot(flood=2)
+    out = _outbox(bot, merge=False)
+    first = out.send_message(1, "a")
+    second = out.send_message(1, "b")
+    assert first.result(5) == 3
+    assert second.result(5) == 4
+    out.stop()
+    # повтор того же сообщения, второе ждёт первое
+    assert bot.calls == [(1, "429"), (1, "429"), (1, "a"), (1, "b")]
+    assert out.retried == 2 and out.failed == 0
+
+
+def test_429_gives_up_after_max_attempts():
+    bot = FloodBot(flood=10, retry_after=0.01)
+    out = _outbox(bot, max_attempts=3)
+    f = out.send_message(1, "a")
+    with pytest.raises(ApiTelegramException):
+        f.result(5)
+    out.stop()
+    assert len(bot.calls) == 3
+    assert out.retried == 2 and out.failed == 1
+
+
+def test_full_queue_drops_bulk_not_interactive():
+    bot = FakeBot()
+    out = _outbox(bot, max_pending=2)
+    first = out.send_message(1, "first")
+    assert bot.entered.wait(5)
+    bulk = out.send_message(2, "bulk", priority=PRIO_BULK)
+    dropped = out.send_message(3, "bulk-dropped", priority=PRIO_BULK)
+    interactive = out.send_message(4, "interactive")
+    assert isinstance(dropped.exception(1), QueueFull)
+    bot.gate.set()
+    for f in (first, bulk, interactive):
+        f.result(5)
+    out.stop()
+    # ответ пользователю не отбрасывается и идёт раньше рассылки
+    assert [chat for chat, _ in bot.calls] == [1, 4, 2]
+    assert out.dropped == 1
+
+
+def test_send_after_stop_is_rejected():
+    bot = FakeBot()
+    bot.gate.set()
+    out = _outbox(bot)
+    out.send_message(1, "a").result(5)
+    out.stop()
+    assert isinstance(out.send_message(1, "b").exception(1), OutboxClosed)
+    assert bot.calls == [(1, "a")]
@@ -0,0 +1,383 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+
+# =========================
+# Трассировка апдейта
+# =========================
+class Span:
+    __slots__ = ("name", "start", "end", "attrs", "children")
+
+    def __init__(self, name: str, start: float, attrs=None):
+        self.name = name
+        self.start = start
+        self.end = 0.0
+        self.attrs = attrs
+        self.children = []
+
+    def to_dict(self, t0: float) -> dict:
+        d = {"name": self.name, "at_ms": round((self.start - t0) * 1000, 2),
+             "ms": round(((self.end or self.start) - self.start) * 1000, 2)}
+        if self.attrs:
+            d.update(self.attrs)
+        if self.children:
+            d["spans"] = [c.to_dict(t0) for c in sorted(self.children, key=lambda c: c.start)]
+        return d
+
+
+class Trace:
+    """Дерево спанов одного апдейта; закрывается, когда закончились и хендлер, и всё отложенное (hold)."""
+
+    __slots__ = ("root", "lock", "pending", "root_done", "opened")
+
+    def __init__(self, root: Span):
+        self.root = root
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.root_done = False
+        self.opened = time.monotonic()
+
+    def add(self, parent: Span, span: Span):
+        with self.lock:
+            parent.children.append(span)
+
+    def duration(self) -> float:
+        end = self.root.end
+
+        def walk(s):
+            nonlocal end
+            end = max(end, s.end)
+            for c in s.children:
+                walk(c)
+        with self.lock:
+            walk(self.root)
+        return end - self.root.start
+
+
+class Handle:
+    """Продолжение трассы в другом потоке (пул AI, outbox)."""
+
+    __slots__ = ("trace", "parent", "released")
+
+    def __init__(self, trace: Trace, parent: Span):
+        self.trace = trace
+        self.parent = parent
+        self.released = False
+
+
+class _Noop:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP = _Noop()
+
+
+class _SpanCtx:
+    __slots__ = ("tracer", "trace", "span", "stack")
+
+    def __init__(self, tracer, trace, span, stack):
+        self.tracer = tracer
+        self.trace = trace
+        self.span = span
+        self.stack = stack
+
+    def __enter__(self):
+        self.stack.append((self.trace, self.span))
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end = time.monotonic()
+        if exc_type is not None:
+            self.span.attrs = dict(self.span.attrs or {}, error=exc_type.__name__)
+        self.stack.pop()
+        return False
+
+
+class _RootCtx(_SpanCtx):
+    __slots__ = ()
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        with self.trace.lock:
+            self.trace.root_done = True
+            done = self.trace.pending == 0
+        if done:
+            self.tracer._finish(self.trace)
+        else:
+            self.tracer._park(self.trace)
+        return False
+
+
+class _ResumeCtx:
+    __slots__ = ("tracer", "handle", "stack")
+
+    def __init__(self, tracer, handle, stack):
+        self.tracer = tracer
+        self.handle = handle
+        self.stack = stack
+
+    def __enter__(self):
+        self.stack.append((self.handle.trace, self.handle.parent))
+        return self.handle.parent
+
+    def __exit__(self, *exc):
+        self.stack.pop()
+        self.tracer.release(self.handle)
+        return False
+
+
+class Tracer:
+    """
+    Спаны апдейта: приём -> очередь -> хендлер -> SQL-хелперы -> OpenAI ->
+    вызовы Telegram (из outbox). Работа, ушедшая в другие потоки, цепляется
+    к трассе через hold()/resume() или record(); трасса закрывается, когда
+    закончилось всё. Если апдейт занял дольше slow_ms, дерево целиком
+    пишется строкой JSON в slow_log и остаётся в последних recent.
+
+    Выключенный tracer: span() возвращает общий no-op, а traced() отдаёт
+    функцию как есть — на горячем пути ничего не добавляется.
+    """
+
+    def __init__(self, enabled: bool = False, slow_ms: float = 2000.0, slow_log: str = "",
+                 recent: int = 20, max_age: float = 300.0):
+        self.enabled = enabled
+        self.slow = slow_ms / 1000.0
+        self.slow_log = slow_log
+        self.max_age = max_age
+        self.recent = deque(maxlen=recent)
+        self._local = threading.local()
+        self._open = {}  # id(trace) -> trace: хендлер закончил, ждём отложенное
+        self._open_lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self.traces = 0
+        self.slow_count = 0
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    # ---- запись ----
+    def root(self, name: str, start: float = None, **attrs):
+        if not self.enabled:
+            return NOOP
+        span = Span(name, start or time.monotonic(), attrs or None)
+        self.traces += 1
+        # корень — всегда новая трасса, даже если поток что-то не закрыл
+        stack = self._local.stack = []
+        return _RootCtx(self, Trace(span), span, stack)
+
+    def span(self, name: str, **attrs):
+        if not self.enabled:
+            return NOOP
+        stack = getattr(self._local, "stack", None)
+        if not stack:
+            return NOOP
+        trace, parent = stack[-1]
+        span = Span(name, time.monotonic(), attrs or None)
+        trace.add(parent, span)
+        return _SpanCtx(self, trace, span, stack)
+
+    def traced(self, kind: str):
+        """Декоратор: спан "<kind>:<имя функции>". При выключенном tracer — функция без обёртки."""
+        def deco(fn):
+            if not self.enabled:
+                return fn
+            name = f"{kind}:{fn.__name__}"
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return deco
+
+    def hold(self):
+        """Handle для продолжения в другом потоке (или None, если трассы нет). Обязателен release/resume."""
+        if not self.enabled:
+            return None
+        stack = getattr(self._local, "stack", None)
+        if not stack:
+            return None
+        trace, parent = stack[-1]
+        with trace.lock:
+            trace.pending += 1
+        return Handle(trace, parent)
+
+    def resume(self, handle):
+        """with resume(h): спаны этого потока — под h.parent; на выходе h освобождается."""
+        if handle is None:
+            return NOOP
+        return _ResumeCtx(self, handle, self._stack())
+
+    def record(self, handle, name: str, start: float, end: float, **attrs):
+        """Готовый спан с известными временами (например, вызов Telegram в outbox)."""
+        if handle is None:
+            return
+        span = Span(name, start, attrs or None)
+        span.end = end
+        handle.trace.add(handle.parent, span)
+
+    def release(self, handle):
+        if handle is None or handle.released:
+            return
+        handle.released = True
+        trace = handle.trace
+        with trace.lock:
+            trace.pending -= 1
+            done = trace.pending == 0 and trace.root_done
+        if done:
+            with self._open_lock:
+                self._open.pop(id(trace), None)
+            self._finish(trace)
+
+    # ---- закрытие ----
+    def _park(self, trace: Trace):
+        now = time.monotonic()
+        with self._open_lock:
+            self._open[id(trace)] = trace
+            # отложенное, которое так и не отпустили (отменённая задача и т.п.)
+            stale = [t for t in self._open.values() if now - t.opened > self.max_age]
+            for t in stale:
+                self._open.pop(id(t), None)
+        for t in stale:
+            t.root.attrs = dict(t.root.attrs or {}, incomplete=True)
+            self._finish(t)
+
+    def _finish(self, trace: Trace):
+        total = trace.duration()
+        if total < self.slow:
+            return
+        self.slow_count += 1
+        with trace.lock:
+            tree = trace.root.to_dict(trace.root.start)
+        tree["total_ms"] = round(total * 1000, 2)
+        tree["ts"] = int(time.time())
+        self.recent.append(tree)
+        if self.slow_log:
+            line = json.dumps(tree, ensure_ascii=False)
+            try:
+                with self._log_lock, open(self.slow_log, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                print(f"⚠️ tracing: slow log: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "traces": self.traces,
+            "slow": self.slow_count,
+            "open": len(self._open),
+        }
+
+
+# =========================
+# Сэмплирующий профайлер
+# =========================
+class SamplingProfiler:
+    """
+    Раз в interval снимает стеки всех потоков (sys._current_frames) и
+    считает одинаковые. Результат — collapsed stacks ("поток;f1;f2 N",
+    формат flamegraph.pl / speedscope). Сам процесс не трогает: только
+    чтение фреймов, поэтому можно включать на проде на N секунд.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 60):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def _sample(self, counts: dict, me: int, names: dict):
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            parts = []
+            while frame is not None and len(parts) < self.max_depth:
+                code = frame.f_code
+                parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            parts.append(names.get(ident, str(ident)))
+            key = ";".join(reversed(parts))
+            counts[key] = counts.get(key, 0) + 1
+
+    def run(self, seconds: float) -> dict:
+        """Блокирует на seconds; {collapsed stack: число сэмплов}."""
+        with self._lock:
+            if self._running:
+                raise RuntimeError("profiler already running")
+            self._running = True
+        try:
+            counts = {}
+            me = threading.get_ident()
+            end = time.monotonic() + seconds
+            while time.monotonic() < end:
+                # имена — на каждом шаге: потоки пулов появляются и исчезают
+                names = {t.ident: t.name for t in threading.enumerate()}
+                self._sample(counts, me, names)
+                time.sleep(self.interval)
+            return counts
+        finally:
+            self._running = False
+
+    def start(self, seconds: float, path: str, on_done):
+        """В фоне: run(seconds) -> файл path -> on_done(path, counts) (или on_done(None, error))."""
+        def work():
+            try:
+                counts = self.run(seconds)
+                write_collapsed(path, counts)
+            except Exception as e:
+                on_done(None, e)
+                return
+            on_done(path, counts)
+        threading.Thread(target=work, name="profiler", daemon=True).start()
+
+
+def write_collapsed(path: str, counts: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, n in sorted(counts.items(), key=lambda kv: -kv[1]):
+            f.write(f"{stack} {n}\n")
+
+
+IDLE_FILES = ("threading.py", "queue.py", "selectors.py", "socket.py", "ssl.py")
+
+
+def hot_frames(counts: dict, top: int = 10, idle=IDLE_FILES):
+    """
+    Самые частые верхние фреймы среди занятых потоков: сэмплы, где поток
+    ждёт (вершина стека в threading/queue/сокетах), не считаются.
+    [(фрейм, сэмплов, доля от занятых)].
+    """
+    own = {}
+    for stack, n in counts.items():
+        leaf = stack.rsplit(";", 1)[-1]
+        if leaf.startswith(idle):
+            continue
+        own[leaf] = own.get(leaf, 0) + n
+    busy = sum(own.values()) or 1
+    return [(fr, n, n / busy) for fr, n in sorted(own.items(), key=lambda kv: -kv[1])[:top]]
+
+
+def flatten(tree: dict, depth: int = 0):
+    """Спаны дерева (из Span.to_dict) списком [(глубина, спан)], без корня."""
+    result = []
+    for s in tree.get("spans", ()):
+        result.append((depth, s))
+        result += flatten(s, depth + 1)
+    return result
@@ -0,0 +1,172 @@
+import hmac
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+from admission import AdmissionClass, AdmissionQueue
+from tracing import Span
+
+
+# =========================
+# Update dispatch
+# =========================
+def update_user_id(update) -> int:
+    """from_user.id апдейта (по нему держим порядок), иначе update_id."""
+    for attr in ("message", "edited_message", "callback_query"):
+        obj = getattr(update, attr, None)
+        if obj is not None and getattr(obj, "from_user", None) is not None:
+            return obj.from_user.id
+    return update.update_id
+
+
+def _queue_span(ticket) -> Span:
+    span = Span("queue", ticket.enqueued, {"late": True} if ticket.late else None)
+    span.end = ticket.enqueued + ticket.waited
+    return span
+
+
+class UpdateDispatcher:
+    """
+    Ограниченная очередь апдейтов + N рабочих потоков.
+    Апдейты одного пользователя всегда попадают в один и тот же поток
+    и обрабатываются строго по порядку поступления, какого бы класса они
+    ни были (тест в callbacks() на это рассчитывает).
+
+    С classify(update) -> класс у каждого потока очередь с классами
+    (admission.AdmissionQueue, ключ — пользователь): между пользователями
+    дешёвые кнопки и ответы теста идут раньше вопросов к AI, но кнопка
+    пользователя не обгоняет его же предыдущий апдейт. Апдейт, прождавший
+    дольше дедлайна класса, не обрабатывается — вместо него on_shed(update, cls).
+
+    С tracer (tracing.Tracer) каждый апдейт — корень трассы "update",
+    начиная с постановки в очередь (ожидание — спан "queue").
+    """
+
+    def __init__(self, handle, workers: int = 8, max_queue: int = 1000,
+                 classify=None, classes=None, on_shed=None, observe=None, tracer=None):
+        self.handle = handle
+        self.tracer = tracer
+        self.workers = max(1, workers)
+        self.classify = classify
+        self.on_shed = on_shed
+        per_worker = max(1, max_queue // self.workers)
+        classes = classes or [AdmissionClass("default")]
+        self._queues = [AdmissionQueue(classes, maxsize=per_worker, observe=observe)
+                        for _ in range(self.workers)]
+        self._threads = []
+        self.accepted = 0
+        self.dropped = 0
+        self.shed = 0
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def submit(self, update) -> bool:
+        """Не блокирует. False — очередь переполнена."""
+        uid = update_user_id(update)
+        q = self._queues[uid % self.workers]
+        cls = self.classify(update) if self.classify else None
+        try:
+            q.put(update, cls, key=uid)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def submit_json(self, data: dict) -> bool:
+        return self.submit(types.Update.de_json(data))
+
+    def _run(self, q):
+        while True:
+            ticket = q.get()
+            if ticket is None:
+                return
+            update = ticket.item
+            if self.tracer is not None and self.tracer.enabled:
+                with self.tracer.root("update", start=ticket.enqueued, update_id=update.update_id,
+                                      user_id=update_user_id(update), cls=ticket.cls) as root:
+                    root.children.append(_queue_span(ticket))
+                    self._handle(ticket, update)
+            else:
+                self._handle(ticket, update)
+
+    def _handle(self, ticket, update):
+        try:
+            if ticket.late and self.on_shed is not None:
+                self.shed += 1
+                self.on_shed(update, ticket.cls)
+            else:
+                self.handle(update)
+        except Exception as e:
+            print(f"⚠️ update {update.update_id}: {e}")
+
+    def start(self):
+        for i, q in enumerate(self._queues):
+            t = threading.Thread(target=self._run, args=(q,), name=f"updates-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 10.0):
+        # дорабатываем то, что уже в очереди, и выходим
+        for q in self._queues:
+            q.close()
+        for t in self._threads:
+            t.join(timeout=timeout)
+        self._threads = []
+
+
+# =========================
+# Webhook HTTP server
+# =========================
+class _WebhookHandler(BaseHTTPRequestHandler):
+    server_version = "CapitalMind"
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, code: int):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        srv = self.server
+        if self.path != srv.path:
+            self._reply(404)
+            return
+        token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, srv.secret):
+            self._reply(403)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+            data = json.loads(self.rfile.read(length))
+            # разбор в Update — у получателя (в режиме процессов это воркер)
+            accepted = srv.dispatcher.submit_json(data)
+        except Exception:
+            self._reply(400)
+            return
+        # сразу отвечаем Telegram; 503 -> Telegram пришлёт апдейт ещё раз
+        self._reply(200 if accepted else 503)
+
+    def do_GET(self):
+        # health-check для Railway
+        self._reply(200 if self.path == "/health" else 404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, path: str, secret: str, dispatcher):
+        # dispatcher: UpdateDispatcher или workers.ProcessRouter (нужен submit_json)
+        if not secret:
+            raise ValueError("webhook secret is required")
+        super().__init__((host, port), _WebhookHandler)
+        self.path = path
+        self.secret = secret
+        self.dispatcher = dispatcher
@@ -0,0 +1,154 @@
+import multiprocessing
+import queue
+import threading
+import time
+
+from telebot import apihelper
+
+
+# =========================
+# Несколько процессов-воркеров
+# =========================
+def raw_user_id(data: dict) -> int:
+    """from.id из сырого апдейта (dict от Telegram), иначе update_id."""
+    for key in ("message", "edited_message", "callback_query"):
+        obj = data.get(key)
+        if obj and obj.get("from"):
+            return obj["from"]["id"]
+    return data.get("update_id", 0)
+
+
+class ProcessRouter:
+    """
+    Входной процесс (polling или webhook) раскладывает сырые апдейты по
+    N процессам-воркерам: user_id % N -> всегда один и тот же процесс,
+    поэтому апдейты пользователя обрабатываются строго по порядку.
+
+    target(index, inbox, events) — main воркера (запускается через spawn):
+      inbox: ("update", dict) | ("invalidate", [user_id] | None) | None (стоп);
+      events: воркер -> роутер, ("invalidate", index, uids) пересылается
+      остальным воркерам (сброс их кэшей после записи в чужие строки).
+
+    Упавший воркер перезапускается с новой очередью: старую он мог бросить
+    с захваченным lock'ом. Апдейты, которые в ней ждали, теряются.
+    """
+
+    def __init__(self, target, processes: int, max_queue: int = 1000, restart_delay: float = 1.0):
+        self.target = target
+        self.n = max(1, processes)
+        self.restart_delay = restart_delay
+        self._ctx = multiprocessing.get_context("spawn")
+        self._per_worker = max(1, max_queue // self.n)
+        self._inboxes = [self._ctx.Queue(maxsize=self._per_worker) for _ in range(self.n)]
+        self._events = self._ctx.Queue()
+        self._procs = [None] * self.n
+        self._stopping = threading.Event()
+        self._threads = []
+        self.accepted = 0
+        self.dropped = 0
+        self.restarts = 0
+
+    def _spawn(self, i: int):
+        p = self._ctx.Process(
+            target=self.target, args=(i, self._inboxes[i], self._events),
+            name=f"bot-worker-{i}", daemon=False,
+        )
+        p.start()
+        self._procs[i] = p
+
+    def start(self):
+        for i in range(self.n):
+            self._spawn(i)
+        for fn, name in ((self._supervise, "workers-supervisor"), (self._forward, "workers-events")):
+            t = threading.Thread(target=fn, name=name, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    # ---- ingress ----
+    def submit_json(self, data: dict, block: bool = False) -> bool:
+        """False — очередь воркера переполнена (webhook ответит 503, Telegram повторит)."""
+        inbox = self._inboxes[raw_user_id(data) % self.n]
+        try:
+            inbox.put(("update", data), block=block)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def depth(self) -> int:
+        total = 0
+        for q in self._inboxes:
+            try:
+                total += q.qsize()
+            except NotImplementedError:  # macOS
+                return -1
+        return total
+
+    # ---- служебные потоки ----
+    def _supervise(self):
+        failures = [0] * self.n
+        while not self._stopping.wait(0.5):
+            for i, p in enumerate(self._procs):
+                if p is None or p.is_alive() or self._stopping.is_set():
+                    continue
+                failures[i] += 1
+                self.restarts += 1
+                print(f"⚠️ worker {i} exited with {p.exitcode}, restarting")
+                # падает в цикле — не крутим перезапуск вхолостую
+                time.sleep(min(30.0, self.restart_delay * failures[i]))
+                if not self._stopping.is_set():
+                    self._inboxes[i] = self._ctx.Queue(maxsize=self._per_worker)
+                    self._spawn(i)
+
+    def _forward(self):
+        while not self._stopping.is_set():
+            try:
+                item = self._events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            kind, src, payload = item
+            if kind == "invalidate":
+                for i, q in enumerate(self._inboxes):
+                    if i != src:
+                        q.put(("invalidate", payload))
+
+    def stop(self, timeout: float = 15.0):
+        """Воркеры дорабатывают свои очереди (стоп-маркер идёт последним) и выходят."""
+        self._stopping.set()
+        for q in self._inboxes:
+            q.put(None)
+        deadline = time.monotonic() + timeout
+        for p in self._procs:
+            if p is not None:
+                p.join(max(0.0, deadline - time.monotonic()))
+        for p in self._procs:
+            if p is not None and p.is_alive():
+                # SIGTERM воркеры игнорируют (останавливает входной процесс)
+                print(f"⚠️ worker {p.name} did not stop in time, killing")
+                p.kill()
+                p.join(2)
+        for t in self._threads:
+            t.join(timeout=1)
+        self._threads = []
+
+
+def poll_updates(token: str, submit, stop: threading.Event, allowed_updates=None, timeout: int = 50):
+    """
+    Long polling без разбора апдейтов: сырые dict'ы уходят в submit(data)
+    (блокирующий — если воркеры не успевают, offset не двигается).
+    """
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = apihelper.get_updates(
+                token, offset=offset, timeout=timeout,
+                allowed_updates=allowed_updates, long_polling_timeout=timeout,
+            )
+        except Exception as e:
+            print(f"⚠️ getUpdates: {e}")
+            stop.wait(3)
+            continue
+        for data in updates:
+            submit(data)
+            offset = data["update_id"] + 1